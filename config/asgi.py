@@ -0,0 +1,11 @@
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.production')
+
+django_application = get_asgi_application()
+
+from hittalaget.conversations.live import LiveMessagesApplication  # noqa: E402
+
+application = LiveMessagesApplication(django_application)
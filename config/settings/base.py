@@ -14,6 +14,28 @@ APPS_DIR = BASE_DIR / 'hittalaget'
 SECRET_KEY = config('SECRET_KEY')
 
 
+# PUBLIC IDS
+# --------------------------------------------------------------------
+# Key of the permutation that turns sequence numbers into the public
+# IDs of teams, ads and ad conversations. It must never change once IDs
+# have been handed out, or new IDs will collide with old ones. The
+# default is for development only: production requires one of its own.
+PUBLIC_ID_KEY = config('PUBLIC_ID_KEY', default='hittalaget')
+
+
+# FILE SERVING
+# --------------------------------------------------------------------
+# How media and static files are served when DEBUG is off: "django",
+# "x-accel-redirect" (nginx) or "x-sendfile" (Apache, lighttpd). See
+# hittalaget/core/files.py. With x-accel-redirect, nginx must serve
+# MEDIA_ROOT at /internal/media/ and STATIC_ROOT at /internal/static/
+# from internal locations.
+FILE_SERVING = config('FILE_SERVING', default='django')
+FILE_SERVING_ACCEL_PREFIX = '/internal/'
+MEDIA_MAX_AGE = 60 * 60 * 24
+STATIC_MAX_AGE = 60 * 60 * 24
+
+
 # APPS
 # --------------------------------------------------------------------
 DJANGO_APPS = [
@@ -23,17 +45,20 @@ DJANGO_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 ]
 THIRD_PARTY_APPS = [
     'django_extensions',
     'debug_toolbar',
 ]
 LOCAL_APPS = [
+    'hittalaget.core.apps.CoreConfig',
     'hittalaget.users.apps.UsersConfig',
     'hittalaget.players.apps.PlayersConfig',
     'hittalaget.teams.apps.TeamsConfig',
     'hittalaget.ads.apps.AdsConfig',
     'hittalaget.conversations.apps.ConversationsConfig',
+    'hittalaget.emails.apps.EmailsConfig',
 ]
 INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
 
@@ -41,17 +66,38 @@ INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
 # MIDDLEWARE
 # --------------------------------------------------------------------
 MIDDLEWARE = [
+    'hittalaget.core.instrumentation.InstrumentationMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'hittalaget.core.db.routers.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'hittalaget.core.sessions.CachedAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 
+# DATABASE REPLICAS
+# --------------------------------------------------------------------
+# Aliases in DATABASES of read-only replicas of "default", which GET
+# requests read from (see hittalaget/core/db/routers.py). A browser
+# that has posted reads from the primary for REPLICA_PIN_SECONDS, and a
+# replica more than REPLICA_MAX_LAG seconds behind is not read from.
+DATABASE_ROUTERS = ['hittalaget.core.db.routers.ReplicaRouter']
+DATABASE_REPLICAS = []
+REPLICA_PIN_SECONDS = config('REPLICA_PIN_SECONDS', default=10, cast=int)
+REPLICA_MAX_LAG = config('REPLICA_MAX_LAG', default=5, cast=float)
+
+
+# METRICS
+# --------------------------------------------------------------------
+# The metrics of the views are at /~metrics/, for staff and for
+# scrapers that send "Authorization: Bearer <METRICS_TOKEN>".
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+
 # URLs
 # --------------------------------------------------------------------
 ROOT_URLCONF = 'config.urls'
@@ -94,7 +140,25 @@ LOGIN_REDIRECT_URL = 'user:redirect'
 LOGOUT_REDIRECT_URL = LOGIN_URL
 
 
+# SESSIONS
+# --------------------------------------------------------------------
+# Set to "hittalaget.core.sessions" to serve sessions and the users of
+# them from a cache in each process (see hittalaget/core/sessions.py).
+# It needs a cache in CACHES that all processes share.
+SESSION_ENGINE = config('SESSION_ENGINE', default='django.contrib.sessions.backends.db')
 
 
-
-
+# EMAIL
+# --------------------------------------------------------------------
+# Emails are put in a queue, and sent with QUEUED_EMAIL_BACKEND by the
+# send_queued_email command. A failed email is tried again after
+# EMAIL_RETRY_DELAY seconds, twice as long after each failed attempt.
+EMAIL_BACKEND = 'hittalaget.emails.backends.QueuedEmailBackend'
+QUEUED_EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_MAX_ATTEMPTS = 6
+EMAIL_RETRY_DELAY = 60
+# New messages are told about in one email per user, at most once every
+# EMAIL_DIGEST_DELAY seconds.
+EMAIL_DIGEST_DELAY = 60 * 15
+DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='noreply@hittalaget.se')
+SITE_URL = config('SITE_URL', default='http://localhost:8000')
@@ -18,7 +18,7 @@ INTERNAL_IPS = [
 # --------------------------------------------------------------------
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'hittalaget.core.db.postgresql',
         'NAME': 'postgres',
         'USER': 'postgres',
         'PASSWORD': '',
@@ -26,6 +26,14 @@ DATABASES = {
         'PORT': '5432',
     }
 }
+# To try the replica router, set DB_REPLICA_NAME to a second database on
+# the same server, made with CREATE DATABASE <name> TEMPLATE postgres.
+# Nothing keeps it in sync, so pages show the rows as they were copied.
+if config('DB_REPLICA_NAME', default=''):
+    DATABASES['replica'] = dict(
+        DATABASES['default'], NAME=config('DB_REPLICA_NAME'), TEST={'MIRROR': 'default'},
+    )
+    DATABASE_REPLICAS = ['replica']
 
 
 # STATIC FILES (CSS, JS, IMAGES)
@@ -45,7 +53,7 @@ MEDIA_URL = '/media/'
 
 # EMAIL
 # --------------------------------------------------------------------
-EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
+QUEUED_EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 
 
 
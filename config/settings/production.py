@@ -1,5 +1,5 @@
 from .base import *
-from decouple import config
+from decouple import Csv, config
 
 
 # GENERAL
@@ -12,16 +12,54 @@ ALLOWED_HOSTS = [
 ]
 
 
+# PUBLIC IDS
+# --------------------------------------------------------------------
+# No default: with the key of base.py, which is in the source, anyone
+# could tell the order and number of the teams and ads from their IDs.
+PUBLIC_ID_KEY = config('PUBLIC_ID_KEY')
+
+
 # DATABASES
 # --------------------------------------------------------------------
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'hittalaget.core.db.postgresql',
         'NAME': config('DB_NAME'),
         'USER': config('DB_USER'),
         'PASSWORD': config('DB_PASSWORD'),
         'HOST': config('DB_HOST'),
         'PORT': config('DB_PORT'),
+        # The connections of each process (see hittalaget/core/db/pool.py).
+        # MAX_SIZE times the number of processes must stay below the
+        # max_connections of Postgres.
+        'POOL': {
+            'MIN_SIZE': config('DB_POOL_MIN_SIZE', default=1, cast=int),
+            'MAX_SIZE': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+            'TIMEOUT': config('DB_POOL_TIMEOUT', default=2, cast=float),
+        },
+    }
+}
+# The hosts of the replicas of the database, separated by commas.
+for i, host in enumerate(config('DB_REPLICA_HOSTS', default='', cast=Csv())):
+    DATABASES['replica_{}'.format(i + 1)] = dict(
+        DATABASES['default'], HOST=host, TEST={'MIRROR': 'default'},
+    )
+    DATABASE_REPLICAS.append('replica_{}'.format(i + 1))
+
+
+# CACHES
+# --------------------------------------------------------------------
+# The cached objects, pages, reference data and sessions are made stale
+# through version tokens in the cache (see hittalaget/core/object_cache.py),
+# so every process must use the same cache. On a single server without
+# memcached, the file based cache works too, with CACHE_BACKEND set to
+# django.core.cache.backends.filebased.FileBasedCache and CACHE_LOCATION
+# to a directory that all processes can write to.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.memcached.MemcachedCache'),
+        'LOCATION': config('CACHE_LOCATION', default='127.0.0.1:11211'),
+        'KEY_FUNCTION': 'hittalaget.core.object_cache.make_cache_key',
     }
 }
 
@@ -59,9 +97,11 @@ MEDIA_ROOT = BASE_DIR / "hittalaget" / "media"
 MEDIA_URL = '/media/'
 
 
-
-
-
-
-
-
+# EMAIL
+# --------------------------------------------------------------------
+EMAIL_HOST = config('EMAIL_HOST', default='localhost')
+EMAIL_PORT = config('EMAIL_PORT', default=25, cast=int)
+EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
+EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
+EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=False, cast=bool)
+EMAIL_TIMEOUT = 30
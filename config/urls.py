@@ -12,6 +12,8 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import TemplateView
+from hittalaget.core.files import file_urlpatterns
+from hittalaget.core.instrumentation import metrics_view
 from hittalaget.users.forms import SetPasswordForm2
 
 
@@ -25,6 +27,8 @@ urlpatterns = [
     path('annonser/', include('hittalaget.ads.urls', namespace='ad')),
     path('konversationer/', include('hittalaget.conversations.urls', namespace='conversation')),
     
+    path('~metrics/', metrics_view, name="metrics"),
+
     path('reset-password/', PasswordResetView.as_view(from_email="test@test.com"), name="password_reset"),
     path('reset-password/email-sent/', PasswordResetDoneView.as_view(), name="password_reset_done"),
     path('reset-password/<uidb64>/<token>/', PasswordResetConfirmView.as_view(form_class=SetPasswordForm2), name="password_reset_confirm"),
@@ -32,7 +36,7 @@ urlpatterns = [
 
     path('', TemplateView.as_view(template_name="pages/index.html"), name="index"),
     path('', include('hittalaget.users.urls', namespace="user")),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT) + file_urlpatterns()
 
 if settings.DEBUG:
   import debug_toolbar
@@ -1,36 +0,0 @@
-#   ---------------------------------------   #
-#   ~~~~~~~~~   FOOTBALL CHOICES   ~~~~~~~~   #            
-#   ---------------------------------------   #
-
-football_min_experience = [
-    ("ungdomsfotboll", "Ungdomsfotboll"),
-    ("korpen", "Korpen"),
-    ("division 8", "Division 8"),
-    ("division 7", "Division 7"),
-    ("division 6", "Division 6"),
-    ("division 5", "Division 5"),
-    ("division 4", "Division 4"),
-    ("division 3", "Division 3"),
-    ("division 2", "Division 2"),
-    ("division 1", "Division 1"),
-    ("superettan", "Superettan"),
-    ("allsvenskan", "Allsvenskan"),
-]
-
-football_special_ability = [
-    ("ingen speciell", "Ingen speciell"),
-    ("snabb", "Snabb"),
-    ("uthållig", "Uthållig"),
-    ("allround", "Allround"),
-    ("positionering", "Positionering"),
-    ("huvudspel", "Huvudspel"),
-    ("ledargestalt", "Ledargestalt"),
-    ("snabba reflexer", "Snabba reflexer"),
-    ("skott", "Skott"),
-    ("spelförståelse", "Spelförståelse"),
-    ("inlägg", "Inlägg"),
-    ("långbollar", "Långbollar"),
-    ("frisparkar", "Frisparkar"),
-    ("dribbla", "Dribbla"),
-    ("tackla", "Tackla"),
-]
\ No newline at end of file
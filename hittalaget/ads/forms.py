@@ -2,46 +2,27 @@ from django import forms
 from django.core.exceptions import ValidationError
 from django.http import Http404
 from .models import Ad
-from .form_choices import (
-    football_min_experience,
-    football_special_ability,
+from hittalaget.core.reference import (
+    SportForm,
+    get_choices,
+    get_positions,
+    set_reference_choices,
 )
-from hittalaget.players.models import Position
 import datetime
 
 
-class SportForm(forms.Form):
-
-    SPORTS = [
-        ("fotboll", "Fotboll"),
-    ]
-
-    sport = forms.CharField(
-        max_length=255,
-        label="Välj en sport",
-        widget=forms.Select(choices=SPORTS)
-    )
-
-
 class AdForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         self.sport = kwargs.pop('sport')
         super().__init__(*args, **kwargs)
 
-        self.fields['position'].queryset = Position.objects.filter(sport=self.sport)
-
-        min_experience = {
-            "fotboll": football_min_experience,
-        }
-        special_ability = {
-            "fotboll": football_special_ability,
-        }
+        set_reference_choices(self, 'position', get_positions(self.sport))
 
         ''' Potential KeyError caused by an invalid sport should be caught
         by the view before even reaching the form. '''
-        self.fields['min_experience'].widget = forms.Select(choices=min_experience[self.sport])
-        self.fields['special_ability'].widget = forms.Select(choices=special_ability[self.sport])
+        self.fields['min_experience'].widget = forms.Select(choices=get_choices(self.sport, "experience"))
+        self.fields['special_ability'].widget = forms.Select(choices=get_choices(self.sport, "special_ability"))
         
         
     class Meta:
@@ -0,0 +1,262 @@
+''' Rank the available players that fit an ad.
+
+The requirements of an ad that are stated as limits (position, max age,
+min height and min experience) are hard constraints and are applied in
+SQL, using the same indexed filters as the player search. The players
+that pass are then scored in batches with NumPy on how well they fit:
+whether they have the special ability asked for, and how far above
+the requirements they are.
+
+The ranking of an ad is cached. It is dropped when the ad changes, and
+it goes stale when any player with the ad's position changes, since
+only those players can match it. The version tokens of the positions
+are in the cache that all processes share (see object_cache.py).
+
+Every match is also stored as an AdMatch, which the "ads for you" feed
+of the players reads from. Background jobs update them once the change
+is committed: the matches of an ad when the ad is saved, and the
+matches of a player when the player, its positions or the user fields
+copied onto it change. '''
+
+import uuid
+
+import numpy as np
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+from hittalaget.players.models import Player
+from hittalaget.core.jobs import job
+from hittalaget.core.reference import get_values
+from hittalaget.players.search import filter_players
+
+
+MATCH_LIMIT = 50
+BATCH_SIZE = 5000
+MATCH_CACHE_TIMEOUT = 60 * 60 * 24
+
+WEIGHTS = {
+    "special_ability": 0.5,
+    "experience": 0.3,
+    "height": 0.1,
+    "age": 0.1,
+}
+
+''' A player this many cm above the min height, or years below the max
+age, gets the full score for that criterion. '''
+HEIGHT_RANGE = 20
+AGE_RANGE = 10
+
+
+def get_candidates(ad):
+    ''' Return the available players that meet the hard requirements of
+    the ad. '''
+    levels = get_values(ad.sport, "experience")
+    queryset = Player.objects.filter(sport=ad.sport, is_available=True)
+    queryset = filter_players(queryset, {
+        "position": ad.position_id,
+        "max_age": ad.max_age,
+        "min_height": ad.min_height,
+    })
+    if ad.min_experience in levels:
+        queryset = queryset.filter(experience__in=levels[levels.index(ad.min_experience):])
+    return queryset
+
+
+def score_batch(ad, experiences, abilities, heights, birth_years):
+    ''' Score a batch of candidates between 0 and 1. The arguments are
+    arrays with one element per candidate. '''
+    levels = get_values(ad.sport, "experience")
+    min_level = levels.index(ad.min_experience) if ad.min_experience in levels else 0
+    top_level = max(len(levels) - 1 - min_level, 1)
+    current_year = timezone.now().year
+
+    ability = (abilities == ad.special_ability).astype(float)
+    experience = np.clip((experiences - min_level) / top_level, 0, 1)
+    height = np.clip((heights - ad.min_height) / HEIGHT_RANGE, 0, 1)
+    age = np.clip((ad.max_age - (current_year - birth_years)) / AGE_RANGE, 0, 1)
+
+    return (
+        WEIGHTS["special_ability"] * ability
+        + WEIGHTS["experience"] * experience
+        + WEIGHTS["height"] * height
+        + WEIGHTS["age"] * age
+    )
+
+
+def iter_scored(ad, batch_size=BATCH_SIZE):
+    ''' Yield (player_ids, scores) arrays for every candidate of the ad,
+    one batch at a time. '''
+    ranks = {level: i for i, level in enumerate(get_values(ad.sport, "experience"))}
+    candidates = get_candidates(ad).order_by('id')
+    last_id = 0
+
+    while True:
+        rows = list(candidates.filter(id__gt=last_id).values_list(
+            'id', 'experience', 'special_ability', 'height', 'birthday'
+        )[:batch_size])
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        ids = np.array([row[0] for row in rows])
+        scores = score_batch(
+            ad,
+            experiences=np.array([ranks.get(row[1], 0) for row in rows]),
+            abilities=np.array([row[2] for row in rows]),
+            heights=np.array([row[3] for row in rows]),
+            birth_years=np.array([row[4].year for row in rows]),
+        )
+        yield ids, scores
+
+
+def rank_players(ad, limit=MATCH_LIMIT):
+    ''' Return the best `limit` candidates as [(player_id, score)], best
+    first. Only the running top list is kept between batches. '''
+    best_ids = np.array([], dtype=np.int64)
+    best_scores = np.array([], dtype=float)
+
+    for ids, scores in iter_scored(ad):
+        best_ids = np.concatenate([best_ids, ids])
+        best_scores = np.concatenate([best_scores, scores])
+
+        ''' Highest score first, and the newest profile first on a tie. '''
+        order = np.lexsort((-best_ids, -best_scores))[:limit]
+        best_ids, best_scores = best_ids[order], best_scores[order]
+
+    return [(int(i), round(float(score), 3)) for i, score in zip(best_ids, best_scores)]
+
+
+# ---------------------------------- #
+# ------------- CACHING ------------ #
+# ---------------------------------- #
+
+
+def _ad_key(ad_pk):
+    return "ads:matches:{}".format(ad_pk)
+
+
+def _position_key(position_id):
+    return "ads:matches:position:{}".format(position_id)
+
+
+def invalidate_ad(ad_pk):
+    cache.delete(_ad_key(ad_pk))
+
+
+def invalidate_positions(position_ids):
+    ''' Mark the rankings of every ad with one of the positions as stale. '''
+    cache.set_many({_position_key(pk): uuid.uuid4().hex for pk in position_ids}, None)
+
+
+def get_matches(ad, limit=MATCH_LIMIT):
+    ''' Return [(player, score)] for the ad, using the cached ranking
+    when it is still valid. '''
+    position_key = _position_key(ad.position_id)
+    version = cache.get(position_key)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(position_key, version, None)
+
+    cached = cache.get(_ad_key(ad.pk))
+    if cached is not None and cached["version"] == version:
+        ranking = cached["ranking"]
+    else:
+        ranking = rank_players(ad, limit)
+        cache.set(_ad_key(ad.pk), {"version": version, "ranking": ranking}, MATCH_CACHE_TIMEOUT)
+
+    players = Player.objects.in_bulk([player_id for player_id, score in ranking])
+    return [(players[player_id], score) for player_id, score in ranking if player_id in players]
+
+
+# ---------------------------------- #
+# ---------- MATCH ENTRIES --------- #
+# ---------------------------------- #
+
+
+def _upsert_matches(ad_ids, player_ids, scores, refreshed):
+    from .models import AdMatch
+
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO {matches} (ad_id, player_id, score, created, updated)
+            SELECT ad_id, player_id, score, %(now)s, %(now)s
+            FROM unnest(%(ads)s::int[], %(players)s::int[], %(scores)s::float8[]) AS m (ad_id, player_id, score)
+            ON CONFLICT (ad_id, player_id)
+            DO UPDATE SET score = EXCLUDED.score, updated = EXCLUDED.updated
+        """.format(matches=AdMatch._meta.db_table), {
+            "ads": [int(i) for i in ad_ids],
+            "players": [int(i) for i in player_ids],
+            "scores": [round(float(score), 3) for score in scores],
+            "now": refreshed,
+        })
+
+
+@job("ads.refresh_ad_matches", priority=10)
+def refresh_ad_matches(ad_pk, batch_size=BATCH_SIZE):
+    ''' Store every player that fits the ad as an AdMatch, and remove
+    the matches of players that no longer fit. Players that already
+    matched keep their entry, so it does not show up as new again. '''
+    from .models import Ad, AdMatch
+
+    with transaction.atomic():
+        ''' Locking the ad keeps two refreshes of it from interleaving. '''
+        ad = Ad.objects.select_for_update().filter(pk=ad_pk).first()
+        if ad is None:
+            return
+
+        refreshed = timezone.now()
+        for ids, scores in iter_scored(ad, batch_size):
+            _upsert_matches([ad.pk] * len(ids), ids, scores, refreshed)
+
+        AdMatch.objects.filter(ad=ad, updated__lt=refreshed).delete()
+
+
+def get_player_ads(player):
+    ''' Return the ads whose hard requirements the player meets, the
+    same ones as those that have the player among get_candidates(). '''
+    from .models import Ad
+
+    if not player.is_available or player.birthday is None or player.height is None:
+        return Ad.objects.none()
+
+    levels = get_values(player.sport, "experience")
+    higher_levels = levels[levels.index(player.experience) + 1:] if player.experience in levels else levels
+    return Ad.objects.filter(
+        sport=player.sport,
+        position__in=player.positions.all(),
+        max_age__gte=timezone.now().year - player.birthday.year,
+        min_height__lte=player.height,
+    ).exclude(min_experience__in=higher_levels)
+
+
+@job("ads.refresh_player_matches", priority=10)
+def refresh_player_matches(player_pk):
+    ''' Store every ad that the player fits as an AdMatch, and remove
+    the matches of ads that it no longer fits. Like refresh_ad_matches(),
+    matches that are still there keep their entry. '''
+    from .models import AdMatch
+
+    with transaction.atomic():
+        ''' Locking the player keeps two refreshes of it from
+        interleaving. '''
+        player = Player.objects.select_for_update().filter(pk=player_pk).first()
+        if player is None:
+            return
+
+        ranks = {level: i for i, level in enumerate(get_values(player.sport, "experience"))}
+        ads = list(get_player_ads(player))
+        scores = [
+            score_batch(
+                ad,
+                experiences=np.array([ranks.get(player.experience, 0)]),
+                abilities=np.array([player.special_ability]),
+                heights=np.array([player.height]),
+                birth_years=np.array([player.birthday.year]),
+            )[0]
+            for ad in ads
+        ]
+
+        refreshed = timezone.now()
+        _upsert_matches([ad.pk for ad in ads], [player.pk] * len(ads), scores, refreshed)
+        AdMatch.objects.filter(player=player, updated__lt=refreshed).delete()
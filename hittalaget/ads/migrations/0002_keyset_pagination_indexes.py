@@ -0,0 +1,17 @@
+# Generated by Django 3.0 on 2026-10-17 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(fields=['sport', '-id'], name='ads_ad_sport_416c6c_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.0 on 2026-10-17 18:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('players', '0003_player_search_facets'),
+        ('ads', '0002_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdMatch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('ad', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='matches', to='ads.ad')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ad_matches', to='players.player')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='admatch',
+            index=models.Index(fields=['player', '-id'], name='ads_admatch_player__3368b1_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='admatch',
+            constraint=models.UniqueConstraint(fields=('ad', 'player'), name='unique_ad_match'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.0 on 2026-10-17 18:55
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0003_admatch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ad',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(
+            sql="""
+                UPDATE ads_ad
+                SET search_vector =
+                    setweight(to_tsvector('swedish'::regconfig, coalesce(title, '')), 'A')
+                    || setweight(to_tsvector('swedish'::regconfig, coalesce(description, '')), 'B')
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='ad',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='ads_ad_search__865551_gin'),
+        ),
+    ]
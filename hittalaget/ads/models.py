@@ -1,9 +1,17 @@
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.db import models
-from django.db.models.signals import pre_save
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
 from django.utils.text import slugify
 from django.urls import reverse
-from hittalaget.players.models import Position
+from hittalaget.players.models import USER_PROFILE_FIELDS, Player, Position
 from hittalaget.teams.models import Team
+from hittalaget.core.jobs import enqueue
+from hittalaget.core.object_cache import bump
+from hittalaget.core.public_ids import allocate_public_id
+from hittalaget.core.search import SEARCH_CONFIG, update_search_vector
+from .matching import invalidate_ad, invalidate_positions
 
 
 class Ad(models.Model):
@@ -18,11 +26,14 @@ class Ad(models.Model):
     position = models.ForeignKey(Position, on_delete=models.CASCADE, related_name="ads")
     min_experience = models.CharField(max_length=255, verbose_name="erfarenhet")
     special_ability = models.CharField(max_length=255, verbose_name="spetsegenskap")
+    search_vector = SearchVectorField(null=True, editable=False)
 
 
     class Meta:
         indexes = [
             models.Index(fields=['ad_id',]),
+            models.Index(fields=['sport', '-id']),
+            GinIndex(fields=['search_vector']),
         ]
 
     
@@ -32,6 +43,31 @@ class Ad(models.Model):
     def __str__(self):
         return self.title
 
+    @staticmethod
+    def make_cache_name(ad_id):
+        ''' The name the ad is cached under in the object cache. '''
+        return "ad:{}".format(ad_id)
+
+
+class AdMatch(models.Model):
+    ''' An available player that fits an ad. Kept up to date by jobs
+    when ads, players, their positions or the user fields copied onto them
+    change (see matching.py), so that the "ads for you" feed of a player
+    is an indexed read. '''
+    ad = models.ForeignKey(Ad, on_delete=models.CASCADE, related_name="matches")
+    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name="ad_matches")
+    score = models.FloatField()
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ad', 'player'], name="unique_ad_match"),
+        ]
+        indexes = [
+            models.Index(fields=['player', '-id']),
+        ]
+
 
 def pre_save_title(sender, instance, **kwargs):
     instance.title = "{} söker {}".format(
@@ -43,15 +79,97 @@ def pre_save_slug(sender, instance, **kwargs):
     instance.slug = slugify(instance.title)
 
 def pre_save_ad_id(sender, instance, **kwargs):
-    from random import randint
-    rand_id = randint(100000, 999999)
-    
-    if not instance.ad_id: 
-        while Ad.objects.filter(ad_id=rand_id).exists():
-            rand_id = randint(100000, 999999)
-        else:
-            instance.ad_id = rand_id
-    
+    if not instance.ad_id:
+        instance.ad_id = allocate_public_id("ad")
+
+
+AD_SEARCH_VECTOR = (
+    SearchVector('title', weight='A', config=SEARCH_CONFIG)
+    + SearchVector('description', weight='B', config=SEARCH_CONFIG)
+)
+
+def post_save_search_vector(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not set(update_fields) & {'title', 'description'}:
+        return
+    update_search_vector(instance, AD_SEARCH_VECTOR)
+
+
+def ad_changed_bump_cache(sender, instance, **kwargs):
+    bump(Ad.make_cache_name(instance.ad_id))
+
+def ad_changed_invalidate_matches(sender, instance, **kwargs):
+    invalidate_ad(instance.pk)
+
+def ad_saved_refresh_matches(sender, instance, **kwargs):
+    ''' An ad can match tens of thousands of players, so the matches are
+    stored by a background job, once the ad has been committed. '''
+    enqueue("ads.refresh_ad_matches", args=[instance.pk])
+
+def player_changed_invalidate_matches(sender, instance, update_fields=None, **kwargs):
+    ''' A player can only match the ads of its own positions. Its image
+    renditions play no part in matching. '''
+    if update_fields is not None and set(update_fields) <= {'image_renditions'}:
+        return
+    invalidate_positions(instance.positions.values_list('pk', flat=True))
+
+def positions_changed_invalidate_matches(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        ''' Players were added to or removed from the position. '''
+        if action in ("post_add", "post_remove", "post_clear"):
+            invalidate_positions([instance.pk])
+    elif action in ("post_add", "post_remove"):
+        invalidate_positions(pk_set)
+    elif action == "pre_clear":
+        invalidate_positions(instance.positions.values_list('pk', flat=True))
+
+def player_saved_refresh_matches(sender, instance, created, update_fields=None, **kwargs):
+    ''' A new player has no positions yet, and is refreshed when they are
+    added. '''
+    if created or (update_fields is not None and set(update_fields) <= {'image_renditions'}):
+        return
+    enqueue("ads.refresh_player_matches", args=[instance.pk])
+
+def positions_changed_refresh_matches(sender, instance, action, reverse, pk_set, **kwargs):
+    ''' The jobs run after the commit, so the players of a position that
+    is cleared are looked up before it. '''
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        player_ids = [instance.pk]
+    elif action == "pre_clear":
+        player_ids = list(instance.players.values_list('pk', flat=True))
+    else:
+        player_ids = pk_set
+    for player_id in player_ids:
+        enqueue("ads.refresh_player_matches", args=[player_id])
+
+def user_changed_refresh_matches(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields is not None and not set(update_fields) & USER_PROFILE_FIELDS):
+        return
+    for player_id in Player.objects.filter(user=instance).values_list('pk', flat=True):
+        enqueue("ads.refresh_player_matches", args=[player_id])
+
+def user_changed_invalidate_matches(sender, instance, update_fields=None, **kwargs):
+    ''' Age and height of the players are copied from the user. '''
+    if update_fields is not None and not set(update_fields) & USER_PROFILE_FIELDS:
+        return
+    invalidate_positions(Player.positions.through.objects.filter(
+        player__user=instance
+    ).values_list('position_id', flat=True).distinct())
+
 pre_save.connect(pre_save_title, sender=Ad)
 pre_save.connect(pre_save_slug, sender=Ad)
-pre_save.connect(pre_save_ad_id, sender=Ad)
\ No newline at end of file
+pre_save.connect(pre_save_ad_id, sender=Ad)
+post_save.connect(post_save_search_vector, sender=Ad)
+post_save.connect(ad_changed_bump_cache, sender=Ad)
+post_delete.connect(ad_changed_bump_cache, sender=Ad)
+post_save.connect(ad_changed_invalidate_matches, sender=Ad)
+post_delete.connect(ad_changed_invalidate_matches, sender=Ad)
+post_save.connect(ad_saved_refresh_matches, sender=Ad)
+post_save.connect(player_changed_invalidate_matches, sender=Player)
+pre_delete.connect(player_changed_invalidate_matches, sender=Player)
+m2m_changed.connect(positions_changed_invalidate_matches, sender=Player.positions.through)
+post_save.connect(user_changed_invalidate_matches, sender=settings.AUTH_USER_MODEL)
+post_save.connect(player_saved_refresh_matches, sender=Player)
+m2m_changed.connect(positions_changed_refresh_matches, sender=Player.positions.through)
+post_save.connect(user_changed_refresh_matches, sender=settings.AUTH_USER_MODEL)
\ No newline at end of file
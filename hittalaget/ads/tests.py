@@ -1,3 +1,202 @@
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
 
-# Create your tests here.
+from hittalaget.core.jobs import run_next_job
+from hittalaget.core.testing import make_ad, make_player, make_team, make_user
+from hittalaget.players.models import Player, Position
+from . import matching
+from .models import AdMatch
+
+
+def make_candidate(username, position, height=185, age=22, **kwargs):
+    now = timezone.now()
+    user = make_user(username, height=height, birthday=now.replace(year=now.year - age))
+    return make_player(user, positions=[position], **kwargs)
+
+
+def run_jobs():
+    while run_next_job() is not None:
+        pass
+
+
+# --------------------------------- #
+# ------------ MATCHING ----------- #
+# --------------------------------- #
+
+
+class MatchingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.back = Position.objects.create(sport="fotboll", name="back")
+        self.forward = Position.objects.create(sport="fotboll", name="forward")
+        self.owner = make_user("owner")
+        self.ad = make_ad(
+            make_team(self.owner, name="FC X"), self.back,
+            max_age=30, min_height=175, min_experience="division 4", special_ability="snabb",
+        )
+
+    def get_usernames(self):
+        return [player.username for player, score in matching.get_matches(self.ad)]
+
+    def test_hard_requirements(self):
+        make_candidate("passar", self.back, experience="division 4")
+        make_candidate("kort", self.back, height=170, experience="allsvenskan")
+        make_candidate("gammal", self.back, age=35, experience="allsvenskan")
+        make_candidate("oerfaren", self.back, experience="korpen")
+        make_candidate("forward", self.forward, experience="allsvenskan")
+        make_candidate("upptagen", self.back, experience="allsvenskan", is_available=False)
+        self.assertEqual(self.get_usernames(), ["passar"])
+
+    def test_best_fit_first(self):
+        make_candidate("ok", self.back, height=176, age=29, experience="division 4", special_ability="skott")
+        make_candidate("bast", self.back, height=195, age=20, experience="allsvenskan")
+        make_candidate("bra", self.back, height=180, age=25, experience="division 3")
+        self.assertEqual(self.get_usernames(), ["bast", "bra", "ok"])
+
+        scores = [score for player, score in matching.get_matches(self.ad)]
+        self.assertEqual(scores[0], 1.0)
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_batches_rank_like_one_batch(self):
+        for i in range(6):
+            make_candidate("spelare{}".format(i), self.back, height=175 + 3 * i, experience="division 4")
+        ranked = matching.rank_players(self.ad)
+        scored = [
+            (int(player_id), round(float(score), 3))
+            for ids, scores in matching.iter_scored(self.ad, batch_size=2)
+            for player_id, score in zip(ids, scores)
+        ]
+        self.assertEqual(ranked, sorted(scored, key=lambda item: (-item[1], -item[0])))
+        self.assertEqual(matching.rank_players(self.ad, limit=2), ranked[:2])
+
+    def test_ranking_is_cached(self):
+        make_candidate("passar", self.back, experience="division 4")
+        self.get_usernames()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get_usernames(), ["passar"])
+        self.assertEqual(len(queries), 1)
+
+    def test_changes_make_the_ranking_stale(self):
+        player = make_candidate("passar", self.back, experience="division 4")
+        forward = make_candidate("forward", self.forward, experience="division 4")
+        self.assertEqual(self.get_usernames(), ["passar"])
+
+        forward.positions.add(self.back)
+        self.assertEqual(self.get_usernames(), ["forward", "passar"])
+
+        player.is_available = False
+        player.save()
+        self.assertEqual(self.get_usernames(), ["forward"])
+
+        forward.user.height = 160
+        forward.user.save()
+        self.assertEqual(self.get_usernames(), [])
+
+        self.ad.min_height = 150
+        self.ad.save()
+        self.assertEqual(self.get_usernames(), ["forward"])
+
+    def test_login_does_not_make_the_ranking_stale(self):
+        player = make_candidate("passar", self.back, experience="division 4")
+        self.get_usernames()
+        player.user.last_login = timezone.now()
+        player.user.save(update_fields=['last_login'])
+        with CaptureQueriesContext(connection) as queries:
+            self.get_usernames()
+        self.assertEqual(len(queries), 1)
+
+
+class AdMatchTests(TestCase):
+    ''' The matches are stored by the jobs that the changes enqueue. '''
+
+    def setUp(self):
+        self.back = Position.objects.create(sport="fotboll", name="back")
+        self.forward = Position.objects.create(sport="fotboll", name="forward")
+        self.team = make_team(make_user("owner"), name="FC X")
+        self.player = make_candidate("kalle", self.back, experience="division 4")
+        self.ad = make_ad(self.team, self.back, max_age=30, min_height=175, min_experience="division 4")
+        run_jobs()
+
+    def get_ads(self, player=None):
+        return set(AdMatch.objects.filter(player=player or self.player).values_list('ad__ad_id', flat=True))
+
+    def test_new_ad_gets_its_players(self):
+        self.assertEqual(self.get_ads(), {self.ad.ad_id})
+
+    def test_refresh_keeps_existing_entries(self):
+        match = AdMatch.objects.get()
+        self.ad.description = "Ny beskrivning."
+        self.ad.save()
+        run_jobs()
+        self.assertEqual(AdMatch.objects.get().created, match.created)
+
+    def test_edited_ad_drops_players_that_no_longer_fit(self):
+        self.ad.min_height = 190
+        self.ad.save()
+        run_jobs()
+        self.assertEqual(self.get_ads(), set())
+
+    def test_unavailable_player_loses_its_matches(self):
+        self.player.is_available = False
+        self.player.save()
+        run_jobs()
+        self.assertEqual(self.get_ads(), set())
+
+    def test_newly_available_player_gets_existing_ads(self):
+        player = make_candidate("lisa", self.back, experience="allsvenskan", is_available=False)
+        run_jobs()
+        self.assertEqual(self.get_ads(player), set())
+
+        player.is_available = True
+        player.save()
+        run_jobs()
+        self.assertEqual(self.get_ads(player), {self.ad.ad_id})
+
+    def test_positions_change_the_matches(self):
+        forward_ad = make_ad(self.team, self.forward, max_age=30, min_height=175, min_experience="korpen")
+        run_jobs()
+        self.assertEqual(self.get_ads(), {self.ad.ad_id})
+
+        self.player.positions.add(self.forward)
+        run_jobs()
+        self.assertEqual(self.get_ads(), {self.ad.ad_id, forward_ad.ad_id})
+
+        self.player.positions.remove(self.back)
+        run_jobs()
+        self.assertEqual(self.get_ads(), {forward_ad.ad_id})
+
+        self.forward.players.clear()
+        run_jobs()
+        self.assertEqual(self.get_ads(), set())
+
+    def test_user_fields_change_the_matches(self):
+        user = self.player.user
+        user.height = 170
+        user.save()
+        run_jobs()
+        self.assertEqual(self.get_ads(), set())
+
+    def test_player_side_agrees_with_ad_side(self):
+        for i, experience in enumerate(["korpen", "division 4", "allsvenskan"]):
+            for age in (25, 30, 31):
+                make_candidate("spelare{}-{}".format(i, age), self.back, age=age, height=170 + 5 * i, experience=experience)
+        run_jobs()
+        AdMatch.objects.all().delete()
+        matching.refresh_ad_matches(self.ad.pk)
+        from_ads = set(AdMatch.objects.values_list('ad', 'player', 'score'))
+        self.assertEqual(len(from_ads), 5)
+
+        AdMatch.objects.all().delete()
+        for player in Player.objects.all():
+            matching.refresh_player_matches(player.pk)
+        self.assertEqual(set(AdMatch.objects.values_list('ad', 'player', 'score')), from_ads)
+
+    def test_feed(self):
+        self.client.force_login(self.player.user)
+        response = self.client.get(reverse("player:ad_feed", kwargs={"sport": "fotboll"}))
+        self.assertContains(response, self.ad.title)
@@ -14,13 +14,16 @@ from django.views.generic import (
 )
 from .models import Ad
 from .forms import SportForm, AdForm
+from .matching import get_matches
 from hittalaget.conversations.forms import AdMessageForm
+from hittalaget.core.object_cache import get_cached_object
+from hittalaget.core.page_cache import AnonymousPageCacheMixin
+from hittalaget.core.reference import is_sport
+from hittalaget.core.pagination import KeysetPaginationMixin
+from hittalaget.core.search import TextSearchMixin
 from hittalaget.teams.models import Team
 
 
-VALID_SPORTS = ["fotboll"]
-
-
 class AdInitiateCreateView(FormView):
     template_name = "ads/initiate_create.html"
     form_class = SportForm
@@ -37,23 +40,36 @@ class AdDetailView(DetailView):
         ''' Return ad if it exist else raise 404. '''
         if not hasattr(self, 'object'):
             ad_id = self.kwargs['ad_id']
-            self.object = get_object_or_404(Ad.objects.select_related('team__user', 'position'), ad_id=ad_id) 
+            self.object = get_cached_object(
+                Ad.make_cache_name(ad_id),
+                lambda: get_object_or_404(Ad.objects.select_related('team__user', 'position'), ad_id=ad_id),
+                lambda ad: [
+                    Team.make_cache_name(ad.team.team_id),
+                    "user:{}".format(ad.team.user_id),
+                    "positions",
+                ],
+            )
             
         return self.object
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        ad = self.get_object()
         context['form'] = AdMessageForm
+
+        ''' Show the owner of the ad the players that fit it best. '''
+        if ad.team.user == self.request.user:
+            context['matches'] = get_matches(ad)
         return context
     
 
-class AdListView(ListView):
+class AdListView(AnonymousPageCacheMixin, TextSearchMixin, KeysetPaginationMixin, ListView):
     template_name = "ads/list.html"
 
     def dispatch(self, request, *args, **kwargs):
         ''' Raise 404 if invalid sport. '''
         sport = kwargs['sport']
-        if sport not in VALID_SPORTS:
+        if not is_sport(sport):
             raise Http404()
         else:
             return super().dispatch(request, *args, **kwargs)
@@ -61,7 +77,7 @@ class AdListView(ListView):
     def get_queryset(self):
         sport = self.kwargs['sport']
         queryset = Ad.objects.filter(sport=sport)
-        return queryset
+        return self.search_queryset(queryset)
 
 
 class AdCreateView(CreateView):
@@ -81,7 +97,7 @@ class AdCreateView(CreateView):
             return redirect_to_login(request.path, reverse("user:login"))
 
         ''' Redirect if invalid sport. '''
-        if sport not in VALID_SPORTS:
+        if not is_sport(sport):
             raise Http404()
 
         ''' Only users with a team for the sport in question can create an ad. '''
@@ -0,0 +1,107 @@
+''' Who can read and write in a conversation.
+
+The conversation of a URL is fetched together with the requesting
+user's membership, in one query: is_member and user_count are
+subqueries on the users table of the conversation, which are answered
+from its unique (conversation, user) index without loading the users.
+The result is kept on the request, so the dispatch, get_object and
+get_context_data of a view, and the views they inherit from, share it.
+
+A PM conversation is found by the participants key of the two users,
+which is made of their ids in a subquery on the username of the URL, an
+ad conversation by its conversation_id. A user that is not in a PM
+conversation gets a 404, as if it did not exist, while a user that is
+not in an ad conversation gets a 403. '''
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import PermissionDenied
+from django.db.models import CharField, Count, Exists, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Coalesce, Concat, Greatest, Least
+from django.http import Http404
+
+from .models import AdConversation, PmConversation
+
+CONVERSATION_MODELS = {
+    "pm": PmConversation,
+    "ad": AdConversation,
+}
+
+
+def get_queryset(tag, user):
+    ''' The conversations of the tag, annotated with is_member, whether
+    user is one of their users, and user_count. '''
+    model = CONVERSATION_MODELS[tag]
+    through = model.users.through
+    column = model._meta.model_name
+    users = through.objects.filter(**{column: OuterRef('pk')})
+    user_count = users.order_by().values(column).annotate(count=Count('*')).values('count')
+
+    queryset = model.objects.annotate(
+        is_member=Exists(users.filter(user=user.pk)),
+        user_count=Coalesce(Subquery(user_count, output_field=IntegerField()), 0),
+    )
+    if tag == "ad":
+        queryset = queryset.select_related('ad__team__user')
+    return queryset
+
+
+def get_participants_key(user, username):
+    ''' PmConversation.make_participants_key() of user and the user with
+    the username, as a subquery, which is NULL if there is no such user. '''
+    user_ids = [Value(user.pk, output_field=IntegerField()), 'pk']
+    key = Concat(
+        Cast(Least(*user_ids), CharField()), Value(":"), Cast(Greatest(*user_ids), CharField()),
+        output_field=CharField(),
+    )
+    others = get_user_model().objects.filter(username=username).annotate(key=key)
+    return Subquery(others.values('key')[:1])
+
+
+def get_lookup(tag, user, kwargs):
+    ''' The lookup of the conversation in the URL kwargs. '''
+    if tag == "pm":
+        return {"participants_key": get_participants_key(user, kwargs['username'])}
+    return {"conversation_id": kwargs['conversation_id']}
+
+
+def find_conversation(tag, user, kwargs):
+    ''' Return the conversation of the URL kwargs, with is_member and
+    user_count, or None if there is none. '''
+    return get_queryset(tag, user).filter(**get_lookup(tag, user, kwargs)).first()
+
+
+def get_conversation(request, tag, kwargs):
+    ''' find_conversation() for the user of the request, once per
+    request. '''
+    if not hasattr(request, 'conversations'):
+        request.conversations = {}
+    key = (tag,) + tuple(sorted(kwargs.items()))
+    if key not in request.conversations:
+        request.conversations[key] = find_conversation(tag, request.user, kwargs)
+    return request.conversations[key]
+
+
+# --------------------------------- #
+# ------------- MIXINS ------------ #
+# --------------------------------- #
+
+
+class ConversationAccessMixin:
+    ''' get_conversation() returns the conversation of the URL if the
+    user is in it, and raises a 404 or 403 otherwise. '''
+    conversation_tag = None
+
+    def find_conversation(self):
+        ''' The conversation of the URL whether or not the user is in
+        it, or None. '''
+        return get_conversation(self.request, self.conversation_tag, self.kwargs)
+
+    def get_conversation(self):
+        conversation = self.find_conversation()
+        if conversation is None:
+            raise Http404()
+        if not conversation.is_member:
+            if self.conversation_tag == "pm":
+                raise Http404()
+            raise PermissionDenied()
+        return conversation
@@ -0,0 +1,407 @@
+''' Live updates of a conversation, streamed to the browser as
+server-sent events by the ASGI application in config/asgi.py.
+
+A new message is announced with NOTIFY when it is committed (see
+record_message). Each process has one MessageHub with one database
+connection that LISTENs for these notifications, and it is woken up by
+the event loop when one arrives, so nothing polls the messages tables.
+The hub loads and renders each new message once, with the same template
+as the detail page, and hands it to every stream of the conversation.
+
+An open stream is only a coroutine and a queue, so a process can hold
+thousands of them. The database is only used when a stream opens, to
+check who the user is and that they are in the conversation, and when
+it closes, to mark what was shown as read. That work runs in a few
+threads of its own, like any other sync code.
+
+The browser reconnects by itself if a stream is closed, and sends the
+id of the last message it got in Last-Event-ID. The messages after it
+are sent first, so nothing is lost while it was away. '''
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+
+import psycopg2
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.template.loader import render_to_string
+from django.urls import Resolver404, resolve
+from hittalaget.core.sessions import get_user
+
+from .access import find_conversation
+from .models import (
+    MESSAGE_CHANNEL,
+    AdMessage,
+    PmMessage,
+    mark_as_read,
+    parse_notification,
+)
+
+logger = logging.getLogger(__name__)
+
+LIVE_KEEPALIVE = 30
+LIVE_RETRY = 3000
+LIVE_CATCH_UP = 50
+LIVE_QUEUE_SIZE = 100
+LIVE_THREADS = 4
+
+''' The URLs of the streams, and the tag of their conversations. '''
+LIVE_URL_NAMES = {
+    "conversation:live": "pm",
+    "conversation:live_ad": "ad",
+}
+
+MESSAGE_MODELS = {
+    "pm": PmMessage,
+    "ad": AdMessage,
+}
+
+MESSAGE_TEMPLATES = {
+    "pm": "conversations/messages_pm.html",
+    "ad": "conversations/messages_ad.html",
+}
+
+_executor = ThreadPoolExecutor(max_workers=LIVE_THREADS, thread_name_prefix="live")
+
+
+def _call(func, args):
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+async def run_sync(func, *args):
+    ''' Run sync code, like queries, without blocking the event loop. '''
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(_executor, _call, func, args)
+
+
+# ---------------------------------- #
+# ------------ SYNC PART ----------- #
+# ---------------------------------- #
+
+
+def get_session_user(cookies):
+    engine = import_module(settings.SESSION_ENGINE)
+    session = engine.SessionStore(cookies.get(settings.SESSION_COOKIE_NAME))
+    return get_user(SimpleNamespace(session=session))
+
+
+def get_conversation(cookies, tag, kwargs):
+    ''' Return the user and the conversation of a stream, or (user, None)
+    if the user is not in it. The same rules as on the detail pages. '''
+    user = get_session_user(cookies)
+    if not user.is_authenticated:
+        return user, None
+
+    conversation = find_conversation(tag, user, kwargs)
+    if conversation is None or not conversation.is_member:
+        return user, None
+    return user, conversation
+
+
+def render_messages(tag, conversation, messages):
+    return [
+        (message.pk, render_to_string(MESSAGE_TEMPLATES[tag], {
+            "message_list": [message],
+            "object": conversation,
+        }))
+        for message in messages
+    ]
+
+
+def render_new_messages(tag, message_pks):
+    ''' Return {conversation pk: [(message pk, html)]} of the messages. '''
+    messages = MESSAGE_MODELS[tag].objects.select_related('author').filter(pk__in=message_pks)
+    if tag == "ad":
+        messages = messages.select_related('conversation__ad__team__user')
+    rendered = {}
+    for message in messages.order_by('created', 'id'):
+        rendered.setdefault(message.conversation_id, []).extend(
+            render_messages(tag, message.conversation, [message])
+        )
+    return rendered
+
+
+def render_messages_after(tag, conversation, message_pk):
+    ''' The messages a stream missed, up to LIVE_CATCH_UP of the latest. '''
+    messages = conversation.messages.select_related('author').filter(pk__gt=message_pk)
+    messages = list(messages.order_by('-created', '-id')[:LIVE_CATCH_UP])
+    return render_messages(tag, conversation, reversed(messages))
+
+
+def connect_listener():
+    ''' A connection of its own, outside of Django's, that stays open. '''
+    params = connections['default'].get_connection_params()
+    connection = psycopg2.connect(**params)
+    connection.set_session(autocommit=True)
+    with connection.cursor() as cursor:
+        cursor.execute("LISTEN {}".format(MESSAGE_CHANNEL))
+    return connection
+
+
+# ---------------------------------- #
+# -------------- HUB --------------- #
+# ---------------------------------- #
+
+
+class MessageHub:
+    ''' Hands the new messages of the conversations to their streams. '''
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.streams = {}
+        self.connection = None
+        self.started = None
+        self.pending = []
+        self.wakeup = asyncio.Event()
+        self.worker = None
+
+    async def start(self):
+        ''' Connect, unless connected already or connecting. A connection
+        that failed is tried again by the next stream. '''
+        if self.started is None or (self.started.done() and self.started.exception() is not None):
+            self.started = self.loop.create_task(self._connect())
+        await asyncio.shield(self.started)
+
+    async def _connect(self):
+        self.connection = await run_sync(connect_listener)
+        self.loop.add_reader(self.connection.fileno(), self._read)
+        if self.worker is None:
+            self.worker = self.loop.create_task(self._publish())
+
+    def subscribe(self, tag, conversation_pk):
+        queue = asyncio.Queue(LIVE_QUEUE_SIZE)
+        self.streams.setdefault((tag, conversation_pk), set()).add(queue)
+        return queue
+
+    def unsubscribe(self, tag, conversation_pk, queue):
+        queues = self.streams.get((tag, conversation_pk))
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.streams[(tag, conversation_pk)]
+
+    def _read(self):
+        try:
+            self.connection.poll()
+        except psycopg2.Error:
+            logger.exception("Lost the connection that listens for messages.")
+            self._disconnect()
+            return
+
+        while self.connection.notifies:
+            notification = self.connection.notifies.pop(0)
+            try:
+                key = parse_notification(notification.payload)
+            except ValueError:
+                continue
+            if key[:2] in self.streams:
+                self.pending.append(key)
+        if self.pending:
+            self.wakeup.set()
+
+    def _disconnect(self):
+        ''' Notifications sent while there is no connection are lost, so
+        every stream is closed. The browsers reconnect, which connects the
+        hub again, and get what they missed from the database. '''
+        self.loop.remove_reader(self.connection.fileno())
+        try:
+            self.connection.close()
+        except psycopg2.Error:
+            pass
+        self.connection = None
+        self.started = None
+        for queues in self.streams.values():
+            for queue in queues:
+                self._put(queue, None)
+        self.streams = {}
+
+    def _put(self, queue, item):
+        try:
+            queue.put_nowait(item)
+        except asyncio.QueueFull:
+            ''' A stream that can not keep up is closed instead of
+            buffering without end. The browser reconnects and catches up. '''
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+    async def _publish(self):
+        ''' Render the new messages in the order they arrived, a batch at
+        a time, once for all the streams of a conversation. '''
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            pending, self.pending = self.pending, []
+
+            by_tag = {}
+            for tag, conversation_pk, message_pk in pending:
+                by_tag.setdefault(tag, []).append(message_pk)
+            for tag, message_pks in by_tag.items():
+                if tag not in MESSAGE_MODELS:
+                    continue
+                try:
+                    rendered = await run_sync(render_new_messages, tag, message_pks)
+                except Exception:
+                    logger.exception("Could not render the new messages.")
+                    continue
+                for conversation_pk, messages in rendered.items():
+                    for queue in self.streams.get((tag, conversation_pk), ()):
+                        for message in messages:
+                            self._put(queue, message)
+
+
+_hubs = {}
+
+
+def get_hub():
+    loop = asyncio.get_event_loop()
+    if loop not in _hubs:
+        _hubs[loop] = MessageHub(loop)
+    return _hubs[loop]
+
+
+# ---------------------------------- #
+# ------------- STREAM ------------- #
+# ---------------------------------- #
+
+
+def format_event(message_pk, html):
+    lines = ["id: {}".format(message_pk)]
+    lines.extend("data: {}".format(line) for line in html.strip().splitlines())
+    return ("\n".join(lines) + "\n\n").encode()
+
+
+def parse_cookies(scope):
+    cookies = {}
+    for name, value in scope['headers']:
+        if name == b'cookie':
+            for cookie in value.decode('latin-1').split(';'):
+                key, _, val = cookie.strip().partition('=')
+                cookies[key] = val
+    return cookies
+
+
+def get_last_id(scope):
+    ''' The last message the browser has: Last-Event-ID when it
+    reconnects, otherwise ?efter= from the page. '''
+    for name, value in scope['headers']:
+        if name == b'last-event-id' and value.isdigit():
+            return int(value)
+    value = parse_qs(scope['query_string'].decode()).get('efter', [''])[0]
+    return int(value) if value.isdigit() else None
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def send_response(send, status, body=b''):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"text/plain; charset=utf-8")],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def stream_conversation(scope, receive, send, tag, kwargs):
+    user, conversation = await run_sync(get_conversation, parse_cookies(scope), tag, kwargs)
+    if conversation is None:
+        ''' The browser gives up on a stream that is not answered with
+        200, instead of reconnecting. '''
+        await send_response(send, 403 if user.is_authenticated else 401)
+        return
+
+    hub = get_hub()
+    try:
+        await hub.start()
+    except Exception:
+        logger.exception("Could not listen for messages.")
+        await send_response(send, 503)
+        return
+
+    ''' Subscribe before catching up, so no message falls in between. '''
+    queue = hub.subscribe(tag, conversation.pk)
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+    get = None
+    sent = set()
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": "retry: {}\n\n".format(LIVE_RETRY).encode(), "more_body": True})
+
+        last_id = get_last_id(scope)
+        if last_id is not None:
+            for message_pk, html in await run_sync(render_messages_after, tag, conversation, last_id):
+                sent.add(message_pk)
+                await send({"type": "http.response.body", "body": format_event(message_pk, html), "more_body": True})
+
+        while not disconnect.done():
+            if get is None:
+                get = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({get, disconnect}, timeout=LIVE_KEEPALIVE, return_when=asyncio.FIRST_COMPLETED)
+            if disconnect in done:
+                break
+            if get not in done:
+                ''' A comment, so proxies do not close an idle stream. '''
+                await send({"type": "http.response.body", "body": b": ping\n\n", "more_body": True})
+                continue
+
+            item, get = get.result(), None
+            if item is None:
+                break
+            message_pk, html = item
+            if message_pk in sent:
+                continue
+            sent.add(message_pk)
+            await send({"type": "http.response.body", "body": format_event(message_pk, html), "more_body": True})
+
+        if not disconnect.done():
+            await send({"type": "http.response.body", "body": b""})
+    finally:
+        hub.unsubscribe(tag, conversation.pk, queue)
+        disconnect.cancel()
+        if get is not None:
+            get.cancel()
+        if sent:
+            await run_sync(mark_as_read, user, conversation)
+
+
+class LiveMessagesApplication:
+    ''' ASGI middleware that answers the requests for the streams of
+    conversations, and passes every other request on to Django. '''
+
+    def __init__(self, application):
+        self.application = application
+
+    def get_stream(self, scope):
+        if scope['type'] != 'http' or scope['method'] != 'GET':
+            return None
+        try:
+            match = resolve(scope['path'])
+        except Resolver404:
+            return None
+        tag = LIVE_URL_NAMES.get(match.view_name)
+        return (tag, match.kwargs) if tag else None
+
+    async def __call__(self, scope, receive, send):
+        stream = self.get_stream(scope)
+        if stream is None:
+            return await self.application(scope, receive, send)
+        return await stream_conversation(scope, receive, send, *stream)
@@ -0,0 +1,51 @@
+# Generated by Django 3.0 on 2026-10-17 19:20
+
+from django.db import migrations, models
+
+
+def backfill_participants_key(apps, schema_editor):
+    ''' Give every conversation its key, made of the ids of the users in
+    users_arr, since a user that left is no longer in users. Pairs that
+    ended up with more than one conversation are merged into the oldest
+    one. A conversation with a user that no longer exists gets a key of
+    its own, that no pair of users has. '''
+    PmConversation = apps.get_model('conversations', 'PmConversation')
+    PmMessage = apps.get_model('conversations', 'PmMessage')
+    User = apps.get_model('users', 'User')
+
+    kept = {}
+    for conversation in PmConversation.objects.order_by('id').iterator():
+        usernames = set(conversation.users_arr)
+        user_ids = User.objects.filter(username__in=usernames).values_list('id', flat=True)
+        if len(user_ids) == len(usernames) == 2:
+            key = ":".join(str(user_id) for user_id in sorted(user_ids))
+        else:
+            key = "conversation:{}".format(conversation.id)
+
+        if key not in kept:
+            conversation.participants_key = key
+            conversation.save(update_fields=['participants_key'])
+            kept[key] = conversation
+            continue
+
+        target = kept[key]
+        PmMessage.objects.filter(conversation=conversation).update(conversation=target)
+        target.users.add(*conversation.users.all())
+        conversation.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0001_initial'),
+        ('users', '0002_auto_20200211_1530'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pmconversation',
+            name='participants_key',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.RunPython(backfill_participants_key, migrations.RunPython.noop),
+    ]
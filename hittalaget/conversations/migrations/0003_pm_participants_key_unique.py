@@ -0,0 +1,20 @@
+# Generated by Django 3.0 on 2026-10-17 19:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    ''' Kept apart from the backfill in 0002, since Postgres can not alter
+    a table in the same transaction as the deletes of merged rows. '''
+
+    dependencies = [
+        ('conversations', '0002_pm_participants_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pmconversation',
+            name='participants_key',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+    ]
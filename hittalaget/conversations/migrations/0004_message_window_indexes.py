@@ -0,0 +1,21 @@
+# Generated by Django 3.0 on 2026-10-17 19:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0003_pm_participants_key_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='admessage',
+            index=models.Index(fields=['conversation', 'created', 'id'], name='conversatio_convers_29ac61_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pmmessage',
+            index=models.Index(fields=['conversation', 'created', 'id'], name='conversatio_convers_086c13_idx'),
+        ),
+    ]
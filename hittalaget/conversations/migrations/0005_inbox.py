@@ -0,0 +1,58 @@
+# Generated by Django 3.0 on 2026-10-17 19:03
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('conversations', '0004_message_window_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InboxEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tag', models.CharField(max_length=255)),
+                ('last_message_at', models.DateTimeField()),
+                ('snippet', models.CharField(max_length=255)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('ad_conversation', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to='conversations.AdConversation')),
+                ('pm_conversation', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to='conversations.PmConversation')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='inboxentry',
+            index=models.Index(fields=['user', 'tag', '-last_message_at', '-id'], name='conversatio_user_id_14bfc7_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='inboxentry',
+            constraint=models.UniqueConstraint(fields=('user', 'pm_conversation'), name='unique_pm_inbox_entry'),
+        ),
+        migrations.AddConstraint(
+            model_name='inboxentry',
+            constraint=models.UniqueConstraint(fields=('user', 'ad_conversation'), name='unique_ad_inbox_entry'),
+        ),
+        migrations.RunSQL(
+            sql=[
+                """
+                INSERT INTO conversations_inboxentry
+                    (user_id, tag, {tag}_conversation_id, last_message_at, snippet, unread_count)
+                SELECT u.user_id, '{tag}', m.conversation_id, m.created, left(m.content, 100), 0
+                FROM (
+                    SELECT DISTINCT ON (conversation_id) conversation_id, created, content
+                    FROM conversations_{tag}message
+                    ORDER BY conversation_id, created DESC, id DESC
+                ) AS m
+                JOIN conversations_{tag}conversation_users AS u ON u.{tag}conversation_id = m.conversation_id
+                """.format(tag=tag)
+                for tag in ("pm", "ad")
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
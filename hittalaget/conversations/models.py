@@ -1,9 +1,10 @@
-from django.db import models
-from django.db.models.signals import pre_save 
+from django.db import connection, models, transaction
+from django.db.models.signals import pre_save, post_save, m2m_changed
 from django.conf import settings
 from django.contrib.postgres.fields import ArrayField
 from django.urls import reverse
 from hittalaget.ads.models import Ad
+from hittalaget.core.public_ids import allocate_public_id
 
 
 # ---------------------------------- #
@@ -34,6 +35,12 @@ class Message(TimeStampedModel):
     class Meta:
         abstract = True
 
+    def save(self, *args, **kwargs):
+        ''' The inbox entries of the conversation are updated by a
+        post_save signal, in the same transaction as the message. '''
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 
 # ---------------------------------- #
 # ---------- CONVERSATIONS --------- #
@@ -42,6 +49,15 @@ class Message(TimeStampedModel):
 
 class PmConversation(Conversation):
     tag = models.CharField(max_length=255, default="pm")
+    participants_key = models.CharField(max_length=255, unique=True)
+
+    @staticmethod
+    def make_participants_key(*user_ids):
+        ''' The key of the conversation between two users, the same no
+        matter who started it. It is made of their ids rather than their
+        usernames, which may contain ":", so that no other pair of users
+        can have the same key. '''
+        return ":".join(str(user_id) for user_id in sorted(user_ids))
 
 
 class AdConversation(Conversation):
@@ -68,11 +84,148 @@ class PmMessage(Message):
     ''' Messages added to a PmConversation. '''
     conversation = models.ForeignKey(PmConversation, on_delete=models.CASCADE, related_name="messages")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', 'created', 'id']),
+        ]
+
 
 class AdMessage(Message):
     ''' Messages added to an AdConversation. '''
     conversation = models.ForeignKey(AdConversation, on_delete=models.CASCADE, related_name="messages")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', 'created', 'id']),
+        ]
+
+
+# ---------------------------------- #
+# -------------- INBOX ------------- #
+# ---------------------------------- #
+
+
+class InboxEntry(models.Model):
+    ''' A conversation as it shows up in the inbox of one of its users:
+    when the last message was sent, the start of it, and how many
+    messages the user has not read yet. One of pm_conversation and
+    ad_conversation is set, depending on the tag. '''
+    SNIPPET_LENGTH = 100
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="inbox_entries")
+    tag = models.CharField(max_length=255)
+    pm_conversation = models.ForeignKey(PmConversation, on_delete=models.CASCADE, null=True, related_name="inbox_entries")
+    ad_conversation = models.ForeignKey(AdConversation, on_delete=models.CASCADE, null=True, related_name="inbox_entries")
+    last_message_at = models.DateTimeField()
+    snippet = models.CharField(max_length=255)
+    unread_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'pm_conversation'], name="unique_pm_inbox_entry"),
+            models.UniqueConstraint(fields=['user', 'ad_conversation'], name="unique_ad_inbox_entry"),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'tag', '-last_message_at', '-id']),
+        ]
+
+    @property
+    def conversation(self):
+        return self.pm_conversation if self.tag == "pm" else self.ad_conversation
+
+
+def get_inbox_upsert(message):
+    ''' The upsert that records a new message in the inbox of every user
+    of its conversation, as (sql, params). The message counts as unread
+    for everyone but the author. '''
+    conversation = message.conversation
+    through = conversation.users.through
+    column = "{}_conversation_id".format(conversation.tag)
+
+    sql = """
+        INSERT INTO {inbox} AS i (user_id, tag, {column}, last_message_at, snippet, unread_count)
+        SELECT u.user_id, %(tag)s, %(conversation)s, %(created)s, %(snippet)s,
+            CASE WHEN u.user_id = %(author)s THEN 0 ELSE 1 END
+        FROM {through} AS u
+        WHERE u.{through_column} = %(conversation)s
+        ON CONFLICT (user_id, {column}) DO UPDATE SET
+            last_message_at = greatest(i.last_message_at, EXCLUDED.last_message_at),
+            snippet = CASE WHEN EXCLUDED.last_message_at >= i.last_message_at
+                THEN EXCLUDED.snippet ELSE i.snippet END,
+            unread_count = CASE WHEN EXCLUDED.unread_count = 0
+                THEN 0 ELSE i.unread_count + 1 END
+    """.format(
+        inbox=InboxEntry._meta.db_table,
+        column=column,
+        through=through._meta.db_table,
+        through_column=through._meta.get_field(conversation._meta.model_name).column,
+    )
+    params = {
+        "tag": conversation.tag,
+        "conversation": conversation.pk,
+        "created": message.created,
+        "snippet": message.content[:InboxEntry.SNIPPET_LENGTH],
+        "author": message.author_id,
+    }
+    return sql, params
+
+
+def mark_as_read(user, conversation):
+    InboxEntry.objects.filter(**{
+        "user": user,
+        "{}_conversation".format(conversation.tag): conversation,
+        "unread_count__gt": 0,
+    }).update(unread_count=0)
+
+
+# ---------------------------------- #
+# ---------- LIVE UPDATES ---------- #
+# ---------------------------------- #
+
+
+''' New messages are announced on this channel, to the processes that
+stream the conversations to the browser (see live.py). '''
+MESSAGE_CHANNEL = "conversation_messages"
+
+
+def make_notification(message):
+    return "{}:{}:{}".format(message.conversation.tag, message.conversation_id, message.pk)
+
+
+def parse_notification(payload):
+    ''' Return (tag, conversation pk, message pk). '''
+    tag, conversation_pk, message_pk = payload.split(":")
+    return tag, int(conversation_pk), int(message_pk)
+
+
+''' Functions of a message that return (sql, params) of a statement to run
+when it is created, like the digest requests of the emails app. They
+run as a part of the statement of record_message, so a new message costs
+one query however many there are. The params of all of them are passed
+together, so each should use names of its own. '''
+MESSAGE_STATEMENTS = []
+
+
+def record_message(message):
+    ''' Update the inbox entries of a new message, run the statements in
+    MESSAGE_STATEMENTS and announce it, with one statement: the upserts
+    run to completion as parts of the WITH, even though the SELECT does
+    not read from them.
+
+    Postgres sends the notification when the transaction is committed,
+    and drops it if it is rolled back, so the listeners never hear of a
+    message they can not read yet. '''
+    sql, params = get_inbox_upsert(message)
+    parts = ["inbox AS ({})".format(sql)]
+    for i, get_statement in enumerate(MESSAGE_STATEMENTS):
+        sql, statement_params = get_statement(message)
+        parts.append("statement_{} AS ({})".format(i, sql))
+        params.update(statement_params)
+    params.update({"channel": MESSAGE_CHANNEL, "notification": make_notification(message)})
+
+    with connection.cursor() as cursor:
+        cursor.execute("WITH {} SELECT pg_notify(%(channel)s, %(notification)s)".format(", ".join(parts)), params)
+
 
 # ---------------------------------- #
 # ------------- SIGNALS ------------ #
@@ -81,13 +234,25 @@ class AdMessage(Message):
 
 def pre_save_conversation_id(sender, instance, **kwargs):
     ''' Generate conversation_id used with the AdConversation model. '''
-    from random import randint
-    rand_id = randint(100000, 999999)
-    
-    if not instance.conversation_id: 
-        while AdConversation.objects.filter(conversation_id=rand_id).exists():
-            rand_id = randint(100000, 999999)
-        else:
-            instance.conversation_id = rand_id
-    
-pre_save.connect(pre_save_conversation_id, sender=AdConversation)
\ No newline at end of file
+    if not instance.conversation_id:
+        instance.conversation_id = allocate_public_id("conversation")
+
+
+def post_save_update_inbox(sender, instance, created, **kwargs):
+    if created:
+        record_message(instance)
+
+def users_removed_clear_inbox(sender, instance, action, reverse, pk_set, **kwargs):
+    ''' A user that leaves a conversation no longer has it in the inbox. '''
+    if action != "post_remove" or reverse:
+        return
+    InboxEntry.objects.filter(**{
+        "user__in": pk_set,
+        "{}_conversation".format(instance.tag): instance,
+    }).delete()
+
+pre_save.connect(pre_save_conversation_id, sender=AdConversation)
+post_save.connect(post_save_update_inbox, sender=PmMessage)
+post_save.connect(post_save_update_inbox, sender=AdMessage)
+m2m_changed.connect(users_removed_clear_inbox, sender=PmConversation.users.through)
+m2m_changed.connect(users_removed_clear_inbox, sender=AdConversation.users.through)
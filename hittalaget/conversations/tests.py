@@ -1,3 +1,240 @@
-from django.test import TestCase
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from hittalaget.core.testing import make_ad, make_player, make_team, make_user
+from hittalaget.players.models import Position
+from .access import find_conversation, get_conversation
+from .models import AdConversation, AdMessage, InboxEntry, PmConversation, PmMessage
+
+
+class ParticipantsKeyTests(TestCase):
+
+    def setUp(self):
+        self.anna = make_user("anna")
+        self.bo = make_user("bo")
+
+    def send(self, author, username, content="Hej!"):
+        self.client.force_login(author)
+        return self.client.post(reverse("conversation:create", kwargs={"username": username}), {"content": content})
+
+    def test_key_is_the_same_whoever_starts(self):
+        self.assertEqual(
+            PmConversation.make_participants_key(self.anna.pk, self.bo.pk),
+            PmConversation.make_participants_key(self.bo.pk, self.anna.pk),
+        )
+
+    def test_key_sorts_ids_as_numbers(self):
+        self.assertEqual(PmConversation.make_participants_key(10, 9), "9:10")
+
+    def test_both_users_write_in_one_conversation(self):
+        self.send(self.anna, "bo")
+        self.send(self.bo, "anna", "Hej själv!")
+
+        conversation = PmConversation.objects.get()
+        self.assertEqual(conversation.participants_key, PmConversation.make_participants_key(self.anna.pk, self.bo.pk))
+        self.assertEqual(set(conversation.users.all()), {self.anna, self.bo})
+        self.assertEqual(PmMessage.objects.filter(conversation=conversation).count(), 2)
+
+    def test_user_that_left_is_added_again(self):
+        self.send(self.anna, "bo")
+        self.client.post(reverse("conversation:delete", kwargs={"username": "anna"}))
+        self.client.force_login(self.bo)
+        self.client.post(reverse("conversation:delete", kwargs={"username": "anna"}))
+        self.assertEqual(PmConversation.objects.get().users.count(), 1)
+
+        self.send(self.anna, "bo")
+        self.assertEqual(PmConversation.objects.count(), 1)
+        self.assertEqual(PmConversation.objects.get().users.count(), 2)
+
+    def test_colliding_usernames_do_not_share_a_conversation(self):
+        ''' "a:b" + "c" and "a" + "b:c" would have the same key if it was
+        made of the usernames. '''
+        ab, c = make_user("a:b"), make_user("c")
+        a, bc = make_user("a"), make_user("b:c")
+        self.send(ab, "c", "Hemligt")
+
+        response = self.send(a, "b:c", "Hej")
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(PmConversation.objects.count(), 2)
+        victims = PmConversation.objects.get(users=ab)
+        self.assertEqual(set(victims.users.all()), {ab, c})
+        self.assertEqual(list(victims.messages.values_list('content', flat=True)), ["Hemligt"])
+
+        self.client.force_login(a)
+        response = self.client.get(reverse("conversation:detail", kwargs={"username": "b:c"}))
+        self.assertNotContains(response, "Hemligt")
+
+    def test_find_conversation(self):
+        self.send(self.anna, "bo")
+        conversation = PmConversation.objects.get()
+        self.assertEqual(find_conversation("pm", self.bo, {"username": "anna"}), conversation)
+        self.assertTrue(find_conversation("pm", self.bo, {"username": "anna"}).is_member)
+        self.assertIsNone(find_conversation("pm", self.bo, {"username": "nobody"}))
+        self.assertIsNone(find_conversation("pm", make_user("cecilia"), {"username": "anna"}))
+
+
+class MessageWindowTests(TestCase):
+
+    def setUp(self):
+        self.anna = make_user("anna")
+        self.bo = make_user("bo")
+        self.conversation = PmConversation.objects.create(
+            participants_key=PmConversation.make_participants_key(self.anna.pk, self.bo.pk),
+            users_arr=["anna", "bo"],
+        )
+        self.conversation.users.add(self.anna, self.bo)
+        PmMessage.objects.bulk_create([
+            PmMessage(conversation=self.conversation, author=self.anna if i % 2 else self.bo, content="m{}".format(i))
+            for i in range(120)
+        ])
+        self.client.force_login(self.anna)
+        self.url = reverse("conversation:detail", kwargs={"username": "bo"})
+
+    def test_only_the_latest_messages_are_shown(self):
+        response = self.client.get(self.url)
+        contents = [message.content for message in response.context['message_list']]
+        self.assertEqual(contents, ["m{}".format(i) for i in range(70, 120)])
+        self.assertTrue(response.context['older_url'].startswith(
+            reverse("conversation:older", kwargs={"username": "bo"}) + "?sida="
+        ))
+
+    def test_older_pages_go_back_to_the_first_message(self):
+        response = self.client.get(self.url)
+        seen = [message.pk for message in response.context['message_list']]
+        while response.context['older_url']:
+            response = self.client.get(response.context['older_url'])
+            self.assertNotContains(response, "<html")
+            seen = [message.pk for message in response.context['message_list']] + seen
+        self.assertEqual(seen, sorted(PmMessage.objects.values_list('pk', flat=True)))
+
+    def test_invalid_cursor(self):
+        url = reverse("conversation:older", kwargs={"username": "bo"})
+        self.assertEqual(self.client.get(url, {"sida": "trasig"}).status_code, 404)
+
+    def test_other_users_can_not_read_older_messages(self):
+        self.client.force_login(make_user("cecilia"))
+        self.assertEqual(self.client.get(reverse("conversation:older", kwargs={"username": "bo"})).status_code, 404)
+
+    def test_ad_conversations_have_older_pages(self):
+        ad = make_ad(make_team(self.bo), Position.objects.create(sport="fotboll", name="back"))
+        make_player(self.anna)
+        self.client.post(reverse("conversation:create_ad", kwargs={"ad_id": ad.ad_id}), {"content": "m0"})
+        conversation = AdConversation.objects.get()
+        AdMessage.objects.bulk_create([
+            AdMessage(conversation=conversation, author=self.anna, content="m{}".format(i)) for i in range(1, 60)
+        ])
+
+        kwargs = {"conversation_id": conversation.conversation_id}
+        response = self.client.get(reverse("conversation:detail_ad", kwargs=kwargs))
+        self.assertEqual(len(response.context['message_list']), 50)
+        self.assertTrue(response.context['older_url'].startswith(reverse("conversation:older_ad", kwargs=kwargs)))
+
+        response = self.client.get(response.context['older_url'])
+        self.assertEqual([message.content for message in response.context['message_list']], ["m{}".format(i) for i in range(10)])
+        self.assertIsNone(response.context['older_url'])
+
+
+class InboxTests(TestCase):
+
+    def setUp(self):
+        self.anna = make_user("anna")
+        self.bo = make_user("bo")
+
+    def send(self, author, username, content="Hej!"):
+        self.client.force_login(author)
+        return self.client.post(reverse("conversation:create", kwargs={"username": username}), {"content": content})
+
+    def get_entry(self, user):
+        return InboxEntry.objects.get(user=user, tag="pm")
+
+    def test_new_messages_are_unread_for_the_receiver(self):
+        self.send(self.anna, "bo", "Ett")
+        self.send(self.anna, "bo", "Två")
+        self.assertEqual(self.get_entry(self.bo).unread_count, 2)
+        self.assertEqual(self.get_entry(self.bo).snippet, "Två")
+        self.assertEqual(self.get_entry(self.anna).unread_count, 0)
+
+    def test_answering_resets_the_author(self):
+        self.send(self.anna, "bo")
+        self.send(self.bo, "anna", "Hej själv!")
+        self.assertEqual(self.get_entry(self.bo).unread_count, 0)
+        self.assertEqual(self.get_entry(self.anna).unread_count, 1)
+        self.assertEqual(InboxEntry.objects.count(), 2)
+
+    def test_snippet_is_shortened(self):
+        self.send(self.anna, "bo", "x" * 500)
+        self.assertEqual(len(self.get_entry(self.bo).snippet), InboxEntry.SNIPPET_LENGTH)
+
+    def test_opening_the_conversation_marks_it_read(self):
+        self.send(self.anna, "bo")
+        self.client.force_login(self.bo)
+        self.client.get(reverse("conversation:detail", kwargs={"username": "anna"}))
+        self.assertEqual(self.get_entry(self.bo).unread_count, 0)
+
+    def test_leaving_removes_the_entry(self):
+        self.send(self.anna, "bo")
+        self.client.force_login(self.bo)
+        self.client.post(reverse("conversation:delete", kwargs={"username": "anna"}))
+        self.assertFalse(InboxEntry.objects.filter(user=self.bo).exists())
+        self.assertTrue(InboxEntry.objects.filter(user=self.anna).exists())
+
+    def test_inbox_lists_the_latest_first(self):
+        cecilia = make_user("cecilia")
+        self.send(self.anna, "bo", "Till Bo")
+        self.send(self.anna, "cecilia", "Till Cecilia")
+        response = self.client.get(reverse("conversation:list", kwargs={"label": "pm"}))
+        self.assertEqual([entry.snippet for entry in response.context['object_list']], ["Till Cecilia", "Till Bo"])
+        self.assertEqual(self.client.get(reverse("conversation:list", kwargs={"label": "okänd"})).status_code, 404)
+        self.assertTrue(cecilia.inbox_entries.exists())
+
+
+class AccessTests(TestCase):
+
+    def setUp(self):
+        self.owner = make_user("owner")
+        self.player = make_user("kalle")
+        self.other = make_user("cecilia")
+        self.ad = make_ad(make_team(self.owner), Position.objects.create(sport="fotboll", name="back"))
+        make_player(self.player)
+
+        self.client.force_login(self.player)
+        self.client.post(reverse("conversation:create_ad", kwargs={"ad_id": self.ad.ad_id}), {"content": "Intresserad!"})
+        self.client.post(reverse("conversation:create", kwargs={"username": "owner"}), {"content": "Hej!"})
+        self.conversation = AdConversation.objects.get()
+
+    def get_status(self, name, kwargs, method="get"):
+        data = {"content": "Hej!"} if method == "post" else {}
+        return getattr(self.client, method)(reverse("conversation:" + name, kwargs=kwargs), data).status_code
+
+    def test_membership_is_fetched_with_the_conversation(self):
+        with self.assertNumQueries(1):
+            conversation = find_conversation("ad", self.other, {"conversation_id": self.conversation.conversation_id})
+        self.assertEqual(conversation, self.conversation)
+        self.assertFalse(conversation.is_member)
+        self.assertEqual(conversation.user_count, 2)
+
+    def test_conversation_is_fetched_once_per_request(self):
+        request = RequestFactory().get("/")
+        request.user = self.player
+        kwargs = {"conversation_id": self.conversation.conversation_id}
+        get_conversation(request, "ad", kwargs)
+        with self.assertNumQueries(0):
+            self.assertTrue(get_conversation(request, "ad", kwargs).is_member)
+
+    def test_other_users_are_forbidden_in_ad_conversations(self):
+        self.client.force_login(self.other)
+        kwargs = {"conversation_id": self.conversation.conversation_id}
+        missing = {"conversation_id": 999999}
+        for name, method in [("detail_ad", "get"), ("older_ad", "get"), ("message_ad", "post"), ("delete_ad", "get")]:
+            self.assertEqual(self.get_status(name, kwargs, method), 403, name)
+            self.assertEqual(self.get_status(name, missing, method), 404, name)
+        self.assertEqual(AdMessage.objects.count(), 1)
+
+    def test_other_users_do_not_find_pm_conversations(self):
+        self.client.force_login(self.other)
+        self.assertEqual(self.get_status("detail", {"username": "owner"}), 404)
+        self.assertEqual(self.get_status("older", {"username": "owner"}), 404)
+
+        self.client.force_login(self.owner)
+        self.assertEqual(self.get_status("detail", {"username": "kalle"}), 200)
+        self.assertEqual(self.get_status("create", {"username": "okand"}, "post"), 404)
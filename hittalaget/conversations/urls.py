@@ -6,11 +6,15 @@ app_name = "conversation"
 urlpatterns = [
     # PM conversations
     path('pm/<str:username>/', views.ConversationDetailView.as_view(), name="detail"),
+    path('pm/<str:username>/aldre/', views.ConversationOlderMessagesView.as_view(), name="older"),
+    path('pm/<str:username>/live/', views.live_messages, name="live"),
     path('pm/<str:username>/nytt-meddelande/', views.ConversationCreateView.as_view(), name="create"),
     path('pm/<str:username>/ta-bort/', views.ConversationDeleteView.as_view(), name="delete"),
     
     # AD conversations
     path('ad/<int:conversation_id>/', views.AdConversationDetailView.as_view(), name="detail_ad"),
+    path('ad/<int:conversation_id>/aldre/', views.AdConversationOlderMessagesView.as_view(), name="older_ad"),
+    path('ad/<int:conversation_id>/live/', views.live_messages, name="live_ad"),
     path('ad/<int:conversation_id>/nytt-meddelande/', views.AdConversationMessageView.as_view(), name="message_ad"),
     path('ad/<int:ad_id>/kontakta/', views.AdConversationCreateView.as_view(), name="create_ad"),
     path('ad/<int:conversation_id>/ta-bort/', views.AdConversationDeleteView.as_view(), name="delete_ad"),
@@ -1,8 +1,7 @@
 from django.contrib.auth import get_user_model
 from django.contrib.auth.views import redirect_to_login
 from django.contrib import messages
-from django.core.exceptions import PermissionDenied
-from django.http import HttpResponseRedirect, Http404
+from django.http import HttpResponse, HttpResponseRedirect, Http404
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse
 from django.views.generic import (
@@ -13,21 +12,85 @@ from django.views.generic import (
     View,
     ListView,
 )
-from .models import PmConversation, AdConversation, AdMessage
+from .access import ConversationAccessMixin
+from .models import PmConversation, AdConversation, AdMessage, InboxEntry, mark_as_read
 from .forms import PmMessageForm, AdMessageForm
 from hittalaget.ads.models import Ad
+from hittalaget.core.pagination import InvalidCursor, KeysetPaginationMixin, KeysetPaginator
 from hittalaget.players.models import Player
 
 User = get_user_model()
 
 
+# --------------------------------- #
+# ------------- MIXINS ------------ #
+# --------------------------------- #
+
+
+class MessageWindowMixin:
+    ''' Show only the latest `message_window` messages of the conversation.
+    Older ones are fetched page by page from the "older" view, which
+    renders the same fragment as the detail page. The context variable is
+    `message_list`, since `messages` is taken by the messages framework.
+    `older_url_name` is the URL name of the "older" view. '''
+    message_window = 50
+    cursor_kwarg = "sida"
+    older_url_name = None
+
+    def get_older_url_kwargs(self):
+        ''' The "older" view takes the same URL kwargs as the detail view. '''
+        return self.kwargs
+
+    def get_older_url(self, cursor):
+        url = reverse(self.older_url_name, kwargs=self.get_older_url_kwargs())
+        return "{}?{}={}".format(url, self.cursor_kwarg, cursor)
+
+    def get_message_context(self, conversation):
+        paginator = KeysetPaginator(
+            conversation.messages.select_related('author'),
+            self.message_window,
+            ("-created", "-id"),
+        )
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidCursor as e:
+            raise Http404(str(e))
+
+        ''' The page runs from the newest message back, so its next page
+        holds the older messages. They are shown oldest first. '''
+        older_cursor = page.next_cursor
+        message_list = list(reversed(page.object_list))
+
+        return {
+            "message_list": message_list,
+            "older_url": self.get_older_url(older_cursor) if older_cursor else None,
+        }
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        conversation = self.get_object()
+        context.update(self.get_message_context(conversation))
+        mark_as_read(self.request.user, conversation)
+        return context
+
+
 # --------------------------------- #
 # ------- CONVERSATION VIEWS ------ #
 # --------------------------------- #
 
 
-class ConversationDetailView(DetailView):
+def live_messages(request, **kwargs):
+    ''' The streams of new messages are answered by the ASGI application
+    (see live.py). Served over WSGI, 204 tells the browser not to retry,
+    and the page works as it would without them. '''
+    return HttpResponse(status=204)
+
+
+
+class ConversationDetailView(ConversationAccessMixin, MessageWindowMixin, DetailView):
     template_name = "conversations/detail_pm.html"
+    conversation_tag = "pm"
+    older_url_name = "conversation:older"
 
     def dispatch(self, request, *args, **kwargs):
         user = request.user
@@ -39,7 +102,7 @@ class ConversationDetailView(DetailView):
 
         ''' Redirect if user try to access conversation with self. '''
         if username == user.username:
-            return redirect("conversation:list")
+            return redirect("conversation:list", label="pm")
         else:
             return super().dispatch(request, *args, **kwargs)
 
@@ -49,20 +112,17 @@ class ConversationDetailView(DetailView):
         return context
 
     def get_object(self, queryset=None):
-        if not hasattr(self, 'object'):
-            username = self.kwargs['username']
-            user = self.request.user
-            try:
-                ''' Get conversation if one exist between users. '''
-                obj = PmConversation.objects.prefetch_related('messages__author').get(users=user, users_arr__icontains=username)
-                self.object = obj
-            except PmConversation.DoesNotExist:
-                raise Http404()
-        
-        return self.object
+        ''' Raise 404 if there is no conversation between the users. '''
+        return self.get_conversation()
 
 
-class ConversationCreateView(View):
+class ConversationOlderMessagesView(ConversationDetailView):
+    ''' Return a fragment with the messages before ?sida=<cursor>. '''
+    template_name = "conversations/messages_pm.html"
+
+
+class ConversationCreateView(ConversationAccessMixin, View):
+    conversation_tag = "pm"
 
     def dispatch(self, request, *args, **kwargs):
         user = request.user
@@ -74,7 +134,7 @@ class ConversationCreateView(View):
 
         ''' Redirect if users try to message self. ''' 
         if username == user.username:
-            return redirect(reverse("conversation:list"))
+            return redirect(reverse("conversation:list", kwargs={"label": "pm"}))
 
         return super().dispatch(request, *args, **kwargs)
 
@@ -82,22 +142,10 @@ class ConversationCreateView(View):
         username = kwargs['username']
         user = request.user
 
-        try:
-            ''' Get conversation if one exist between users. '''
-            conversation = PmConversation.objects.filter(
-                users_arr__icontains=user.username
-            ).get(
-                users_arr__icontains=username
-            )
-        except PmConversation.DoesNotExist:
-            ''' Create conversation if one does not exist between users. '''
-            conversation = PmConversation()
-            conversation.users_arr = [user, username]
-            conversation.save()
-
-        ''' Re-add users in case someone left the conversation. '''
-        receiver = get_object_or_404(User, username=username)
-        conversation.users.add(user, receiver)                
+        ''' Use the conversation as it is if both users are in it. '''
+        conversation = self.find_conversation()
+        if conversation is None or not conversation.is_member or conversation.user_count < 2:
+            conversation = self.start_conversation(user, username)
 
         form = PmMessageForm(request.POST)
 
@@ -110,9 +158,25 @@ class ConversationCreateView(View):
 
         return redirect(reverse('conversation:detail', kwargs={"username": username}))
 
+    def start_conversation(self, user, username):
+        receiver = get_object_or_404(User, username=username)
+
+        ''' Get conversation if one exist between users, otherwise create
+        it. The key is unique, so two first messages sent at the same time
+        end up in the same conversation. '''
+        conversation, created = PmConversation.objects.get_or_create(
+            participants_key=PmConversation.make_participants_key(user.pk, receiver.pk),
+            defaults={"users_arr": [user.username, receiver.username]},
+        )
 
-class ConversationDeleteView(DeleteView):
+        ''' Re-add users in case someone left the conversation. '''
+        conversation.users.add(user, receiver)
+        return conversation
+
+
+class ConversationDeleteView(ConversationAccessMixin, DeleteView):
     template_name = "conversations/delete.html"
+    conversation_tag = "pm"
 
     def dispatch(self, request, *args, **kwargs):
         user = request.user
@@ -124,26 +188,20 @@ class ConversationDeleteView(DeleteView):
 
         ''' Redirect if user try to delete conversation with self. '''
         if username == user.username:
-            return redirect("conversation:list")
+            return redirect("conversation:list", label="pm")
         
         ''' Redirect if conversation doesn't exist. '''
         if self.get_object() is not None:
             return super().dispatch(request, *args, **kwargs)
         else:
-            return redirect(reverse("conversation:list"))
+            return redirect(reverse("conversation:list", kwargs={"label": "pm"}))
 
     def get_object(self, queryset=None):
-        if not hasattr(self, 'object'):
-            user = self.request.user
-            username = self.kwargs['username']
-            try:
-                obj = PmConversation.objects.get(users=user, users_arr__icontains=username)
-                self.object = obj
-            except PmConversation.DoesNotExist:
-                self.object = None
-
-        return self.object
-        
+        conversation = self.find_conversation()
+        if conversation is None or not conversation.is_member:
+            return None
+        return conversation
+
     def delete(self, request, *args, **kwargs):
         ''' Remove user from conversation. '''
         conversation = self.get_object()
@@ -156,8 +214,11 @@ class ConversationDeleteView(DeleteView):
         return reverse("conversation:list", kwargs={"label": "pm"})
 
 
-class ConversationListView(ListView):
+class ConversationListView(KeysetPaginationMixin, ListView):
+    ''' The inbox. Reads the inbox entries of the user, so it costs the
+    same no matter how many conversations or messages there are. '''
     template_name = "conversations/list.html"
+    keyset_ordering = ("-last_message_at", "-id")
 
     def dispatch(self, request, *args, **kwargs):
         user = request.user
@@ -173,13 +234,13 @@ class ConversationListView(ListView):
         user = self.request.user
 
         if label == "pm":
-            q = PmConversation.objects.filter(users=user)
+            q = InboxEntry.objects.select_related('pm_conversation')
         elif label == "ad":
-            q = AdConversation.objects.select_related('ad__team__user').filter(users=user)
+            q = InboxEntry.objects.select_related('ad_conversation__ad__team__user')
         else:
             raise Http404()
 
-        return q
+        return q.filter(user=user, tag=label)
     
 
 # --------------------------------- #
@@ -187,8 +248,10 @@ class ConversationListView(ListView):
 # --------------------------------- #
 
 
-class AdConversationDetailView(DetailView):
+class AdConversationDetailView(ConversationAccessMixin, MessageWindowMixin, DetailView):
     template_name = "conversations/detail_ad.html"
+    conversation_tag = "ad"
+    older_url_name = "conversation:older_ad"
 
     def dispatch(self, request, *args, **kwargs):
         user = request.user
@@ -199,10 +262,8 @@ class AdConversationDetailView(DetailView):
         
         ''' Raise 404 if conversation does not exist, 403 if user is not part
         of the conversation, otherwise proceed as normal. '''
-        if user not in self.get_object().users.all():
-            raise PermissionDenied()
-        else:
-            return super().dispatch(request, *args, **kwargs)
+        self.get_conversation()
+        return super().dispatch(request, *args, **kwargs)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -210,18 +271,12 @@ class AdConversationDetailView(DetailView):
         return context
 
     def get_object(self, queryset=None):
-        conversation_id = self.kwargs['conversation_id']
+        return self.get_conversation()
 
-        if not hasattr(self, 'object'):
-            ''' Get conversation if it exist, oterwise raise a 404. '''
-            obj = get_object_or_404(AdConversation.objects.prefetch_related(
-                'messages__author'
-            ).select_related(
-                'ad__team__user'
-            ), conversation_id=conversation_id)
-            self.object = obj
 
-        return self.object
+class AdConversationOlderMessagesView(AdConversationDetailView):
+    ''' Return a fragment with the messages before ?sida=<cursor>. '''
+    template_name = "conversations/messages_ad.html"
 
 
 class AdConversationCreateView(View):
@@ -240,7 +295,7 @@ class AdConversationCreateView(View):
         ad = self.get_ad()
         if ad.team.user == user:
             # add message in future..
-            return redirect(ad.get_absoulte_url())
+            return redirect(ad.get_absolute_url())
 
         ''' Redirect if user does not have player profile. '''
         if not Player.objects.filter(user=user, sport=ad.sport).exists():
@@ -252,7 +307,7 @@ class AdConversationCreateView(View):
     def get_ad(self):
         if not hasattr(self, 'ad'):
             ad_id = self.kwargs['ad_id']
-            ad = get_object_or_404(Ad, ad_id=ad_id) # select_related('team')
+            ad = get_object_or_404(Ad.objects.select_related('team__user'), ad_id=ad_id)
             self.ad = ad
 
         return self.ad
@@ -270,23 +325,26 @@ class AdConversationCreateView(View):
             conversation.users_arr = [user.username, ad.team.user.username]
             conversation.save()
 
-        ''' Assign conversation, and author to the message, and then create it. '''
+        ''' Assign conversation, and author to the message, and then create it.
+        The users are added first, so the message shows up in their inboxes. '''
         form = AdMessageForm(request.POST)
 
         if form.is_valid():
+            conversation.users.add(user, ad.team.user)
             message = form.save(commit=False)
             message.conversation = conversation
             message.author = user
             message.save()
-            # add users
-            conversation.users.add(user, ad.team.user)
 
         return redirect(conversation.get_absolute_url())
 
 
-class AdConversationMessageView(View):
-    ''' Handles messages posted with the form from the conversation:detail_ad page. '''
-    
+class AdConversationMessageView(ConversationAccessMixin, View):
+    ''' Handles messages posted with the form from the conversation:detail_ad
+    page. Takes three queries: the conversation with the membership of the
+    user, the message, and the inbox entries. '''
+    conversation_tag = "ad"
+
     def dispatch(self, request, *args, **kwargs):
         user = request.user
 
@@ -296,19 +354,8 @@ class AdConversationMessageView(View):
         
         ''' Raise 404 if conversation does not exist, and a 403 if user
         is not part of the conversation. '''
-        conversation = self.get_conversation()
-
-        if user not in conversation.users.all():
-            raise PermissionDenied()
-        else:
-            return super().dispatch(request, *args, **kwargs)
-    
-    def get_conversation(self):
-        if not hasattr(self, 'conversation'):
-            conversation_id = self.kwargs['conversation_id']
-            self.conversation = get_object_or_404(AdConversation, conversation_id=conversation_id)
-        
-        return self.conversation
+        self.get_conversation()
+        return super().dispatch(request, *args, **kwargs)
 
     def post(self, request, *args, **kwargs):
         user = request.user
@@ -329,8 +376,9 @@ class AdConversationMessageView(View):
         return redirect(conversation.get_absolute_url())
 
 
-class AdConversationDeleteView(DeleteView):
+class AdConversationDeleteView(ConversationAccessMixin, DeleteView):
     template_name = "conversations/delete.html"
+    conversation_tag = "ad"
 
     def dispatch(self, request, *args, **kwargs):
         user = request.user
@@ -341,34 +389,24 @@ class AdConversationDeleteView(DeleteView):
         
         ''' Raise 404 if conversation does not exist, 403 if user is not part of
         conversation, otherwise proceed as normal. '''
-        if user not in self.get_object().users.all():
-            raise PermissionDenied()
-        else:
-            return super().dispatch(request, *args, **kwargs)
+        self.get_conversation()
+        return super().dispatch(request, *args, **kwargs)
 
     def get_object(self, queryset=None):
-        conversation_id = self.kwargs['conversation_id']
-
-        if not hasattr(self, 'object'):
-            ''' Get conversation if it exist, oterwise raise a 404. '''
-            ''' select related => users (used in dispatch, and delete..) '''
-            obj = get_object_or_404(AdConversation, conversation_id=conversation_id)
-            self.object = obj
-
-        return self.object
+        return self.get_conversation()
 
     def delete(self, request, *args, **kwargs):
         conversation = self.get_object()
         user = request.user
 
-        if len(conversation.users.all()) < 2:
+        if conversation.user_count < 2:
             ''' Delete the conversation if there is only one user left. '''
             conversation.delete()
         else:
             ''' Remove the user from the conversation, and set is_active to False. '''
             conversation.users.remove(user)
             conversation.is_active = False
-            conversation.save()
+            conversation.save(update_fields=['is_active'])
         
         return HttpResponseRedirect(self.get_success_url())
 
@@ -0,0 +1,29 @@
+''' A small thread pool for work that should not hold up the response.
+
+Tasks run in the web process itself, so they are lost if the process
+dies. Use it for work that can safely be redone, like refreshing caches. '''
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections, connections
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="background")
+
+
+def _run(func, args, kwargs):
+    close_old_connections()
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception("Background task %s failed.", func.__name__)
+    finally:
+        ''' Each worker thread has connections of its own, which would
+        otherwise be left open until the thread exits. '''
+        connections.close_all()
+
+
+def run_in_background(func, *args, **kwargs):
+    return _executor.submit(_run, func, args, kwargs)
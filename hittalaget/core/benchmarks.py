@@ -0,0 +1,225 @@
+''' Helpers shared by the bench_* management commands.
+
+The benchmarks seed their rows with set based SQL inside a transaction
+that is rolled back afterwards, so they can run against a development
+database without leaving anything behind. '''
+
+import math
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+
+from hittalaget.ads.models import Ad
+from hittalaget.core.reference import get_values, invalidate
+from hittalaget.players.models import Player, Position
+from hittalaget.teams.models import Team
+from hittalaget.users.models import City
+
+User = get_user_model()
+
+BENCH_POSITIONS = ["målvakt", "back", "mittback", "mittfältare", "ytter", "anfallare"]
+
+''' Words for seeded ad descriptions. They are drawn so that a word is
+rarer the earlier it comes in the list, from about one ad in a hundred
+for the first one to more than half of the ads for the last. '''
+BENCH_WORDS = [
+    "vänsterfotad", "målfarlig", "huvudspelsstark", "tekniker", "straffskytt",
+    "uthållig", "ledare", "kapten", "djupledslöpningar", "frisparkar",
+    "spelförståelse", "duellstark", "kvick", "lång", "stabil",
+    "offensiv", "defensiv", "ambitiös", "träningsvillig", "lagspelare",
+    "seriespel", "division", "säsongen", "matcher", "träningar",
+    "vecka", "klubb", "laget", "spelare", "söker",
+]
+BENCH_LEVELS = ["korpen", "division 6", "division 5", "division 4", "division 3", "division 2"]
+
+
+def timed(func, repeat=10):
+    ''' Return the median wall time of func() in milliseconds. '''
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def percentile(samples, p):
+    ''' The p:th percentile of samples, by the nearest rank method. '''
+    ordered = sorted(samples)
+    rank = max(math.ceil(p / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def seed_cities(count, prefix="bench"):
+    names = ["{}-stad-{}".format(prefix, i) for i in range(count)]
+    City.objects.bulk_create([City(name=name) for name in names], ignore_conflicts=True)
+    return list(City.objects.filter(name__in=names).values_list('pk', flat=True))
+
+
+def seed_positions(sport="fotboll"):
+    existing = list(Position.objects.filter(sport=sport).values_list('pk', flat=True))
+    if existing:
+        return existing
+    Position.objects.bulk_create([Position(sport=sport, name=name) for name in BENCH_POSITIONS])
+    invalidate()
+    return list(Position.objects.filter(sport=sport).values_list('pk', flat=True))
+
+
+def seed_users(count, prefix="bench", cities=50):
+    ''' Insert `count` users named <prefix>_<n>, spread over `cities`
+    cities, ages 16-40 and heights 160-199 cm. '''
+    city_ids = seed_cities(cities, prefix=prefix)
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO {users} (password, is_superuser, username, first_name,
+                last_name, email, is_staff, is_active, date_joined, birthday,
+                height, city_id)
+            SELECT '!', false, %(prefix)s || '_' || g, 'Bench', 'Bench',
+                %(prefix)s || '_' || g || '@example.com', false, true, now(),
+                now() - (interval '1 year' * (16 + abs(hashtext(g || 'age')) %% 25)),
+                160 + abs(hashtext(g || 'height')) %% 40,
+                (%(cities)s::int[])[1 + abs(hashtext(g || 'city')) %% %(city_count)s]
+            FROM generate_series(1, %(count)s) AS g
+        """.format(users=User._meta.db_table), {
+            "prefix": prefix,
+            "count": count,
+            "cities": city_ids,
+            "city_count": len(city_ids),
+        })
+
+
+def seed_players(count, sport="fotboll", prefix="bench"):
+    ''' Insert `count` players, each with a user of its own and one or
+    two positions. About two out of three players are available. '''
+    seed_users(count, prefix=prefix)
+    position_ids = seed_positions(sport)
+
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO {players} (user_id, username, sport, side, experience,
+                special_ability, is_available, image, image_renditions, city_id, birthday, height)
+            SELECT id, username, %(sport)s,
+                (%(sides)s::text[])[1 + abs(hashtext(id || 'side')) %% 3],
+                (%(experiences)s::text[])[1 + abs(hashtext(id || 'experience')) %% 12],
+                (%(abilities)s::text[])[1 + abs(hashtext(id || 'ability')) %% 15],
+                abs(hashtext(id || 'available')) %% 3 <> 0,
+                'images/players/default.png', '{{}}', city_id, birthday, height
+            FROM {users}
+            WHERE username LIKE %(pattern)s
+        """.format(players=Player._meta.db_table, users=User._meta.db_table), {
+            "sport": sport,
+            "pattern": "{}\\_%".format(prefix),
+            "sides": get_values(sport, "side"),
+            "experiences": get_values(sport, "experience"),
+            "abilities": get_values(sport, "special_ability"),
+        })
+        cursor.execute("""
+            INSERT INTO {through} (player_id, position_id)
+            SELECT id, (%(positions)s::int[])[1 + abs(hashtext(id || 'position')) %% %(position_count)s]
+            FROM {players} WHERE username LIKE %(pattern)s
+            UNION ALL
+            SELECT id, (%(positions)s::int[])[1 + (abs(hashtext(id || 'position')) + 1) %% %(position_count)s]
+            FROM {players} WHERE username LIKE %(pattern)s AND abs(hashtext(id || 'second')) %% 2 = 0
+        """.format(
+            through=Player.positions.through._meta.db_table,
+            players=Player._meta.db_table,
+        ), {
+            "pattern": "{}\\_%".format(prefix),
+            "positions": position_ids,
+            "position_count": len(position_ids),
+        })
+        cursor.execute("ANALYZE {}".format(User._meta.db_table))
+        cursor.execute("ANALYZE {}".format(Player._meta.db_table))
+        cursor.execute("ANALYZE {}".format(Player.positions.through._meta.db_table))
+
+
+def seed_teams(count, sport="fotboll", prefix="benchteam"):
+    ''' Insert `count` teams, each with a user of its own. '''
+    seed_users(count, prefix=prefix)
+
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO {teams} (user_id, name, city_id, team_id, slug, founded,
+                home, is_looking, is_verified, website, sport, level, image, image_renditions)
+            SELECT id, 'IK ' || username, city_id, 1000000 + id, username, 1900 + id %% 120,
+                (%(words)s::text[])[1 + abs(hashtext(id || 'home')) %% 30] || 'vallen',
+                true, false, '', %(sport)s,
+                (%(levels)s::text[])[1 + abs(hashtext(id || 'level')) %% 6],
+                'images/teams/default.png', '{{}}'
+            FROM {users}
+            WHERE username LIKE %(pattern)s
+        """.format(teams=Team._meta.db_table, users=User._meta.db_table), {
+            "sport": sport,
+            "pattern": "{}\\_%".format(prefix),
+            "words": BENCH_WORDS,
+            "levels": BENCH_LEVELS,
+        })
+        cursor.execute("""
+            UPDATE {teams} SET search_vector =
+                setweight(to_tsvector('swedish', name), 'A')
+                || setweight(to_tsvector('swedish', home || ' ' || level), 'B')
+            WHERE sport = %(sport)s AND name LIKE %(pattern)s
+        """.format(teams=Team._meta.db_table), {
+            "sport": sport,
+            "pattern": "IK {}\\_%".format(prefix),
+        })
+        cursor.execute("ANALYZE {}".format(Team._meta.db_table))
+
+
+def seed_ads(count, teams=5000, sport="fotboll", prefix="benchteam"):
+    ''' Insert `count` ads spread over `teams` new teams. Each ad has
+    a description of twelve words drawn from BENCH_WORDS, and its search
+    vector is filled in directly. '''
+    seed_teams(teams, sport=sport, prefix=prefix)
+    position_ids = seed_positions(sport)
+
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            WITH teams AS (
+                SELECT row_number() OVER (ORDER BY id) AS n, id, name
+                FROM {teams} WHERE sport = %(sport)s AND name LIKE %(pattern)s
+            ),
+            positions AS (
+                SELECT row_number() OVER (ORDER BY id) AS n, id, name
+                FROM {positions} WHERE id = ANY(%(positions)s)
+            ),
+            ads AS (
+                SELECT g,
+                    1 + abs(hashtext(g || 'team')) %% %(team_count)s AS team_n,
+                    1 + abs(hashtext(g || 'position')) %% %(position_count)s AS position_n,
+                    (
+                        SELECT string_agg((%(words)s::text[])[
+                            1 + floor(sqrt(abs(hashtext(g || 'word' || i)) %% %(word_space)s))::int
+                        ], ' ')
+                        FROM generate_series(1, 12) AS i
+                    ) AS description
+                FROM generate_series(1, %(count)s) AS g
+            )
+            INSERT INTO {ads} (ad_id, team_id, sport, title, slug, description,
+                max_age, min_height, position_id, min_experience, special_ability,
+                search_vector)
+            SELECT 1000000 + a.g, t.id, %(sport)s, t.name || ' söker ' || p.name,
+                'ad-' || a.g, a.description, 25, 175, p.id, 'korpen', '',
+                setweight(to_tsvector('swedish', t.name || ' söker ' || p.name), 'A')
+                || setweight(to_tsvector('swedish', a.description), 'B')
+            FROM ads AS a
+            JOIN teams AS t ON t.n = a.team_n
+            JOIN positions AS p ON p.n = a.position_n
+        """.format(
+            ads=Ad._meta.db_table,
+            teams=Team._meta.db_table,
+            positions=Position._meta.db_table,
+        ), {
+            "sport": sport,
+            "pattern": "IK {}\\_%".format(prefix),
+            "positions": position_ids,
+            "position_count": len(position_ids),
+            "team_count": teams,
+            "count": count,
+            "words": BENCH_WORDS,
+            "word_space": len(BENCH_WORDS) ** 2,
+        })
+        cursor.execute("ANALYZE {}".format(Ad._meta.db_table))
+
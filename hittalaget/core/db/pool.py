@@ -0,0 +1,297 @@
+''' A pool of database connections in each process.
+
+Without it, every request opens a connection to Postgres and closes it
+when it is done, which adds the time to connect to every page and uses
+up max_connections when there are many processes. With ENGINE set to
+"hittalaget.core.db.postgresql", Django still closes the connection of
+a request when it is done, but it goes back to the pool of the process,
+and the next request in any thread gets it from there.
+
+A pool keeps at least MIN_SIZE connections open and opens at most
+MAX_SIZE. A checkout that finds them all in use waits for one for at
+most TIMEOUT seconds, then fails with PoolTimeout rather than queueing
+up requests behind a database that can not keep up. On checkout, a
+connection that has been idle for more than CHECK_AFTER seconds is
+checked with a SELECT 1, and one that is broken, or older than
+MAX_LIFETIME, is replaced. Idle connections above MIN_SIZE are closed
+after MAX_IDLE seconds.
+
+A connection is returned with its transaction rolled back, but with the
+rest of its session as it was, so use SET LOCAL rather than SET. The
+idle connections are closed before the process forks, so a child never
+shares one with its parent.
+
+The pools count their waits, timeouts and the connections they open and
+close. Each process adds them to the PoolMetric rows along with its
+view metrics, so /~metrics/ shows the pools of every process (see
+hittalaget/core/instrumentation.py). '''
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from django.db import OperationalError
+from psycopg2 import extensions
+
+logger = logging.getLogger(__name__)
+
+POOL_DEFAULTS = {
+    "MIN_SIZE": 1,
+    "MAX_SIZE": 10,
+    "TIMEOUT": 2,
+    "CHECK_AFTER": 1,
+    "MAX_IDLE": 60 * 5,
+    "MAX_LIFETIME": 60 * 60,
+}
+
+''' The counters of a pool, which only ever go up. '''
+POOL_COUNTERS = ("checkouts", "waits", "wait_seconds", "timeouts", "opened", "closed", "failed_checks")
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class PooledConnection:
+
+    def __init__(self, connection, isolation_level):
+        self.connection = connection
+        self.isolation_level = isolation_level
+        self.created_at = time.monotonic()
+        self.returned_at = self.created_at
+
+
+class Pool:
+
+    def __init__(self, alias, options):
+        self.alias = alias
+        self.options = dict(POOL_DEFAULTS, **options)
+        self.condition = threading.Condition()
+        self.idle = deque()
+        self.in_use = {}
+        self.opening = 0
+        ''' Counters, for the metrics. '''
+        self.opened = 0
+        self.closed = 0
+        self.failed_checks = 0
+        self.timeouts = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_seconds = 0
+        ''' The counters as of the last take_pool_stats(). '''
+        self.taken = dict.fromkeys(POOL_COUNTERS, 0)
+
+    @property
+    def size(self):
+        return len(self.idle) + len(self.in_use) + self.opening
+
+    def open(self, connect):
+        ''' connect() returns (connection, isolation level). '''
+        try:
+            pooled = PooledConnection(*connect())
+        except Exception:
+            with self.condition:
+                self.opening -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.opening -= 1
+            self.opened += 1
+        return pooled
+
+    def close(self, pooled):
+        try:
+            pooled.connection.close()
+        except Exception:
+            pass
+        with self.condition:
+            self.closed += 1
+
+    def fill(self, connect):
+        ''' Open connections until there are MIN_SIZE. '''
+        while True:
+            with self.condition:
+                if self.size >= self.options["MIN_SIZE"]:
+                    return
+                self.opening += 1
+            try:
+                pooled = self.open(connect)
+            except Exception:
+                logger.warning("Could not open a connection to %s.", self.alias, exc_info=True)
+                return
+            with self.condition:
+                self.idle.appendleft(pooled)
+                self.condition.notify()
+
+    def is_healthy(self, pooled):
+        connection = pooled.connection
+        if connection.closed or time.monotonic() - pooled.created_at > self.options["MAX_LIFETIME"]:
+            return False
+        if time.monotonic() - pooled.returned_at <= self.options["CHECK_AFTER"]:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            if not connection.autocommit:
+                connection.rollback()
+            return True
+        except Exception:
+            return False
+
+    def get(self, connect):
+        ''' Return a connection that works, from the pool or newly
+        opened with connect(), or raise PoolTimeout. '''
+        start = time.monotonic()
+        deadline = start + self.options["TIMEOUT"]
+        waited = False
+        with self.condition:
+            self.checkouts += 1
+            while not self.idle and self.size >= self.options["MAX_SIZE"]:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout("All {} connections to {} were in use for {} seconds.".format(
+                        self.options["MAX_SIZE"], self.alias, self.options["TIMEOUT"],
+                    ))
+                waited = True
+                self.condition.wait(remaining)
+            pooled = self.idle.pop() if self.idle else None
+            if pooled is None:
+                self.opening += 1
+            else:
+                self.in_use[id(pooled.connection)] = pooled
+            if waited:
+                self.waits += 1
+                self.wait_seconds += time.monotonic() - start
+
+        if pooled is not None and not self.is_healthy(pooled):
+            with self.condition:
+                del self.in_use[id(pooled.connection)]
+                self.opening += 1
+                self.failed_checks += 1
+            self.close(pooled)
+            pooled = None
+        if pooled is None:
+            pooled = self.open(connect)
+            with self.condition:
+                self.in_use[id(pooled.connection)] = pooled
+        return pooled
+
+    def put(self, connection, discard=False):
+        ''' Return a connection to the pool. With discard, or if it can
+        not be rolled back, it is closed instead. '''
+        with self.condition:
+            pooled = self.in_use.pop(id(connection), None)
+        if pooled is None:
+            connection.close()
+            return
+
+        if not discard and not connection.closed:
+            try:
+                if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+                del connection.notifies[:]
+            except Exception:
+                discard = True
+        if discard or connection.closed or connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            self.close(pooled)
+            with self.condition:
+                self.condition.notify()
+            return
+
+        pooled.returned_at = time.monotonic()
+        with self.condition:
+            self.idle.append(pooled)
+            expired = self.prune()
+            self.condition.notify()
+        for pooled in expired:
+            self.close(pooled)
+
+    def prune(self):
+        ''' Take the connections that have been idle for more than
+        MAX_IDLE out of the pool, down to MIN_SIZE, oldest first. Called
+        with the condition held. '''
+        expired = []
+        now = time.monotonic()
+        while (self.idle and self.size > self.options["MIN_SIZE"]
+               and now - self.idle[0].returned_at > self.options["MAX_IDLE"]):
+            expired.append(self.idle.popleft())
+        return expired
+
+    def close_idle(self):
+        with self.condition:
+            idle, self.idle = list(self.idle), deque()
+        for pooled in idle:
+            self.close(pooled)
+
+
+# ---------------------------------- #
+# ------------- POOLS -------------- #
+# ---------------------------------- #
+
+
+''' {(alias, connection parameters): Pool} of this process. '''
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, conn_params, options, connect):
+    ''' The pool of the database, created, and filled to MIN_SIZE in the
+    background, on first use. '''
+    key = (alias, repr(sorted(conn_params.items())))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = Pool(alias, options)
+            threading.Thread(target=pool.fill, args=(connect,), daemon=True).start()
+    return pool
+
+
+def close_idle_connections():
+    ''' Close the idle connections of every pool, e.g. before dropping a
+    database, which can not be done while connections to it are open. '''
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_idle()
+
+
+def _after_fork_in_child():
+    ''' The connections in use by the parent are its own. '''
+    global _pools_lock
+    _pools.clear()
+    _pools_lock = threading.Lock()
+
+os.register_at_fork(before=close_idle_connections, after_in_child=_after_fork_in_child)
+
+
+# ---------------------------------- #
+# ------------- METRICS ------------ #
+# ---------------------------------- #
+
+
+def take_pool_stats():
+    ''' {alias: stats} of the pools of this process: the connections in
+    use and idle, MAX_SIZE, and how much each counter went up since the
+    last call. The pools of an alias with different connection parameters
+    are added up. '''
+    with _pools_lock:
+        pools = list(_pools.values())
+
+    stats = {}
+    for pool in pools:
+        with pool.condition:
+            counters = {name: getattr(pool, name) for name in POOL_COUNTERS}
+            values = dict(
+                {name: value - pool.taken[name] for name, value in counters.items()},
+                in_use=len(pool.in_use),
+                idle=len(pool.idle),
+                max_size=pool.options["MAX_SIZE"],
+            )
+            pool.taken = counters
+        if pool.alias in stats:
+            values = {name: value + stats[pool.alias][name] for name, value in values.items()}
+        stats[pool.alias] = values
+    return stats
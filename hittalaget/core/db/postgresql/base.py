@@ -0,0 +1,30 @@
+''' django.db.backends.postgresql, with the connections from a pool (see
+hittalaget/core/db/pool.py). The pool is set up with POOL in the
+settings of the database, e.g. "POOL": {"MAX_SIZE": 20}. '''
+
+from django.db.backends.postgresql import base
+
+from ..pool import get_pool
+from .creation import DatabaseCreation
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_new_connection(self, conn_params):
+        def connect():
+            connection = super(DatabaseWrapper, self).get_new_connection(conn_params)
+            return connection, self.isolation_level
+
+        self.pool = get_pool(self.alias, conn_params, self.settings_dict.get('POOL', {}), connect)
+        pooled = self.pool.get(connect)
+        self.isolation_level = pooled.isolation_level
+        return pooled.connection
+
+    def _close(self):
+        ''' Return the connection to the pool. One closed in an atomic
+        block is closed for real, since the wrapper holds on to it until
+        the block is left. '''
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.put(self.connection, discard=self.in_atomic_block)
@@ -0,0 +1,11 @@
+from django.db.backends.postgresql import creation
+
+from ..pool import close_idle_connections
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        ''' Postgres does not drop a database with open connections. '''
+        close_idle_connections()
+        super()._destroy_test_db(test_database_name, verbosity)
@@ -0,0 +1,199 @@
+''' Reads from replicas of the database, writes to the primary.
+
+The aliases in DATABASE_REPLICAS are read-only replicas of "default".
+ReplicaMiddleware lets the GET and HEAD requests read from them, one
+replica per request, and ReplicaRouter sends their reads there. Every
+write goes to the primary, as does every read outside of such requests
+(jobs, commands, the live streams), in a transaction on the primary, and
+after the request has written something, so a request sees its own
+writes.
+
+A replica is behind the primary, so a user that has just posted, say a
+message or a changed is_available, might not see it on the next page.
+A request that is not a GET or HEAD, or that wrote something (like the
+GET of a conversation, which marks it as read), sets a cookie that
+makes the requests of that browser read from the primary for the next
+REPLICA_PIN_SECONDS seconds.
+
+Each process measures the lag of a replica at most every
+REPLICA_CHECK_INTERVAL seconds, and stops reading from it while it is
+more than REPLICA_MAX_LAG seconds behind, can not be reached, or is not
+receiving WAL from the primary. The lag is shown by the replica_lag
+command and in the metrics. '''
+
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+REPLICA_CHECK_INTERVAL = 5
+PIN_COOKIE = "primary_until"
+SAFE_METHODS = ("GET", "HEAD")
+
+''' Seconds since the replica replayed its last transaction, or 0 if it
+has replayed everything it received, or is not a replica. NULL if it
+has no WAL receiver: having replayed all it received then says nothing
+about how far behind the primary it is. A row in pg_stat_wal_receiver
+is visible to any user, its other columns only to pg_read_all_stats. '''
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver) THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+def measure_lag(alias):
+    ''' Return the lag of the replica in seconds, or None if it can not
+    be reached or is not receiving WAL. '''
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(LAG_SQL)
+            lag = cursor.fetchone()[0]
+    except DatabaseError:
+        logger.warning("Replica %s can not be reached.", alias, exc_info=True)
+        connections[alias].close()
+        return None
+    if lag is None:
+        logger.warning("Replica %s is not receiving WAL from the primary.", alias)
+        return None
+    return float(lag)
+
+
+class ReplicaStatus:
+    ''' The lag of each replica, as last measured by this process. '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lags = {}
+
+    def get_lag(self, alias):
+        with self.lock:
+            entry = self.lags.get(alias)
+        if entry is not None and time.monotonic() - entry[0] < REPLICA_CHECK_INTERVAL:
+            return entry[1]
+        lag = measure_lag(alias)
+        with self.lock:
+            self.lags[alias] = (time.monotonic(), lag)
+        return lag
+
+    def is_usable(self, alias):
+        lag = self.get_lag(alias)
+        return lag is not None and lag <= settings.REPLICA_MAX_LAG
+
+
+replica_status = ReplicaStatus()
+
+
+def choose_replica():
+    ''' A replica that is not too far behind, or None. '''
+    usable = [alias for alias in settings.DATABASE_REPLICAS if replica_status.is_usable(alias)]
+    return random.choice(usable) if usable else None
+
+
+# ---------------------------------- #
+# ------------- ROUTING ------------ #
+# ---------------------------------- #
+
+
+''' The routing of the request in this thread. replica is None when the
+request reads from the primary, and CHOOSE until its first read. '''
+_state = threading.local()
+CHOOSE = object()
+
+
+def get_read_database():
+    replica = getattr(_state, 'replica', None)
+    if replica is None or getattr(_state, 'wrote', False) or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return DEFAULT_DB_ALIAS
+    if replica is CHOOSE:
+        replica = _state.replica = choose_replica()
+    return replica or DEFAULT_DB_ALIAS
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        return get_read_database()
+
+    def db_for_write(self, model, **hints):
+        ''' The primary, unless the write is about an object from another
+        database that is not a replica, as when migrating that one. '''
+        _state.wrote = True
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db not in (None, *settings.DATABASE_REPLICAS):
+            return instance._state.db
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        ''' The replicas hold the same rows as the primary. '''
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+def is_pinned(request):
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+class ReplicaMiddleware:
+    ''' Should come before the middleware that reads from the database,
+    like SessionMiddleware. '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        is_safe = request.method in SAFE_METHODS
+        _state.replica = CHOOSE if is_safe and not is_pinned(request) else None
+        _state.wrote = False
+        try:
+            response = self.get_response(request)
+            wrote = _state.wrote
+        finally:
+            _state.replica = None
+            _state.wrote = False
+
+        if not is_safe or wrote:
+            pin_seconds = settings.REPLICA_PIN_SECONDS
+            response.set_cookie(
+                PIN_COOKIE, "{:.0f}".format(time.time() + pin_seconds),
+                max_age=pin_seconds, httponly=True, samesite='Lax',
+            )
+        return response
+
+
+# ---------------------------------- #
+# ------------- METRICS ------------ #
+# ---------------------------------- #
+
+
+def format_lag_metrics():
+    ''' The lag of each replica as Prometheus gauges. A replica that can
+    not be reached or is not receiving WAL is down, and has no lag. '''
+    lines = []
+    lags = {alias: replica_status.get_lag(alias) for alias in settings.DATABASE_REPLICAS}
+    if not lags:
+        return ""
+    lines.append("# TYPE hittalaget_replica_up gauge")
+    for alias, lag in lags.items():
+        lines.append('hittalaget_replica_up{{db="{}"}} {}'.format(alias, int(lag is not None)))
+    lines.append("# TYPE hittalaget_replica_lag_seconds gauge")
+    for alias, lag in lags.items():
+        if lag is not None:
+            lines.append('hittalaget_replica_lag_seconds{{db="{}"}} {}'.format(alias, lag))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,189 @@
+''' Serving the media and static files when DEBUG is off.
+
+django.conf.urls.static only serves files while DEBUG is on, and reads
+them through Python. In production the files are served by the view
+below, in one of three ways, picked by settings.FILE_SERVING:
+
+"x-accel-redirect": the response only carries an X-Accel-Redirect
+    header, and nginx sends the file from an internal location, which
+    is FILE_SERVING_ACCEL_PREFIX followed by the URL prefix of the files
+    ("/internal/media/" for MEDIA_URL "/media/").
+"x-sendfile": the same with an X-Sendfile header holding the path of
+    the file, for Apache (mod_xsendfile) and lighttpd.
+"django": the file is sent by the WSGI server. Servers with a
+    wsgi.file_wrapper, like gunicorn, send it with os.sendfile(), so the
+    file is never copied through Python.
+
+In every mode the view answers conditional requests itself from the
+stat() of the file, and in the "django" mode it answers single range
+requests too. The ETag is made the way nginx makes it, so it is the same
+whichever way the file was sent. '''
+
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.urls import re_path
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+
+FILE_SERVING_MODES = ("django", "x-accel-redirect", "x-sendfile")
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class FileRange:
+    ''' The part of an open file from `start`, `length` bytes long.
+
+    It is left at `start`, so a server that sends the file with sendfile()
+    starts from there, and stops after Content-Length bytes. Other servers
+    read it, and read() stops at the end of the range. '''
+
+    def __init__(self, f, start, length):
+        f.seek(start)
+        self.file = f
+        self.remaining = length
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def make_etag(stat):
+    return '"{:x}-{:x}"'.format(int(stat.st_mtime), stat.st_size)
+
+
+def parse_range(header, size):
+    ''' Return (start, length) of a single byte range, None if the header
+    should be ignored, or False if the range can not be satisfied.
+    Requests for several ranges get the whole file. '''
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        ''' A suffix: the last `last` bytes. '''
+        length = min(int(last), size)
+        if length == 0:
+            return False
+        return size - length, length
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return False
+    return start, end - start + 1
+
+
+def _range_applies(request, etag, mtime):
+    ''' If-Range asks for the range only if the file is unchanged. '''
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == int(mtime)
+
+
+def _set_headers(response, etag, mtime, max_age):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(mtime)
+    patch_cache_control(response, public=True, max_age=max_age)
+    return response
+
+
+def serve(request, path, document_root, max_age, accel_location=None):
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        full_path = safe_join(str(document_root), path)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError, ValueError):
+        raise Http404("Filen finns inte.")
+    if not os.path.isfile(full_path):
+        raise Http404("Filen finns inte.")
+
+    etag = make_etag(stat)
+    mtime = int(stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=mtime)
+    if response is not None:
+        return _set_headers(response, etag, mtime, max_age)
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+    mode = settings.FILE_SERVING
+
+    if mode == "x-accel-redirect":
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = accel_location + quote(path)
+    elif mode == "x-sendfile":
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+    else:
+        size = stat.st_size
+        byte_range = None
+        if 'HTTP_RANGE' in request.META and _range_applies(request, etag, mtime):
+            byte_range = parse_range(request.META['HTTP_RANGE'], size)
+
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = "bytes */{}".format(size)
+            response['Accept-Ranges'] = "bytes"
+            return response
+
+        start, length = byte_range or (0, size)
+        if request.method == "HEAD":
+            response = HttpResponse(content_type=content_type)
+        else:
+            ''' Unbuffered, so that the position of the file descriptor
+            is where the range starts. '''
+            f = open(full_path, 'rb', buffering=0)
+            response = FileResponse(FileRange(f, start, length), content_type=content_type)
+        if byte_range:
+            response.status_code = 206
+            response['Content-Range'] = "bytes {}-{}/{}".format(start, start + length - 1, size)
+        response['Content-Length'] = length
+        response['Accept-Ranges'] = "bytes"
+
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return _set_headers(response, etag, mtime, max_age)
+
+
+def _pattern(prefix, document_root, max_age):
+    prefix = prefix.lstrip('/')
+    return re_path(r'^{}(?P<path>.*)$'.format(re.escape(prefix)), serve, kwargs={
+        "document_root": document_root,
+        "max_age": max_age,
+        "accel_location": settings.FILE_SERVING_ACCEL_PREFIX + prefix,
+    })
+
+
+def file_urlpatterns():
+    ''' The URL patterns of the media and static files. While DEBUG is on
+    they are served by django.conf.urls.static and staticfiles instead. '''
+    if settings.DEBUG:
+        return []
+    if settings.FILE_SERVING not in FILE_SERVING_MODES:
+        raise ValueError("FILE_SERVING must be one of {}.".format(", ".join(FILE_SERVING_MODES)))
+    return [
+        _pattern(settings.MEDIA_URL, settings.MEDIA_ROOT, settings.MEDIA_MAX_AGE),
+        _pattern(settings.STATIC_URL, settings.STATIC_ROOT, settings.STATIC_MAX_AGE),
+    ]
@@ -0,0 +1,123 @@
+''' Resized WebP renditions of the uploaded player and team images.
+
+An upload is stored as it is, and the renditions are made from it by a
+background job once the row is committed, so the request that uploads
+an image never waits for Pillow. Each rendition is at most one of
+RENDITION_WIDTHS pixels wide (never wider than the original), turned
+the way its EXIF orientation says, and saved as WebP without the EXIF
+data, which can hold the location the photo was taken at.
+
+The widths that are done are stored on the row in `image_renditions`.
+Until then it is empty and the templates show the original. '''
+
+import io
+import logging
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models.signals import post_init, post_save, pre_save
+from PIL import Image, ImageOps
+
+from .jobs import enqueue, job
+
+logger = logging.getLogger(__name__)
+
+RENDITION_WIDTHS = (80, 160, 320, 640)
+RENDITION_QUALITY = 80
+
+
+def rendition_name(name, width):
+    ''' The extension is kept, so a.png and a.jpg get renditions of their
+    own. '''
+    return "renditions/{}-{}.webp".format(name, width)
+
+
+def rendition_url(name, width):
+    return default_storage.url(rendition_name(name, width))
+
+
+def create_renditions(name):
+    ''' Make the renditions of the image `name` in the default storage,
+    and return their widths. '''
+    with default_storage.open(name, "rb") as f:
+        image = Image.open(f)
+        image.load()
+
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "RGBA"):
+        has_alpha = image.mode in ("LA", "PA") or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+
+    widths = sorted({min(width, image.width) for width in RENDITION_WIDTHS})
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.LANCZOS) if width != image.width else image
+        buffer = io.BytesIO()
+        ''' Pillow only writes EXIF data when it is passed to save(). '''
+        resized.save(buffer, "WEBP", quality=RENDITION_QUALITY, method=4)
+
+        path = rendition_name(name, width)
+        if default_storage.exists(path):
+            default_storage.delete(path)
+        default_storage.save(path, ContentFile(buffer.getvalue()))
+    return widths
+
+
+@job("core.update_renditions")
+def update_renditions(model_label, pk, name):
+    ''' Make the renditions of the image of a row, unless the image has
+    been changed since. '''
+    model = apps.get_model(model_label)
+    if not model.objects.filter(pk=pk, image=name).exists():
+        return
+    try:
+        widths = create_renditions(name)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        ''' Not an image Pillow can read, or one so large that it would
+        use up the memory of the worker. Trying again will not help. '''
+        logger.exception("Could not make the renditions of %s.", name)
+        return
+
+    instance = model.objects.filter(pk=pk, image=name).first()
+    if instance is not None:
+        instance.image_renditions = widths
+        ''' Saved with update_fields, so that the signals that only care
+        about other fields can skip it. '''
+        instance.save(update_fields=['image_renditions'])
+
+
+# ---------------------------------- #
+# ------------- SIGNALS ------------ #
+# ---------------------------------- #
+
+
+def post_init_image_name(sender, instance, **kwargs):
+    instance._loaded_image_name = instance.image.name if 'image' in instance.__dict__ else None
+
+
+def pre_save_image_changed(sender, instance, update_fields=None, **kwargs):
+    ''' The renditions of the old image no longer apply. '''
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    if instance.image.name != getattr(instance, '_loaded_image_name', None):
+        instance.image_renditions = []
+
+
+def post_save_image_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    name = instance.image.name
+    if not name or name == getattr(instance, '_loaded_image_name', None):
+        return
+    instance._loaded_image_name = name
+    enqueue("core.update_renditions", args=[instance._meta.label, instance.pk, name])
+
+
+def connect_image_renditions(model):
+    ''' Make renditions of the image of every row of the model that is
+    saved with a new image. The model needs an `image` and an
+    `image_renditions` field. '''
+    post_init.connect(post_init_image_name, sender=model)
+    pre_save.connect(pre_save_image_changed, sender=model)
+    post_save.connect(post_save_image_changed, sender=model)
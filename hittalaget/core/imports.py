@@ -0,0 +1,362 @@
+''' Bulk import of teams, players and ads, e.g. when a federation is
+onboarded.
+
+Rows are read as dicts and inserted in batches with bulk_create, which
+skips the save() signals. Whatever those signals would have done per
+row is done per batch instead: public IDs are allocated with one query,
+slugs and ad titles are built from lookups made once per batch, the
+positions of players are inserted together, and the search vectors are
+filled in with one UPDATE.
+
+A row that can not be imported (an unknown user, an invalid choice, a
+profile that already exists...) is skipped and reported, and the rest
+of the batch is imported. Each batch is its own transaction: if the
+database refuses it, its rows are reported and the next batch is
+imported. '''
+
+import csv
+import json
+
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError, transaction
+from django.utils.text import slugify
+
+from hittalaget.ads.matching import invalidate_positions
+from hittalaget.ads.models import AD_SEARCH_VECTOR, Ad
+from hittalaget.core.jobs import enqueue_many
+from hittalaget.core.public_ids import allocate_public_ids
+from hittalaget.core.reference import SPORT_CHOICES, get_cities, get_reference_data, get_values, invalidate
+from hittalaget.players.models import Player
+from hittalaget.teams.models import TEAM_SEARCH_VECTOR, Team
+from hittalaget.users.models import City
+
+User = get_user_model()
+
+BATCH_SIZE = 5000
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.errors = []
+
+    def add_error(self, number, message):
+        self.errors.append((number, message))
+
+    def add_batch_error(self, numbers, error):
+        for number in numbers:
+            self.add_error(number, "not imported with its batch: {}".format(error))
+
+
+# ---------------------------------- #
+# ------------- READING ------------ #
+# ---------------------------------- #
+
+
+def read_rows(path, format=None):
+    ''' Yield the rows of a .csv or .jsonl file as dicts. '''
+    format = format or path.rsplit(".", 1)[-1].lower()
+    with open(path, newline="", encoding="utf-8") as f:
+        if format == "csv":
+            yield from csv.DictReader(f)
+        elif format == "jsonl":
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            raise ValueError("Unknown format: {}".format(format))
+
+
+def _batches(rows, size):
+    ''' Yield lists of (number, row), numbering the rows from 1. '''
+    batch = []
+    for number, row in enumerate(rows, start=1):
+        batch.append((number, row))
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# ---------------------------------- #
+# ------------ VALIDATION ---------- #
+# ---------------------------------- #
+
+
+def _required(row, field):
+    value = row.get(field)
+    if value is None or str(value).strip() == "":
+        raise InvalidRow("{} is missing".format(field))
+    return str(value).strip()
+
+
+def _integer(row, field):
+    value = _required(row, field)
+    try:
+        number = int(value)
+    except ValueError:
+        raise InvalidRow("{} is not a number: {}".format(field, value))
+    if number < 0:
+        raise InvalidRow("{} is negative: {}".format(field, value))
+    return number
+
+
+def _boolean(row, field):
+    value = row.get(field, False)
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "true", "ja", "yes")
+
+
+def _choice(row, field, choices):
+    value = _required(row, field)
+    if value not in choices:
+        raise InvalidRow("{} is not a valid choice: {}".format(field, value))
+    return value
+
+
+def _sport(row):
+    return _choice(row, "sport", SPORT_CHOICES)
+
+
+def _positions(row):
+    ''' Positions are a list in JSONL, and separated by ";" in CSV. '''
+    value = row.get("positions") or []
+    if isinstance(value, str):
+        value = value.split(";")
+    return [name.strip() for name in value if name.strip()]
+
+
+def _get_cities(names):
+    ''' Return {name: pk}, creating the cities that do not exist. '''
+    cities = {city.name: city.pk for city in get_cities()}
+    missing = set(names) - set(cities)
+    if missing:
+        City.objects.bulk_create([City(name=name) for name in missing], ignore_conflicts=True)
+        cities.update(City.objects.filter(name__in=missing).values_list('name', 'pk'))
+        ''' bulk_create does not send the signals that reload the
+        reference data. '''
+        invalidate()
+    return cities
+
+
+def _get_positions():
+    return {
+        (position.sport, position.name): position.pk
+        for position in get_reference_data().positions_by_pk.values()
+    }
+
+
+# ---------------------------------- #
+# ------------- IMPORTERS ---------- #
+# ---------------------------------- #
+
+
+def import_teams(rows, batch_size=BATCH_SIZE):
+    ''' Rows: username (the owner), sport, name, city, founded, home,
+    level, and optionally website and is_looking. '''
+    result = ImportResult()
+
+    for batch in _batches(rows, batch_size):
+        users = dict(User.objects.filter(
+            username__in={str(row.get("username")) for number, row in batch}
+        ).values_list('username', 'pk'))
+        existing = set(Team.objects.filter(user__in=users.values()).values_list('user', 'sport'))
+        cities = _get_cities({str(row.get("city", "")).strip() for number, row in batch} - {""})
+
+        teams = []
+        numbers = []
+        for number, row in batch:
+            try:
+                username = _required(row, "username")
+                sport = _sport(row)
+                if username not in users:
+                    raise InvalidRow("unknown user: {}".format(username))
+                if (users[username], sport) in existing:
+                    raise InvalidRow("{} already has a team for {}".format(username, sport))
+                name = _required(row, "name")
+                team = Team(
+                    user_id=users[username],
+                    sport=sport,
+                    name=name,
+                    slug=slugify(name),
+                    city_id=cities[_required(row, "city")],
+                    founded=_integer(row, "founded"),
+                    home=_required(row, "home"),
+                    level=_choice(row, "level", get_values(sport, "level")),
+                    website=str(row.get("website") or ""),
+                    is_looking=_boolean(row, "is_looking"),
+                )
+            except InvalidRow as e:
+                result.add_error(number, str(e))
+                continue
+            existing.add((team.user_id, sport))
+            teams.append(team)
+            numbers.append(number)
+
+        if not teams:
+            continue
+        try:
+            with transaction.atomic():
+                for team, team_id in zip(teams, allocate_public_ids("team", len(teams))):
+                    team.team_id = team_id
+                Team.objects.bulk_create(teams)
+                Team.objects.filter(pk__in=[team.pk for team in teams]).update(search_vector=TEAM_SEARCH_VECTOR)
+        except DatabaseError as e:
+            result.add_batch_error(numbers, e)
+            continue
+        result.created += len(teams)
+
+    return result
+
+
+def import_players(rows, batch_size=BATCH_SIZE):
+    ''' Rows: username, sport, positions, side, experience,
+    special_ability, and optionally is_available. '''
+    result = ImportResult()
+    positions = _get_positions()
+
+    for batch in _batches(rows, batch_size):
+        users = {user["username"]: user for user in User.objects.filter(
+            username__in={str(row.get("username")) for number, row in batch}
+        ).values('pk', 'username', 'city_id', 'birthday', 'height')}
+        existing = set(Player.objects.filter(
+            user__in=[user["pk"] for user in users.values()]
+        ).values_list('user', 'sport'))
+
+        players = []
+        numbers = []
+        for number, row in batch:
+            try:
+                username = _required(row, "username")
+                sport = _sport(row)
+                user = users.get(username)
+                if user is None:
+                    raise InvalidRow("unknown user: {}".format(username))
+                if (user["pk"], sport) in existing:
+                    raise InvalidRow("{} already has a player profile for {}".format(username, sport))
+                position_ids = []
+                for name in _positions(row):
+                    if (sport, name) not in positions:
+                        raise InvalidRow("unknown position: {}".format(name))
+                    position_ids.append(positions[(sport, name)])
+                player = Player(
+                    user_id=user["pk"],
+                    username=username,
+                    sport=sport,
+                    side=_choice(row, "side", get_values(sport, "side")),
+                    experience=_choice(row, "experience", get_values(sport, "experience")),
+                    special_ability=_choice(row, "special_ability", get_values(sport, "special_ability")),
+                    is_available=_boolean(row, "is_available"),
+                    city_id=user["city_id"],
+                    birthday=user["birthday"],
+                    height=user["height"],
+                )
+            except InvalidRow as e:
+                result.add_error(number, str(e))
+                continue
+            existing.add((user["pk"], sport))
+            players.append((player, position_ids))
+            numbers.append(number)
+
+        if not players:
+            continue
+        try:
+            with transaction.atomic():
+                Player.objects.bulk_create([player for player, position_ids in players])
+                Player.positions.through.objects.bulk_create([
+                    Player.positions.through(player_id=player.pk, position_id=position_id)
+                    for player, position_ids in players
+                    for position_id in set(position_ids)
+                ])
+        except DatabaseError as e:
+            result.add_batch_error(numbers, e)
+            continue
+        invalidate_positions({pk for player, position_ids in players for pk in position_ids})
+        ''' The available players are added to the matches of the ads
+        that are already there. '''
+        enqueue_many("ads.refresh_player_matches", [
+            [player.pk] for player, position_ids in players if player.is_available
+        ])
+        result.created += len(players)
+
+    return result
+
+
+def import_ads(rows, batch_size=BATCH_SIZE):
+    ''' Rows: username (the owner of the team), sport, position,
+    description, max_age, min_height, min_experience and
+    special_ability. '''
+    result = ImportResult()
+    positions = _get_positions()
+    position_names = {pk: name for (sport, name), pk in positions.items()}
+
+    for batch in _batches(rows, batch_size):
+        teams = {
+            (username, sport): (pk, name)
+            for username, sport, pk, name in Team.objects.filter(
+                user__username__in={str(row.get("username")) for number, row in batch}
+            ).values_list('user__username', 'sport', 'pk', 'name')
+        }
+
+        ads = []
+        numbers = []
+        for number, row in batch:
+            try:
+                username = _required(row, "username")
+                sport = _sport(row)
+                if (username, sport) not in teams:
+                    raise InvalidRow("{} has no team for {}".format(username, sport))
+                team_id, team_name = teams[(username, sport)]
+                position = _required(row, "position")
+                if (sport, position) not in positions:
+                    raise InvalidRow("unknown position: {}".format(position))
+                position_id = positions[(sport, position)]
+                title = "{} söker {}".format(team_name, position_names[position_id])
+                ad = Ad(
+                    team_id=team_id,
+                    sport=sport,
+                    title=title,
+                    slug=slugify(title),
+                    description=_required(row, "description"),
+                    max_age=_integer(row, "max_age"),
+                    min_height=_integer(row, "min_height"),
+                    position_id=position_id,
+                    min_experience=_choice(row, "min_experience", get_values(sport, "experience")),
+                    special_ability=_choice(row, "special_ability", get_values(sport, "special_ability")),
+                )
+            except InvalidRow as e:
+                result.add_error(number, str(e))
+                continue
+            ads.append(ad)
+            numbers.append(number)
+
+        if not ads:
+            continue
+        try:
+            with transaction.atomic():
+                for ad, ad_id in zip(ads, allocate_public_ids("ad", len(ads))):
+                    ad.ad_id = ad_id
+                Ad.objects.bulk_create(ads)
+                Ad.objects.filter(pk__in=[ad.pk for ad in ads]).update(search_vector=AD_SEARCH_VECTOR)
+        except DatabaseError as e:
+            result.add_batch_error(numbers, e)
+            continue
+        ''' The matching players are stored by the jobs, as they are for
+        the ads that are saved. '''
+        enqueue_many("ads.refresh_ad_matches", [[ad.pk] for ad in ads])
+        result.created += len(ads)
+
+    return result
+
+
+IMPORTERS = {
+    "teams": import_teams,
+    "players": import_players,
+    "ads": import_ads,
+}
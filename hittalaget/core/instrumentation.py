@@ -0,0 +1,371 @@
+''' Timing and SQL instrumentation of every request, without DEBUG.
+
+InstrumentationMiddleware measures, for each request to a resolved URL,
+the number of queries, the time spent in SQL, the time spent rendering
+the template of a TemplateResponse (including the queries made from the
+template) and the total time. They are sent back in a Server-Timing
+header, so the browser's developer tools show them, and added to a
+histogram per view name.
+
+A request that runs the same query, with different parameters, at least
+N_PLUS_ONE_THRESHOLD times is most likely loading a relation once per
+row (an N+1). It is logged with the query and counted per view.
+
+Each process sums its requests in memory, and adds the sums to the
+ViewMetric rows every METRICS_FLUSH_INTERVAL seconds with one upsert,
+in the background. The rows hold the totals of all processes, which
+metrics_view exports in the Prometheus text format.
+
+The connection pools of the process are flushed at the same time, to a
+PoolMetric row per database and process. The counters are added up
+over every row. The connections in use and idle are added up over the
+processes that flushed in the last POOL_METRICS_MAX_AGE seconds, since
+the others have stopped or been idle. '''
+
+import logging
+import os
+import re
+import socket
+import threading
+import time
+from contextlib import ExitStack
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import Count, Q, Sum
+from django.http import Http404, HttpResponse
+from django.utils import timezone
+
+from .background import run_in_background
+from .db.pool import POOL_COUNTERS, take_pool_stats
+from .db.routers import format_lag_metrics
+from .models import PoolMetric, ViewMetric
+
+logger = logging.getLogger(__name__)
+
+N_PLUS_ONE_THRESHOLD = 10
+METRICS_FLUSH_INTERVAL = 10
+POOL_METRICS_MAX_AGE = 60
+
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+''' The histograms of each view, and the upper bounds of their buckets.
+There is one more bucket, for everything above the last bound. '''
+METRICS = {
+    "queries": COUNT_BUCKETS,
+    "sql_seconds": SECONDS_BUCKETS,
+    "template_seconds": SECONDS_BUCKETS,
+    "total_seconds": SECONDS_BUCKETS,
+    "n_plus_one_queries": COUNT_BUCKETS,
+}
+
+''' Parameter lists of different lengths, like IN (%s, %s), are the
+same query. '''
+PARAMETER_LIST_RE = re.compile(r'%s(?:\s*,\s*%s)+')
+
+
+def get_query_shape(sql):
+    return PARAMETER_LIST_RE.sub('%s, ...', sql)
+
+
+class QueryRecorder:
+    ''' An execute wrapper that counts and times the queries of a
+    request. '''
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0
+        self.shapes = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+            shape = get_query_shape(sql)
+            self.shapes[shape] = self.shapes.get(shape, 0) + 1
+
+    def get_repeated(self):
+        ''' Return (count, shape) of the query run most often, if it looks
+        like an N+1. '''
+        if not self.shapes:
+            return None
+        shape, count = max(self.shapes.items(), key=lambda item: item[1])
+        if count < N_PLUS_ONE_THRESHOLD:
+            return None
+        return count, shape
+
+
+class Histogram:
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        index = len(self.bounds)
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                index = i
+                break
+        self.buckets[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Metrics:
+    ''' The sums of this process since they were last flushed. '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.flushed_at = time.monotonic()
+
+    def observe(self, view_name, values):
+        with self.lock:
+            for metric, value in values.items():
+                key = (view_name, metric)
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(METRICS[metric])
+                self.histograms[key].observe(value)
+
+            if time.monotonic() - self.flushed_at < METRICS_FLUSH_INTERVAL:
+                return
+            histograms, self.histograms = self.histograms, {}
+            self.flushed_at = time.monotonic()
+        run_in_background(flush, histograms)
+
+
+metrics = Metrics()
+
+
+def flush(histograms):
+    flush_histograms(histograms)
+    flush_pools()
+
+
+def flush_histograms(histograms):
+    ''' Add the histograms to the ViewMetric rows, creating the ones that
+    are missing. '''
+    if not histograms:
+        return
+    rows = []
+    params = []
+    for (view_name, metric), histogram in sorted(histograms.items()):
+        rows.append("(%s, %s, %s, %s, %s::bigint[])")
+        params.extend([view_name, metric, histogram.count, histogram.sum, histogram.buckets])
+
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO {table} AS m (view_name, metric, count, sum, buckets)
+            VALUES {rows}
+            ON CONFLICT (view_name, metric) DO UPDATE SET
+                count = m.count + EXCLUDED.count,
+                sum = m.sum + EXCLUDED.sum,
+                buckets = CASE WHEN cardinality(m.buckets) = cardinality(EXCLUDED.buckets)
+                    THEN ARRAY(
+                        SELECT a + b FROM unnest(m.buckets, EXCLUDED.buckets) WITH ORDINALITY AS u(a, b, i)
+                        ORDER BY i
+                    )
+                    ELSE EXCLUDED.buckets END
+        """.format(table=ViewMetric._meta.db_table, rows=", ".join(rows)), params)
+
+
+def get_process_name():
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+def flush_pools():
+    ''' Store the connections of the pools of this process in its
+    PoolMetric rows, and add to their counters. '''
+    stats = take_pool_stats()
+    if not stats:
+        return
+    columns = ("in_use", "idle", "max_size") + POOL_COUNTERS
+    rows = []
+    params = []
+    process = get_process_name()
+    now = timezone.now()
+    for db, values in sorted(stats.items()):
+        rows.append("({})".format(", ".join(["%s"] * (len(columns) + 3))))
+        params.extend([db, process] + [values[column] for column in columns] + [now])
+
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO {table} AS m (db, process, {columns}, updated)
+            VALUES {rows}
+            ON CONFLICT (db, process) DO UPDATE SET
+                in_use = EXCLUDED.in_use,
+                idle = EXCLUDED.idle,
+                max_size = EXCLUDED.max_size,
+                {counters},
+                updated = EXCLUDED.updated
+        """.format(
+            table=PoolMetric._meta.db_table,
+            columns=", ".join(columns),
+            rows=", ".join(rows),
+            counters=", ".join("{0} = m.{0} + EXCLUDED.{0}".format(name) for name in POOL_COUNTERS),
+        ), params)
+
+
+def retire_pool_metrics(max_age=60 * 60 * 24):
+    ''' Add the counters of the processes that have not flushed for
+    max_age seconds to the row of their database with an empty process,
+    and delete their rows. '''
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            WITH retired AS (
+                DELETE FROM {table} WHERE process <> '' AND updated < %s RETURNING *
+            )
+            INSERT INTO {table} AS m (db, process, in_use, idle, max_size, {counters}, updated)
+            SELECT db, '', 0, 0, 0, {sums}, %s FROM retired GROUP BY db
+            ON CONFLICT (db, process) DO UPDATE SET {updates}, updated = EXCLUDED.updated
+        """.format(
+            table=PoolMetric._meta.db_table,
+            counters=", ".join(POOL_COUNTERS),
+            sums=", ".join("sum({})".format(name) for name in POOL_COUNTERS),
+            updates=", ".join("{0} = m.{0} + EXCLUDED.{0}".format(name) for name in POOL_COUNTERS),
+        ), [timezone.now() - timedelta(seconds=max_age), timezone.now()])
+
+
+def format_server_timing(values, recorder):
+    return ", ".join([
+        'db;dur={:.1f};desc="{} queries"'.format(values["sql_seconds"] * 1000, recorder.count),
+        'tpl;dur={:.1f}'.format(values["template_seconds"] * 1000),
+        'total;dur={:.1f}'.format(values["total_seconds"] * 1000),
+    ])
+
+
+class InstrumentationMiddleware:
+    ''' Should come first in MIDDLEWARE, so the total time covers the
+    other middleware as well. '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        recorder = QueryRecorder()
+        request.template_seconds = 0
+        with ExitStack() as stack:
+            ''' Every database, in case queries go to more than one. '''
+            for db in connections.all():
+                stack.enter_context(db.execute_wrapper(recorder))
+            response = self.get_response(request)
+        total = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return response
+
+        values = {
+            "queries": recorder.count,
+            "sql_seconds": recorder.seconds,
+            "template_seconds": request.template_seconds,
+            "total_seconds": total,
+        }
+        repeated = recorder.get_repeated()
+        if repeated is not None:
+            count, shape = repeated
+            values["n_plus_one_queries"] = count
+            logger.warning("Likely N+1 in %s: %s queries like %s", match.view_name, count, shape)
+
+        response['Server-Timing'] = format_server_timing(values, recorder)
+        metrics.observe(match.view_name, values)
+        return response
+
+    def process_template_response(self, request, response):
+        ''' Called right before the template is rendered. The callback is
+        called right after. '''
+        start = time.perf_counter()
+
+        def rendered(response):
+            request.template_seconds += time.perf_counter() - start
+        response.add_post_render_callback(rendered)
+        return response
+
+
+# ---------------------------------- #
+# ------------ METRICS ------------- #
+# ---------------------------------- #
+
+
+def format_bound(bound):
+    return "{:g}".format(bound)
+
+
+def format_metrics(rows):
+    ''' The rows as Prometheus histograms, one per metric, labelled with
+    the view name. '''
+    lines = []
+    by_metric = {}
+    for row in rows:
+        by_metric.setdefault(row.metric, []).append(row)
+
+    for metric, metric_rows in sorted(by_metric.items()):
+        name = "hittalaget_view_{}".format(metric)
+        bounds = METRICS.get(metric, ())
+        lines.append("# TYPE {} histogram".format(name))
+        for row in metric_rows:
+            view = row.view_name.replace('\\', '\\\\').replace('"', '\\"')
+            cumulative = 0
+            for bound, count in zip(list(bounds) + ["+Inf"], row.buckets):
+                cumulative += count
+                le = bound if bound == "+Inf" else format_bound(bound)
+                lines.append('{}_bucket{{view="{}",le="{}"}} {}'.format(name, view, le, cumulative))
+            lines.append('{}_sum{{view="{}"}} {}'.format(name, view, row.sum))
+            lines.append('{}_count{{view="{}"}} {}'.format(name, view, row.count))
+    return "\n".join(lines) + "\n"
+
+
+def format_pool_metrics():
+    ''' The pools of every process as Prometheus metrics, labelled with
+    the database. '''
+    live = Q(updated__gte=timezone.now() - timedelta(seconds=POOL_METRICS_MAX_AGE)) & ~Q(process="")
+    totals = {"total_{}".format(name): Sum(name) for name in POOL_COUNTERS}
+    totals.update({"live_{}".format(name): Sum(name, filter=live) for name in ("in_use", "idle", "max_size")})
+    rows = list(PoolMetric.objects.order_by('db').values('db').annotate(processes=Count('pk', filter=live), **totals))
+    if not rows:
+        return ""
+
+    metrics = [
+        ("hittalaget_db_pool_processes", "gauge", lambda row: [("", row["processes"])]),
+        ("hittalaget_db_pool_connections", "gauge", lambda row: [
+            ('state="in_use"', row["live_in_use"] or 0),
+            ('state="idle"', row["live_idle"] or 0),
+        ]),
+        ("hittalaget_db_pool_max_connections", "gauge", lambda row: [("", row["live_max_size"] or 0)]),
+    ] + [
+        ("hittalaget_db_pool_{}_total".format(name), "counter", lambda row, name=name: [("", row["total_" + name])])
+        for name in POOL_COUNTERS
+    ]
+    lines = []
+    for name, kind, get_values in metrics:
+        lines.append("# TYPE {} {}".format(name, kind))
+        for row in rows:
+            for labels, value in get_values(row):
+                labels = ",".join(filter(None, ['db="{}"'.format(row["db"]), labels]))
+                lines.append("{}{{{}}} {}".format(name, labels, value))
+    return "\n".join(lines) + "\n"
+
+
+def can_see_metrics(request):
+    ''' Staff, or a scraper with the token in METRICS_TOKEN. '''
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    token = settings.METRICS_TOKEN
+    return bool(token) and request.META.get('HTTP_AUTHORIZATION') == "Bearer {}".format(token)
+
+
+def metrics_view(request):
+    if not can_see_metrics(request):
+        raise Http404()
+    rows = ViewMetric.objects.order_by('metric', 'view_name')
+    content = format_metrics(rows) + format_lag_metrics() + format_pool_metrics()
+    return HttpResponse(content, content_type="text/plain; version=0.0.4; charset=utf-8")
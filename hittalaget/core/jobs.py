@@ -0,0 +1,232 @@
+''' Background jobs, with Postgres as the queue.
+
+A job is a row in the Job table naming a function that was registered
+with @job. The runworker command claims the jobs that are due, highest
+priority first, with SELECT ... FOR UPDATE SKIP LOCKED, so any number of
+workers can run side by side without running a job twice. A job runs in
+the transaction that claimed it, and is deleted in it when it is done:
+if the worker dies, the transaction is rolled back and the job is run
+again by another worker.
+
+enqueue() adds a job in the current transaction, so it can be called
+from a signal inside save(): the job only runs if the save commits, and
+never sees the rows before they are committed. The workers are woken up
+with NOTIFY, which Postgres sends on commit as well.
+
+A job that raises is tried again after JOB_RETRY_DELAY seconds, twice as
+long after each failed attempt, and kept with is_failed set once it has
+failed max_attempts times. Periodic jobs are scheduled by the workers
+themselves, and run every `every` seconds whether they fail or not.
+
+The functions are called with the args and kwargs of the job, which are
+stored as JSON, so pass primary keys and names rather than objects. A
+function can run more than once for the same job (after a failure, or
+when a worker dies at the wrong moment), so it should be safe to redo. '''
+
+import logging
+import select
+import signal
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from .instrumentation import retire_pool_metrics
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+JOB_CHANNEL = "jobs"
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_DELAY = 30
+JOB_POLL_INTERVAL = 60
+
+
+class JobType:
+
+    def __init__(self, name, func, priority, max_attempts, every):
+        self.name = name
+        self.func = func
+        self.priority = priority
+        self.max_attempts = max_attempts
+        self.every = every
+
+    @property
+    def periodic_key(self):
+        return "periodic:{}".format(self.name)
+
+
+JOBS = {}
+
+
+def job(name, priority=0, max_attempts=JOB_MAX_ATTEMPTS, every=None):
+    ''' Register the decorated function as the job `name`. With `every`,
+    it is run every that many seconds. '''
+    def decorator(func):
+        JOBS[name] = JobType(name, func, priority, max_attempts, every)
+        return func
+    return decorator
+
+
+def enqueue(name, args=(), kwargs=None, priority=None, run_at=None, key=None):
+    ''' Add a job that calls the function registered as `name`. While a
+    job with the same key waits, adding another one does nothing. '''
+    if name not in JOBS:
+        raise ValueError("Unknown job {}.".format(name))
+    Job.objects.bulk_create([Job(
+        name=name,
+        args=list(args),
+        kwargs=kwargs or {},
+        priority=JOBS[name].priority if priority is None else priority,
+        run_at=run_at or timezone.now(),
+        key=key,
+    )], ignore_conflicts=key is not None)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_notify(%s, '')", [JOB_CHANNEL])
+
+
+def enqueue_many(name, args_list, batch_size=5000):
+    ''' Add a job for each of the args in args_list, in batches. '''
+    if name not in JOBS:
+        raise ValueError("Unknown job {}.".format(name))
+    job_type = JOBS[name]
+    now = timezone.now()
+    Job.objects.bulk_create([
+        Job(name=name, args=list(args), kwargs={}, priority=job_type.priority, run_at=now)
+        for args in args_list
+    ], batch_size=batch_size)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_notify(%s, '')", [JOB_CHANNEL])
+
+
+def schedule_periodic_jobs():
+    ''' Add the periodic jobs that are not in the table yet. '''
+    Job.objects.bulk_create([
+        Job(name=job_type.name, priority=job_type.priority, key=job_type.periodic_key)
+        for job_type in JOBS.values() if job_type.every
+    ], ignore_conflicts=True)
+
+
+def _done(job, job_type):
+    if job_type.every:
+        job.run_at = timezone.now() + timedelta(seconds=job_type.every)
+        job.attempts = 0
+        job.save(update_fields=['run_at', 'attempts'])
+    else:
+        job.delete()
+
+
+def _failed(job, job_type, error):
+    job.attempts += 1
+    job.last_error = str(error)
+    if job_type is not None and job_type.every:
+        job.run_at = timezone.now() + timedelta(seconds=job_type.every)
+    elif job.attempts >= (job_type.max_attempts if job_type else JOB_MAX_ATTEMPTS):
+        job.is_failed = True
+    else:
+        job.run_at = timezone.now() + timedelta(seconds=JOB_RETRY_DELAY * 2 ** (job.attempts - 1))
+    job.save(update_fields=['attempts', 'last_error', 'is_failed', 'run_at'])
+
+
+def run_next_job():
+    ''' Run the next job that is due, and return it, or None if there
+    is none. '''
+    with transaction.atomic():
+        job = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(is_failed=False, run_at__lte=timezone.now())
+            .order_by('-priority', 'run_at', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+
+        job_type = JOBS.get(job.name)
+        try:
+            if job_type is None:
+                raise LookupError("Unknown job {}.".format(job.name))
+            ''' A savepoint, so that what the job did is rolled back if it
+            fails, while the failure is still recorded. '''
+            with transaction.atomic():
+                job_type.func(*job.args, **job.kwargs)
+        except Exception as e:
+            logger.exception("Job %s (%s) failed.", job.pk, job.name)
+            _failed(job, job_type, e)
+        else:
+            _done(job, job_type)
+    return job
+
+
+def seconds_to_next_job():
+    ''' Seconds until the next job this worker can claim is due. The jobs
+    that other workers are running are skipped: they are due already, and
+    waiting for them would have the worker poll without end. '''
+    with transaction.atomic():
+        run_at = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(is_failed=False)
+            .order_by('run_at').values_list('run_at', flat=True).first()
+        )
+    if run_at is None:
+        return JOB_POLL_INTERVAL
+    return min(max((run_at - timezone.now()).total_seconds(), 0), JOB_POLL_INTERVAL)
+
+
+class Worker:
+    ''' Runs jobs until stopped. Between jobs it sleeps until the next
+    scheduled one is due, or until a new job is enqueued. '''
+
+    def __init__(self):
+        self.stopping = False
+        self.listening = None
+        autodiscover_modules('jobs')
+
+    def stop(self, *args):
+        ''' Stop once the current job is done. '''
+        self.stopping = True
+
+    def listen(self):
+        ''' LISTEN on the connection of the worker, again whenever it has
+        been replaced by a new one. '''
+        connection.ensure_connection()
+        if self.listening is not connection.connection:
+            with connection.cursor() as cursor:
+                cursor.execute("LISTEN {}".format(JOB_CHANNEL))
+            self.listening = connection.connection
+
+    def wait(self, timeout):
+        self.listen()
+        if timeout > 0 and not connection.connection.notifies:
+            select.select([connection.connection], [], [], timeout)
+        connection.connection.poll()
+        del connection.connection.notifies[:]
+
+    def run(self, once=False):
+        ''' With `once`, return when no job is due. '''
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        schedule_periodic_jobs()
+        self.listen()
+        while not self.stopping:
+            if run_next_job() is not None:
+                continue
+            if once:
+                break
+            self.wait(seconds_to_next_job())
+
+
+# ---------------------------------- #
+# -------------- JOBS -------------- #
+# ---------------------------------- #
+
+
+@job("core.clear_sessions", every=60 * 60 * 24)
+def clear_sessions():
+    call_command("clearsessions")
+
+
+@job("core.retire_pool_metrics", every=60 * 60)
+def retire_stopped_pools():
+    retire_pool_metrics()
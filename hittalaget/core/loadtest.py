@@ -0,0 +1,545 @@
+''' The work of the bench_urls command: a load test of every URL name.
+
+Each URL name has a scenario, which picks the rows to ask for from the
+seeded dataset, the user to log in as and, for the views that handle
+forms, what to post. Every scenario is run by `concurrency` threads at
+once, either in this process with the test client, or over HTTP against
+a running server that uses the same database.
+
+The dataset is seeded with seed_market (see seeding.py) and committed,
+since the requests are served by other connections, and kept for the
+next run. Seed it in a database of its own. The queries of each request
+are read from the Server-Timing header of InstrumentationMiddleware, so
+they are counted the same way in both modes.
+
+The POST scenarios send messages and toggle statuses. The rows they
+add are deleted, and the ones they change put back, once each of them
+has run, so every scenario, and the next run, starts from the same
+dataset.
+
+A report can be saved as a baseline, and later reports compared with
+it: a scenario that got slower, served fewer requests per second, made
+more queries or started to fail counts as a regression. '''
+
+import re
+import threading
+import time
+from http.client import HTTPConnection, HTTPSConnection
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+from django.db.models import Max, Q
+from django.http import HttpRequest
+from django.middleware.csrf import get_token
+from django.test import Client
+from django.urls import URLPattern, URLResolver, get_resolver, reverse
+from django.utils import timezone
+
+from hittalaget.conversations.models import AdConversation, AdMessage, InboxEntry, PmConversation, PmMessage
+from hittalaget.emails.models import DigestRequest
+from hittalaget.players.models import History, Player
+from hittalaget.teams.models import Team
+
+from .benchmarks import percentile
+from .models import Job
+from .seeding import seed_market
+
+User = get_user_model()
+
+SPORT = "fotboll"
+
+PREFIX = "load"
+
+''' Each player and each team has a user of its own, and a user in
+three has neither. '''
+DATASET_SIZES = {
+    "users": 350000,
+    "players": 200000,
+    "teams": 50000,
+    "ads": 300000,
+    "pm_conversations": 50000,
+    "ad_conversations": 50000,
+    "messages": 5000000,
+}
+
+''' URL names in these namespaces are not part of the site. '''
+EXCLUDED_NAMESPACES = ("admin", "djdt")
+
+HTTP_TIMEOUT = 30
+
+SERVER_TIMING_QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+
+
+# ---------------------------------- #
+# ------------- DATASET ------------ #
+# ---------------------------------- #
+
+
+def has_dataset():
+    return User.objects.filter(username="{}_1".format(PREFIX)).exists()
+
+
+def seed_dataset(sizes):
+    return seed_market(sizes, prefix=PREFIX)
+
+
+def count_dataset():
+    return {
+        "users": User.objects.count(),
+        "players": Player.objects.count(),
+        "pm_conversations": PmConversation.objects.count(),
+        "ad_conversations": AdConversation.objects.count(),
+    }
+
+
+class Sample:
+    ''' The rows the scenarios ask for. The first user of the dataset is
+    a player, with a private conversation and a conversation about an ad. '''
+
+    def __init__(self):
+        self.player_user = User.objects.get(username="{}_1".format(PREFIX))
+        self.player = Player.objects.get(user=self.player_user, sport=SPORT)
+        self.history = (
+            History.objects.filter(player__sport=SPORT, player__username__startswith="{}_".format(PREFIX))
+            .select_related('player__user').first()
+        )
+        self.history_user = self.history.player.user if self.history else None
+        self.user = (
+            User.objects.filter(username__startswith="{}_".format(PREFIX), player_profiles=None, teams=None)
+            .order_by('-id').first()
+        )
+
+        pm_conversation = PmConversation.objects.filter(users=self.player_user).order_by('id').first()
+        self.partner = None
+        if pm_conversation is not None:
+            self.partner = [name for name in pm_conversation.users_arr if name != self.player_user.username][0]
+
+        self.ad_conversation = (
+            AdConversation.objects.filter(users=self.player_user)
+            .select_related('ad__team__user').order_by('id').first()
+        )
+        self.ad = self.ad_conversation.ad if self.ad_conversation else None
+        self.team = self.ad.team if self.ad else None
+        self.team_user = self.team.user if self.team else None
+
+
+class Snapshot:
+    ''' What a POST scenario of `user` can add or change: the rows of the
+    ADDED models, the inbox entries of the user's conversations, and the
+    statuses of the user's players and teams. restore() puts them back as
+    they were when the snapshot was taken. '''
+    ADDED = (PmConversation, AdConversation, PmMessage, AdMessage, DigestRequest, Job)
+    INBOX_FIELDS = ['last_message_at', 'snippet', 'unread_count']
+
+    def __init__(self, user):
+        self.max_pks = {model: model.objects.aggregate(pk=Max('pk'))['pk'] or 0 for model in self.ADDED}
+        self.inbox = list(InboxEntry.objects.filter(
+            Q(pm_conversation__users=user) | Q(ad_conversation__users=user)
+        ).distinct())
+        self.statuses = [
+            (Player, dict(Player.objects.filter(user=user).values_list('pk', 'is_available')), 'is_available'),
+            (Team, dict(Team.objects.filter(user=user).values_list('pk', 'is_looking')), 'is_looking'),
+        ]
+
+    def restore(self):
+        with transaction.atomic():
+            for model, max_pk in self.max_pks.items():
+                model.objects.filter(pk__gt=max_pk).delete()
+            InboxEntry.objects.bulk_update(self.inbox, self.INBOX_FIELDS)
+
+            ''' Saved, rather than updated, so the matches and caches
+            follow. The jobs that the scenario queued for them are gone. '''
+            for model, values, field in self.statuses:
+                for obj in model.objects.filter(pk__in=values):
+                    if getattr(obj, field) != values[obj.pk]:
+                        setattr(obj, field, values[obj.pk])
+                        obj.save()
+
+
+# ---------------------------------- #
+# ------------ SCENARIOS ----------- #
+# ---------------------------------- #
+
+
+class Target:
+    ''' One request of a scenario, made over and over. '''
+
+    def __init__(self, url_name, kwargs=None, user=None, method="GET", data=None, headers=None):
+        self.url_name = url_name
+        self.path = reverse(url_name, kwargs=kwargs)
+        self.user = user
+        self.method = method
+        self.data = data or {}
+        self.headers = headers or {}
+
+
+MESSAGE = {"content": "Hej! Är platsen i laget fortfarande ledig?"}
+
+
+def metrics_target(s):
+    if not settings.METRICS_TOKEN:
+        return None
+    return Target("metrics", headers={"Authorization": "Bearer {}".format(settings.METRICS_TOKEN)})
+
+
+def pm_target(url_name, **options):
+    return lambda s: s.partner and Target(url_name, kwargs={"username": s.partner}, user=s.player_user, **options)
+
+
+def ad_conversation_target(url_name, **options):
+    return lambda s: s.ad_conversation and Target(
+        url_name, kwargs={"conversation_id": s.ad_conversation.conversation_id}, user=s.player_user, **options
+    )
+
+
+''' A function per URL name, returning the Target of the scenario, or
+None if the dataset has nothing to ask for. '''
+SCENARIOS = {
+    "index": lambda s: Target("index"),
+    "about": lambda s: Target("about"),
+    "contact": lambda s: Target("contact"),
+    "metrics": metrics_target,
+    "password_reset": lambda s: Target("password_reset"),
+    "password_reset_done": lambda s: Target("password_reset_done"),
+    "password_reset_confirm": lambda s: Target("password_reset_confirm", kwargs={"uidb64": "MQ", "token": "x-x"}),
+    "password_reset_complete": lambda s: Target("password_reset_complete"),
+
+    "player:initiate_create": lambda s: Target("player:initiate_create", user=s.user),
+    "player:list": lambda s: Target("player:list", kwargs={"sport": SPORT}),
+    "player:create": lambda s: Target("player:create", kwargs={"sport": SPORT}, user=s.user),
+    "player:update": lambda s: Target("player:update", kwargs={"sport": SPORT}, user=s.player_user),
+    "player:delete": lambda s: Target("player:delete", kwargs={"sport": SPORT}, user=s.player_user),
+    "player:ad_feed": lambda s: Target("player:ad_feed", kwargs={"sport": SPORT}, user=s.player_user),
+    "player:update_status": lambda s: Target(
+        "player:update_status", kwargs={"sport": SPORT}, user=s.player_user, method="POST"
+    ),
+    "player:create_history": lambda s: Target("player:create_history", kwargs={"sport": SPORT}, user=s.player_user),
+    "player:delete_history": lambda s: s.history and Target(
+        "player:delete_history", kwargs={"sport": SPORT, "id": s.history.pk}, user=s.history_user
+    ),
+    "player:detail": lambda s: Target("player:detail", kwargs={"sport": SPORT, "username": s.player.username}),
+
+    "team:initiate_create": lambda s: Target("team:initiate_create", user=s.user),
+    "team:list": lambda s: Target("team:list", kwargs={"sport": SPORT}),
+    "team:create": lambda s: Target("team:create", kwargs={"sport": SPORT}, user=s.user),
+    "team:update": lambda s: s.team and Target("team:update", kwargs={"sport": SPORT}, user=s.team_user),
+    "team:delete": lambda s: s.team and Target("team:delete", kwargs={"sport": SPORT}, user=s.team_user),
+    "team:update_status": lambda s: s.team and Target(
+        "team:update_status", kwargs={"sport": SPORT}, user=s.team_user, method="POST"
+    ),
+    "team:detail": lambda s: s.team and Target(
+        "team:detail", kwargs={"sport": SPORT, "team_id": s.team.team_id, "slug": s.team.slug}
+    ),
+
+    "ad:initiate_create": lambda s: s.team and Target("ad:initiate_create", user=s.team_user),
+    "ad:list": lambda s: Target("ad:list", kwargs={"sport": SPORT}),
+    "ad:create": lambda s: s.team and Target("ad:create", kwargs={"sport": SPORT}, user=s.team_user),
+    "ad:detail": lambda s: s.ad and Target(
+        "ad:detail", kwargs={"sport": SPORT, "ad_id": s.ad.ad_id, "slug": s.ad.slug}
+    ),
+    "ad:delete": lambda s: s.ad and Target(
+        "ad:delete", kwargs={"sport": SPORT, "ad_id": s.ad.ad_id, "slug": s.ad.slug}, user=s.team_user
+    ),
+
+    "conversation:detail": pm_target("conversation:detail"),
+    "conversation:older": pm_target("conversation:older"),
+    "conversation:live": pm_target("conversation:live"),
+    "conversation:create": pm_target("conversation:create", method="POST", data=MESSAGE),
+    "conversation:delete": pm_target("conversation:delete"),
+    "conversation:detail_ad": ad_conversation_target("conversation:detail_ad"),
+    "conversation:older_ad": ad_conversation_target("conversation:older_ad"),
+    "conversation:live_ad": ad_conversation_target("conversation:live_ad"),
+    "conversation:message_ad": ad_conversation_target("conversation:message_ad", method="POST", data=MESSAGE),
+    "conversation:create_ad": lambda s: s.ad and Target(
+        "conversation:create_ad", kwargs={"ad_id": s.ad.ad_id}, user=s.player_user, method="POST", data=MESSAGE
+    ),
+    "conversation:delete_ad": ad_conversation_target("conversation:delete_ad"),
+    "conversation:list": lambda s: Target("conversation:list", kwargs={"label": "pm"}, user=s.player_user),
+
+    "user:register": lambda s: Target("user:register"),
+    "user:login": lambda s: Target("user:login"),
+    "user:logout": lambda s: Target("user:logout"),
+    "user:redirect": lambda s: Target("user:redirect", user=s.player_user),
+    "user:update_account": lambda s: Target("user:update_account", user=s.player_user),
+    "user:delete_account": lambda s: Target("user:delete_account", user=s.player_user),
+    "user:password_change": lambda s: Target("user:password_change", user=s.player_user),
+    "user:detail": lambda s: Target("user:detail", kwargs={"username": s.player_user.username}),
+}
+
+
+def get_url_names(resolver=None, namespace=None):
+    ''' The names of all URL patterns, with their namespaces. '''
+    resolver = resolver or get_resolver()
+    names = []
+    for pattern in resolver.url_patterns:
+        if isinstance(pattern, URLResolver):
+            if pattern.namespace in EXCLUDED_NAMESPACES:
+                continue
+            inner = namespace
+            if pattern.namespace:
+                inner = "{}:{}".format(namespace, pattern.namespace) if namespace else pattern.namespace
+            names.extend(get_url_names(pattern, inner))
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            names.append("{}:{}".format(namespace, pattern.name) if namespace else pattern.name)
+    return names
+
+
+def get_targets(sample):
+    ''' Return the targets, and the URL names that have none with the
+    reason why. '''
+    targets = {}
+    skipped = {}
+    for url_name in get_url_names():
+        if url_name in targets or url_name in skipped:
+            continue
+        scenario = SCENARIOS.get(url_name)
+        if scenario is None:
+            skipped[url_name] = "no scenario"
+            continue
+        target = scenario(sample)
+        if target:
+            targets[url_name] = target
+        else:
+            skipped[url_name] = "nothing to request in the dataset"
+    return targets, skipped
+
+
+# ---------------------------------- #
+# ------------- CLIENTS ------------ #
+# ---------------------------------- #
+
+
+def get_host():
+    ''' A host the site accepts, so the test client is not turned away
+    by ALLOWED_HOSTS. '''
+    for host in settings.ALLOWED_HOSTS:
+        if host != "*":
+            return host.lstrip(".")
+    return "localhost"
+
+
+def inprocess_client(target):
+    ''' Return a function making the request of the target with the test
+    client, logged in as its user. '''
+    ''' An address outside INTERNAL_IPS, so the debug toolbar stays out. '''
+    client = Client(raise_request_exception=False, HTTP_HOST=get_host(), REMOTE_ADDR="192.0.2.1")
+    if target.user is not None:
+        client.force_login(target.user)
+    extra = {"HTTP_{}".format(name.upper().replace("-", "_")): value for name, value in target.headers.items()}
+    method = getattr(client, target.method.lower())
+
+    def send():
+        response = method(target.path, data=target.data, **extra)
+        return response.status_code, response.get('Server-Timing')
+    return send
+
+
+def get_session_cookie(user):
+    ''' The cookie of a new session of the user, saved where the server
+    reads its sessions from. '''
+    client = Client()
+    client.force_login(user)
+    return client.cookies[settings.SESSION_COOKIE_NAME].value
+
+
+def get_csrf_cookie():
+    ''' Return (cookie, token) for a CSRF cookie of our own. '''
+    request = HttpRequest()
+    token = get_token(request)
+    return request.META["CSRF_COOKIE"], token
+
+
+def http_client_factory(base_url, target):
+    ''' Return a function that returns, in each thread, a function making
+    the request of the target over a keep-alive connection. The session
+    is made up front, in this thread. '''
+    parts = urlsplit(base_url)
+    connection_class = HTTPSConnection if parts.scheme == "https" else HTTPConnection
+    path = parts.path.rstrip("/") + target.path
+
+    csrf_cookie, csrf_token = get_csrf_cookie()
+    cookies = {settings.CSRF_COOKIE_NAME: csrf_cookie}
+    if target.user is not None:
+        cookies[settings.SESSION_COOKIE_NAME] = get_session_cookie(target.user)
+
+    headers = dict(target.headers)
+    headers["Cookie"] = "; ".join("{}={}".format(name, value) for name, value in cookies.items())
+    body = None
+    if target.method == "POST":
+        body = urlencode(target.data)
+        headers["Content-Type"] = "application/x-www-form-urlencoded"
+        headers["X-CSRFToken"] = csrf_token
+        headers["Referer"] = base_url
+
+    def factory():
+        connection = connection_class(parts.netloc, timeout=HTTP_TIMEOUT)
+
+        def send():
+            try:
+                connection.request(target.method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+            except Exception:
+                ''' The next request opens a new connection. '''
+                connection.close()
+                raise
+            return response.status, response.getheader('Server-Timing')
+        return send
+    return factory
+
+
+# ---------------------------------- #
+# ------------- RUNNING ------------ #
+# ---------------------------------- #
+
+
+class Recorder:
+    ''' What the threads of one scenario saw. '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.queries = []
+        self.errors = 0
+        self.started = None
+        self.finished = None
+
+    def record(self, seconds, status, server_timing):
+        with self.lock:
+            self.latencies.append(seconds)
+            if status is None or status >= 400:
+                self.errors += 1
+            match = SERVER_TIMING_QUERIES_RE.search(server_timing or "")
+            if match:
+                self.queries.append(int(match.group(1)))
+
+    def mark(self, started, finished):
+        with self.lock:
+            self.started = started if self.started is None else min(self.started, started)
+            self.finished = finished if self.finished is None else max(self.finished, finished)
+
+
+def run_target(factory, requests, concurrency, warmup):
+    ''' Make `requests` requests, split over `concurrency` threads that
+    start together once each has made its warmup requests. Each thread
+    calls factory() for its own client. '''
+    recorder = Recorder()
+    barrier = threading.Barrier(concurrency)
+    counts = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+    failures = []
+
+    def work(count):
+        try:
+            try:
+                send = factory()
+                for _ in range(warmup):
+                    try:
+                        send()
+                    except Exception:
+                        pass
+                barrier.wait()
+            except threading.BrokenBarrierError:
+                return
+            except Exception as e:
+                ''' The other threads would wait for this one forever. '''
+                failures.append(e)
+                barrier.abort()
+                return
+            started = time.perf_counter()
+            for _ in range(count):
+                start = time.perf_counter()
+                try:
+                    status, server_timing = send()
+                except Exception:
+                    status, server_timing = None, None
+                recorder.record(time.perf_counter() - start, status, server_timing)
+            recorder.mark(started, time.perf_counter())
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=work, args=(count,)) for count in counts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if failures:
+        raise failures[0]
+    return recorder
+
+
+def summarize(target, recorder):
+    seconds = (recorder.finished - recorder.started) if recorder.started is not None else 0
+    latencies = [latency * 1000 for latency in recorder.latencies]
+    return {
+        "method": target.method,
+        "path": target.path,
+        "requests": len(latencies),
+        "errors": recorder.errors,
+        "seconds": round(seconds, 3),
+        "requests_per_second": round(len(latencies) / seconds, 1) if seconds else None,
+        "p50_ms": round(percentile(latencies, 50), 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95), 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99), 2) if latencies else None,
+        "queries_per_request": (
+            round(sum(recorder.queries) / len(recorder.queries), 2) if recorder.queries else None
+        ),
+    }
+
+
+def run(targets, requests, concurrency, warmup=1, base_url=None):
+    ''' Run every target, one after the other, and return the report. '''
+    results = {}
+    for url_name, target in sorted(targets.items()):
+        if base_url:
+            factory = http_client_factory(base_url, target)
+        else:
+            factory = lambda target=target: inprocess_client(target)
+        snapshot = Snapshot(target.user) if target.method == "POST" and target.user is not None else None
+        try:
+            results[url_name] = summarize(target, run_target(factory, requests, concurrency, warmup))
+        finally:
+            if snapshot is not None:
+                snapshot.restore()
+    return {
+        "created": timezone.now().isoformat(),
+        "mode": "http" if base_url else "in-process",
+        "concurrency": concurrency,
+        "requests": requests,
+        "debug": settings.DEBUG,
+        "dataset": count_dataset(),
+        "results": results,
+    }
+
+
+# ---------------------------------- #
+# ------------ BASELINES ----------- #
+# ---------------------------------- #
+
+
+def compare(report, baseline, threshold):
+    ''' Return a line for each regression of the report from the
+    baseline. Latency and throughput may be off by `threshold` (0.2 is
+    20 %), queries by as much or by one query, whichever is more. '''
+    regressions = []
+    for url_name, result in sorted(report["results"].items()):
+        base = baseline["results"].get(url_name)
+        if base is None:
+            continue
+
+        if result["errors"] and not base["errors"]:
+            regressions.append("{}: {} failed requests, none in the baseline".format(url_name, result["errors"]))
+
+        if result["p95_ms"] and base["p95_ms"] and result["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            regressions.append("{}: p95 {} ms, baseline {} ms".format(url_name, result["p95_ms"], base["p95_ms"]))
+
+        rps, base_rps = result["requests_per_second"], base["requests_per_second"]
+        if rps and base_rps and rps < base_rps * (1 - threshold):
+            regressions.append("{}: {} requests/s, baseline {}".format(url_name, rps, base_rps))
+
+        queries, base_queries = result["queries_per_request"], base["queries_per_request"]
+        if queries is not None and base_queries is not None:
+            if queries > max(base_queries * (1 + threshold), base_queries + 1):
+                regressions.append("{}: {} queries per request, baseline {}".format(url_name, queries, base_queries))
+    return regressions
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.db import transaction
+
+from hittalaget.core.benchmarks import seed_players, timed
+from hittalaget.core.pagination import KeysetPaginator
+from hittalaget.players.models import Player
+
+
+class Command(BaseCommand):
+    help = ("Compare keyset and OFFSET pagination of the player market from "
+            "page 1 to page --pages. Seeded rows are rolled back afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=10000)
+        parser.add_argument("--per-page", type=int, default=25)
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        pages = options["pages"]
+        per_page = options["per_page"]
+        repeat = options["repeat"]
+
+        with transaction.atomic():
+            ''' About two out of three seeded players are available, so
+            seed a margin on top of that. '''
+            count = pages * per_page * 8 // 5
+            self.stdout.write("Seeding {} players...".format(count))
+            seed_players(count)
+
+            queryset = Player.objects.filter(sport="fotboll", is_available=True)
+            keyset = KeysetPaginator(queryset, per_page, ("-id",))
+            offset = Paginator(queryset.order_by("-id"), per_page)
+
+            depths = [p for p in (1, 10, 100, 1000, 10000, 100000) if p <= pages]
+
+            self.stdout.write("{:>8}  {:>12}  {:>12}".format("page", "keyset ms", "offset ms"))
+            for page_number in depths:
+                if page_number == 1:
+                    cursor = None
+                else:
+                    ''' The cursor a client would hold after reading the
+                    previous page. Looked up outside the timed section. '''
+                    last_seen = queryset.order_by("-id")[(page_number - 1) * per_page - 1]
+                    cursor = keyset.encode_cursor("n", last_seen)
+
+                keyset_ms = timed(lambda: list(keyset.page(cursor)), repeat)
+                offset_ms = timed(lambda: list(offset.page(page_number)), repeat)
+                self.stdout.write("{:>8}  {:>12.2f}  {:>12.2f}".format(page_number, keyset_ms, offset_ms))
+
+            transaction.set_rollback(True)
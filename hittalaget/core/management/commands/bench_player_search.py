@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from hittalaget.core.benchmarks import seed_players, timed
+from hittalaget.core.pagination import KeysetPaginator
+from hittalaget.players.models import Player, Position
+from hittalaget.players.search import FacetIndex, filter_players
+from hittalaget.users.models import City
+
+
+class Command(BaseCommand):
+    help = ("Time faceted player searches, first page and facet counts, "
+            "against --players seeded profiles. Seeded rows are rolled back "
+            "afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--players", type=int, default=1000000)
+        parser.add_argument("--repeat", type=int, default=10)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.stdout.write("Seeding {} players...".format(options["players"]))
+            seed_players(options["players"])
+
+            position = Position.objects.filter(sport="fotboll").first()
+            city = City.objects.filter(name__startswith="bench-stad").first()
+            searches = [
+                ("position", {"position": position}),
+                ("position + city", {"position": position, "city": city}),
+                ("max age 20", {"max_age": 20}),
+                ("height 185-190 + side", {"min_height": 185, "max_height": 190, "side": "vänster"}),
+                ("experience + ability + city", {
+                    "experience": "division 2",
+                    "special_ability": "snabb",
+                    "city": city,
+                }),
+            ]
+
+            base = Player.objects.filter(sport="fotboll", is_available=True)
+            index = FacetIndex("fotboll")
+            build_ms = timed(index.build, 1)
+            self.stdout.write("Facet index built in {:.0f} ms.".format(build_ms))
+
+            self.stdout.write("{:<30}  {:>10}  {:>10}".format("search", "page ms", "facets ms"))
+            for name, data in searches:
+                paginator = KeysetPaginator(filter_players(base, data), 25)
+                page_ms = timed(lambda: list(paginator.page()), options["repeat"])
+                facets_ms = timed(lambda: index.counts(data), options["repeat"])
+                self.stdout.write("{:<30}  {:>10.2f}  {:>10.2f}".format(name, page_ms, facets_ms))
+
+            transaction.set_rollback(True)
@@ -0,0 +1,95 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from hittalaget.core.public_ids import SIX_DIGITS, allocate_public_id, get_allocator
+
+
+class Command(BaseCommand):
+    help = ("Compare the insert throughput of random IDs with retries and of "
+            "the public ID allocator, with the six-digit space 10%, 50% and "
+            "90% full. Everything is rolled back afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--inserts", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        inserts = options["inserts"]
+        first, size = SIX_DIGITS
+
+        self.stdout.write("{:>6}  {:>14}  {:>15}  {:>17}  {:>18}".format(
+            "fill", "random rows/s", "random queries", "allocator rows/s", "allocator queries"))
+
+        for fill in (0.1, 0.5, 0.9):
+            used = int(size * fill)
+            with transaction.atomic():
+                random_rate, random_queries = self.bench_random(used, inserts)
+                transaction.set_rollback(True)
+            with transaction.atomic():
+                allocator_rate, allocator_queries = self.bench_allocator(used, inserts)
+                transaction.set_rollback(True)
+
+            self.stdout.write("{:>5.0f}%  {:>14.0f}  {:>15.2f}  {:>17.0f}  {:>18.2f}".format(
+                fill * 100, random_rate, random_queries, allocator_rate, allocator_queries))
+
+    def create_table(self, cursor):
+        cursor.execute("CREATE TEMP TABLE bench_public_id (public_id int UNIQUE) ON COMMIT DROP")
+
+    def bench_random(self, used, inserts):
+        ''' The old way: a random six-digit number, and an EXISTS query
+        for each try until a free one is found. '''
+        first, size = SIX_DIGITS
+        with connection.cursor() as cursor:
+            self.create_table(cursor)
+            cursor.execute("""
+                INSERT INTO bench_public_id
+                SELECT %s + g FROM generate_series(0, %s) AS g ORDER BY random() LIMIT %s
+            """, [first, size - 1, used])
+            cursor.execute("ANALYZE bench_public_id")
+
+            queries = 0
+            start = time.perf_counter()
+            for _ in range(inserts):
+                while True:
+                    public_id = random.randint(first, first + size - 1)
+                    cursor.execute("SELECT EXISTS (SELECT 1 FROM bench_public_id WHERE public_id = %s)", [public_id])
+                    queries += 1
+                    if not cursor.fetchone()[0]:
+                        break
+                cursor.execute("INSERT INTO bench_public_id VALUES (%s)", [public_id])
+                queries += 1
+            elapsed = time.perf_counter() - start
+
+        return inserts / elapsed, queries / inserts
+
+    def bench_allocator(self, used, inserts):
+        ''' The allocator, after `used` IDs have been handed out. The
+        unique constraint makes any collision fail the benchmark. '''
+        allocator = get_allocator("bench")
+        allocator.reserved = []
+
+        with connection.cursor() as cursor:
+            self.create_table(cursor)
+            cursor.execute("CREATE TEMP SEQUENCE core_public_id_bench MINVALUE 0 START WITH 0")
+
+            issued = [allocator.public_id(n) for n in range(used)]
+            for i in range(0, used, 100000):
+                cursor.execute(
+                    "INSERT INTO bench_public_id SELECT unnest(%s::int[])", [issued[i:i + 100000]]
+                )
+            cursor.execute("ANALYZE bench_public_id")
+            cursor.execute("SELECT setval('core_public_id_bench', %s, false)", [used])
+
+            ''' The inserts go through a cursor opened in the context, so
+            they are counted along with the queries of the allocator. '''
+            with CaptureQueriesContext(connection) as queries, connection.cursor() as insert_cursor:
+                start = time.perf_counter()
+                for _ in range(inserts):
+                    public_id = allocate_public_id("bench")
+                    insert_cursor.execute("INSERT INTO bench_public_id VALUES (%s)", [public_id])
+                elapsed = time.perf_counter() - start
+
+        return inserts / elapsed, len(queries) / inserts
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from hittalaget.ads.models import Ad
+from hittalaget.core.benchmarks import BENCH_WORDS, seed_ads, timed
+from hittalaget.core.pagination import KeysetPaginator
+from hittalaget.core.search import search
+
+
+class Command(BaseCommand):
+    help = ("Time the full-text search of ads against --ads seeded ads, and "
+            "compare it with icontains. Seeded rows are rolled back afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ads", type=int, default=500000)
+        parser.add_argument("--per-page", type=int, default=25)
+        parser.add_argument("--repeat", type=int, default=10)
+
+    def handle(self, *args, **options):
+        per_page = options["per_page"]
+        repeat = options["repeat"]
+
+        with transaction.atomic():
+            self.stdout.write("Seeding {} ads...".format(options["ads"]))
+            seed_ads(options["ads"])
+
+            ads = Ad.objects.filter(sport="fotboll")
+            ''' A rare, a common and a very common word, two words, and
+            a word that no ad contains. '''
+            terms = [
+                BENCH_WORDS[0],
+                BENCH_WORDS[10],
+                BENCH_WORDS[-2],
+                "{} {}".format(BENCH_WORDS[5], BENCH_WORDS[20]),
+                "målvaktstränare",
+            ]
+
+            self.stdout.write("{:<28}  {:>8}  {:>10}  {:>10}  {:>12}".format(
+                "search", "ranked", "page 1 ms", "page 10 ms", "icontains ms"))
+            for text in terms:
+                paginator = KeysetPaginator(search(ads, text), per_page, ("-rank", "-id"))
+                ranked = search(ads, text).count()
+
+                ''' Walk to page 10 outside the timed section. '''
+                cursor = None
+                for _ in range(9):
+                    cursor = paginator.page(cursor).next_cursor
+
+                first_ms = timed(lambda: list(paginator.page()), repeat)
+                deep_ms = timed(lambda: list(paginator.page(cursor)), repeat) if cursor else float("nan")
+                naive_ms = timed(
+                    lambda: list(ads.filter(description__icontains=text.split()[0]).order_by("-id")[:per_page]),
+                    repeat,
+                )
+                self.stdout.write("{:<28}  {:>8}  {:>10.2f}  {:>10.2f}  {:>12.2f}".format(
+                    text, ranked, first_ms, deep_ms, naive_ms))
+
+            transaction.set_rollback(True)
@@ -0,0 +1,94 @@
+import fnmatch
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from hittalaget.core import loadtest
+
+
+class Command(BaseCommand):
+    help = ("Load test every URL name, in this process or over HTTP with --url, and "
+            "report p50/p95/p99, requests/s and queries per request as JSON. The "
+            "dataset is seeded with --seed and committed, so use a database of its own.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", action="store_true", help="Seed the dataset unless it is there already.")
+        parser.add_argument("--scale", type=float, default=1.0, help="Multiply the sizes of the dataset by this.")
+        for name, size in loadtest.DATASET_SIZES.items():
+            parser.add_argument("--{}".format(name.replace("_", "-")), type=int, default=size)
+        parser.add_argument("--url", help="The server to load test over HTTP, e.g. http://127.0.0.1:8000.")
+        parser.add_argument("--requests", type=int, default=200, help="Requests per URL name.")
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--warmup", type=int, default=1, help="Untimed requests per thread.")
+        parser.add_argument("--only", nargs="+", default=[], help="URL names to run, e.g. 'player:*'.")
+        parser.add_argument("--output", help="Write the report to this file instead of stdout.")
+        parser.add_argument("--save-baseline", help="Write the report to this file, as the baseline.")
+        parser.add_argument("--baseline", help="Fail if the report has regressed from this baseline.")
+        parser.add_argument("--threshold", type=float, default=0.2)
+
+    def handle(self, *args, **options):
+        concurrency = options["concurrency"]
+        if concurrency < 1 or options["requests"] < concurrency:
+            raise CommandError("--requests must be at least --concurrency, which must be at least 1.")
+
+        if options["seed"]:
+            if loadtest.has_dataset():
+                self.stderr.write("The dataset is there already, and is not seeded again.")
+            else:
+                sizes = {
+                    name: max(int(options[name] * options["scale"]), 2)
+                    for name in loadtest.DATASET_SIZES
+                }
+                self.stderr.write("Seeding {}...".format(
+                    ", ".join("{} {}".format(size, name) for name, size in sizes.items())
+                ))
+                try:
+                    loadtest.seed_dataset(sizes)
+                except ValueError as e:
+                    raise CommandError(e)
+
+        if not loadtest.has_dataset():
+            raise CommandError("There is no dataset. Seed it with --seed.")
+        if settings.DEBUG:
+            self.stderr.write("DEBUG is on, so the numbers include its overhead.")
+
+        targets, skipped = loadtest.get_targets(loadtest.Sample())
+        if options["only"]:
+            targets = {
+                url_name: target for url_name, target in targets.items()
+                if any(fnmatch.fnmatchcase(url_name, pattern) for pattern in options["only"])
+            }
+        for url_name, reason in sorted(skipped.items()):
+            self.stderr.write("Skipped {}: {}".format(url_name, reason))
+
+        report = loadtest.run(
+            targets,
+            options["requests"],
+            concurrency,
+            warmup=options["warmup"],
+            base_url=options["url"],
+        )
+        report["skipped"] = skipped
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
+        if options["save_baseline"]:
+            with open(options["save_baseline"], "w") as f:
+                f.write(output + "\n")
+
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)
+            if (baseline["mode"], baseline["concurrency"]) != (report["mode"], report["concurrency"]):
+                raise CommandError("The baseline was made {} with concurrency {}.".format(
+                    baseline["mode"], baseline["concurrency"]
+                ))
+            regressions = loadtest.compare(report, baseline, options["threshold"])
+            if regressions:
+                raise CommandError("Regressions from the baseline:\n{}".format("\n".join(regressions)))
+            self.stderr.write("No regressions from the baseline.")
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from hittalaget.core.images import create_renditions
+from hittalaget.players.models import Player
+from hittalaget.teams.models import Team
+
+
+class Command(BaseCommand):
+    help = ("Make the WebP renditions of the player and team images that do "
+            "not have them yet, e.g. the ones uploaded before renditions were "
+            "made. Rows that share an image, like the default one, share its "
+            "renditions.")
+
+    def handle(self, *args, **options):
+        for model in (Player, Team):
+            names = (
+                model.objects.filter(image_renditions=[]).exclude(image="").exclude(image=None)
+                .values_list('image', flat=True).distinct()
+            )
+            for name in names.iterator():
+                try:
+                    widths = create_renditions(name)
+                except (OSError, ValueError, Image.DecompressionBombError) as e:
+                    self.stderr.write("{}: {}".format(name, e))
+                    continue
+                count = model.objects.filter(image=name, image_renditions=[]).update(image_renditions=widths)
+                self.stdout.write("{}: {} ({} rows)".format(name, widths, count))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hittalaget.core.imports import BATCH_SIZE, IMPORTERS, read_rows
+
+
+class Command(BaseCommand):
+    help = ("Import teams, players or ads from a CSV or JSONL file. Rows that "
+            "can not be imported are skipped and listed by their row number.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=sorted(IMPORTERS))
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=["csv", "jsonl"],
+                            help="Defaults to the file extension.")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        kind = options["kind"]
+        start = time.perf_counter()
+        try:
+            result = IMPORTERS[kind](read_rows(options["path"], options["format"]), batch_size=options["batch_size"])
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+        elapsed = time.perf_counter() - start
+
+        for number, message in result.errors:
+            self.stderr.write("Row {}: {}".format(number, message))
+        self.stdout.write("Imported {} {} in {:.1f}s, skipped {}.".format(
+            result.created, kind, elapsed, len(result.errors)))
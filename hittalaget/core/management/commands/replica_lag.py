@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from hittalaget.core.db.routers import measure_lag
+
+
+class Command(BaseCommand):
+    help = ("Show how many seconds each replica in DATABASE_REPLICAS is behind "
+            "the primary. Fails if one can not be reached, or is more than "
+            "REPLICA_MAX_LAG seconds behind, so it can be used as a check.")
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("There are no replicas in DATABASE_REPLICAS.")
+
+        failing = []
+        for alias in settings.DATABASE_REPLICAS:
+            lag = measure_lag(alias)
+            if lag is None:
+                self.stdout.write("{}: down".format(alias))
+                failing.append(alias)
+            else:
+                self.stdout.write("{}: {:.1f} s".format(alias, lag))
+                if lag > settings.REPLICA_MAX_LAG:
+                    failing.append(alias)
+
+        if failing:
+            raise CommandError("Not usable: {}".format(", ".join(failing)))
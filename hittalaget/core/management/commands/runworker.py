@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from hittalaget.core.jobs import JOBS, Worker
+
+
+class Command(BaseCommand):
+    help = ("Run background jobs until stopped. Start as many workers as "
+            "needed, on one machine or several; they never run the same job "
+            "twice. SIGTERM and SIGINT stop a worker once its job is done.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true",
+                            help="Exit once no job is due.")
+
+    def handle(self, *args, **options):
+        worker = Worker()
+        self.stdout.write("Running jobs: {}".format(", ".join(sorted(JOBS))))
+        worker.run(once=options["once"])
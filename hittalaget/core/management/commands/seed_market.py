@@ -0,0 +1,74 @@
+import json
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from hittalaget.core.seeding import DISTRIBUTIONS, SEED_NOW, SIZES, get_today, seed_market
+
+
+class Command(BaseCommand):
+    help = ("Seed a synthetic market of users, players, teams, ads, conversations "
+            "and messages, streamed in with COPY by parallel workers. The same seed "
+            "gives the same market.")
+
+    def add_arguments(self, parser):
+        for name, size in SIZES.items():
+            parser.add_argument("--{}".format(name.replace("_", "-")), type=int, default=size)
+        parser.add_argument("--scale", type=float, default=1.0, help="Multiply the sizes by this.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--distributions",
+                            help="A JSON file overriding any of: {}.".format(", ".join(DISTRIBUTIONS)))
+        parser.add_argument("--prefix", default="m", help="Usernames are <prefix>_<n>.")
+        parser.add_argument("--password", help="The password of every user. By default they have none.")
+        parser.add_argument("--now", default=SEED_NOW.strftime("%Y-%m-%d"),
+                            help="When the newest rows are from, as YYYY-MM-DD. It is part of what the "
+                                 "seed reproduces, so it defaults to a fixed date.")
+        parser.add_argument("--today", action="store_true",
+                            help="Make the newest rows from today instead of --now.")
+        parser.add_argument("--workers", type=int, help="Defaults to the number of CPUs.")
+        parser.add_argument("--match", action="store_true",
+                            help="Queue jobs that store the matching players of the ads.")
+
+    def handle(self, *args, **options):
+        sizes = {name: int(options[name] * options["scale"]) for name in SIZES}
+
+        distributions = {}
+        if options["distributions"]:
+            try:
+                with open(options["distributions"]) as f:
+                    distributions = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(e)
+
+        if options["today"]:
+            now = get_today()
+        else:
+            try:
+                now = timezone.make_aware(datetime.strptime(options["now"], "%Y-%m-%d"), timezone.utc)
+            except ValueError as e:
+                raise CommandError(e)
+
+        def progress(counts):
+            self.stderr.write("\r" + ", ".join("{} {}".format(count, name) for name, count in sorted(counts.items())),
+                              ending="")
+
+        try:
+            counts = seed_market(
+                sizes,
+                seed=options["seed"],
+                distributions=distributions,
+                prefix=options["prefix"],
+                workers=options["workers"],
+                password=options["password"],
+                now=now,
+                match=options["match"],
+                progress=progress,
+            )
+        except ValueError as e:
+            raise CommandError(e)
+
+        seconds = counts.pop("seconds")
+        self.stderr.write("")
+        self.stdout.write("Seeded {} in {:.1f}s.".format(
+            ", ".join("{} {}".format(count, name) for name, count in sorted(counts.items())), seconds))
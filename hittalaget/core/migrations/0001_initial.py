@@ -0,0 +1,26 @@
+# Generated by Django 3.0 on 2026-10-17 19:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservedPublicId',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=255)),
+                ('public_id', models.IntegerField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='reservedpublicid',
+            constraint=models.UniqueConstraint(fields=('kind', 'public_id'), name='unique_reserved_public_id'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.0 on 2026-10-17 19:06
+
+from django.db import migrations
+
+
+''' (kind, table, column) of the public IDs. '''
+PUBLIC_IDS = [
+    ("team", "teams_team", "team_id"),
+    ("ad", "ads_ad", "ad_id"),
+    ("conversation", "conversations_adconversation", "conversation_id"),
+]
+
+
+class Migration(migrations.Migration):
+    ''' Create a sequence for each kind of public ID, and reserve the IDs
+    that were handed out at random before. '''
+
+    dependencies = [
+        ('core', '0001_initial'),
+        ('teams', '0004_search_vector'),
+        ('ads', '0004_search_vector'),
+        ('conversations', '0005_inbox'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "CREATE SEQUENCE core_public_id_{} MINVALUE 0 START WITH 0".format(kind)
+                for kind, table, column in PUBLIC_IDS
+            ],
+            reverse_sql=[
+                "DROP SEQUENCE core_public_id_{}".format(kind)
+                for kind, table, column in PUBLIC_IDS
+            ],
+        ),
+        migrations.RunSQL(
+            sql=[
+                """
+                INSERT INTO core_reservedpublicid (kind, public_id)
+                SELECT '{kind}', {column} FROM {table}
+                """.format(kind=kind, table=table, column=column)
+                for kind, table, column in PUBLIC_IDS
+            ],
+            reverse_sql="DELETE FROM core_reservedpublicid",
+        ),
+    ]
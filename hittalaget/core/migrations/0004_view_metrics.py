@@ -0,0 +1,29 @@
+# Generated by Django 3.0 on 2026-10-17 19:43
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ViewMetric',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('view_name', models.CharField(max_length=255)),
+                ('metric', models.CharField(max_length=255)),
+                ('count', models.BigIntegerField(default=0)),
+                ('sum', models.FloatField(default=0)),
+                ('buckets', django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), default=list, size=None)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='viewmetric',
+            constraint=models.UniqueConstraint(fields=('view_name', 'metric'), name='unique_view_metric'),
+        ),
+    ]
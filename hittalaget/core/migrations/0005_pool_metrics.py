@@ -0,0 +1,37 @@
+# Generated by Django 3.0 on 2026-10-17 20:50
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_view_metrics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PoolMetric',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('db', models.CharField(max_length=255)),
+                ('process', models.CharField(max_length=255)),
+                ('in_use', models.IntegerField(default=0)),
+                ('idle', models.IntegerField(default=0)),
+                ('max_size', models.IntegerField(default=0)),
+                ('checkouts', models.BigIntegerField(default=0)),
+                ('waits', models.BigIntegerField(default=0)),
+                ('wait_seconds', models.FloatField(default=0)),
+                ('timeouts', models.BigIntegerField(default=0)),
+                ('opened', models.BigIntegerField(default=0)),
+                ('closed', models.BigIntegerField(default=0)),
+                ('failed_checks', models.BigIntegerField(default=0)),
+                ('updated', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='poolmetric',
+            constraint=models.UniqueConstraint(fields=('db', 'process'), name='unique_pool_metric'),
+        ),
+    ]
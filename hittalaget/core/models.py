@@ -0,0 +1,88 @@
+from django.contrib.postgres.fields import ArrayField, JSONField
+from django.db import models
+from django.utils import timezone
+
+
+class ReservedPublicId(models.Model):
+    ''' A public ID that was handed out before the allocator in
+    hittalaget.core.public_ids existed, and must be skipped by it. '''
+    kind = models.CharField(max_length=255)
+    public_id = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'public_id'], name="unique_reserved_public_id"),
+        ]
+
+
+class Job(models.Model):
+    ''' A call of a registered job function, waiting to be run by the
+    runworker command (see hittalaget.core.jobs). Jobs with a higher
+    priority run first. A job is deleted once it has run, unless it is
+    periodic, in which case it waits for its next run. '''
+    name = models.CharField(max_length=255)
+    args = JSONField(default=list)
+    kwargs = JSONField(default=dict)
+    priority = models.SmallIntegerField(default=0)
+    run_at = models.DateTimeField(default=timezone.now)
+    key = models.CharField(max_length=255, null=True, unique=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    is_failed = models.BooleanField(default=False)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-priority', 'run_at', 'id'], condition=models.Q(is_failed=False), name="job_due"),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class ViewMetric(models.Model):
+    ''' A histogram of one metric of the requests to one view, summed over
+    every process (see hittalaget.core.instrumentation). `buckets` holds
+    the number of observations in each bucket of the metric, not the
+    cumulative counts. '''
+    view_name = models.CharField(max_length=255)
+    metric = models.CharField(max_length=255)
+    count = models.BigIntegerField(default=0)
+    sum = models.FloatField(default=0)
+    buckets = ArrayField(models.BigIntegerField(), default=list)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['view_name', 'metric'], name="unique_view_metric"),
+        ]
+
+    def __str__(self):
+        return "{} {}".format(self.view_name, self.metric)
+
+
+class PoolMetric(models.Model):
+    ''' The connection pool of one database in one process, as last
+    flushed by that process (see hittalaget.core.instrumentation). The
+    counters of processes that have stopped are added to the row with
+    an empty `process`, so the sums over all rows never go down. '''
+    db = models.CharField(max_length=255)
+    process = models.CharField(max_length=255)
+    in_use = models.IntegerField(default=0)
+    idle = models.IntegerField(default=0)
+    max_size = models.IntegerField(default=0)
+    checkouts = models.BigIntegerField(default=0)
+    waits = models.BigIntegerField(default=0)
+    wait_seconds = models.FloatField(default=0)
+    timeouts = models.BigIntegerField(default=0)
+    opened = models.BigIntegerField(default=0)
+    closed = models.BigIntegerField(default=0)
+    failed_checks = models.BigIntegerField(default=0)
+    updated = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['db', 'process'], name="unique_pool_metric"),
+        ]
+
+    def __str__(self):
+        return "{} {}".format(self.db, self.process)
@@ -0,0 +1,96 @@
+''' A cache of the objects shown on the detail pages, already joined.
+
+Every cached object depends on a few names, like "user:12" or
+"positions", and each name has a version token in the cache. An entry
+stores the tokens of its names as they were when it was loaded, and is
+only used while all of them are unchanged. Signals bump the token of a
+name when a row it stands for is saved or deleted, which makes every
+entry that depends on it stale at once, without having to know which
+entries there are.
+
+The first name of an entry is the one it is looked up by. Its token is
+read before the object is loaded, so a change committed while loading
+is never hidden behind an old object. The tokens of the other names are
+only known after loading, and in the rare case of a change in between
+the entry lives on until OBJECT_CACHE_TIMEOUT.
+
+The tokens are how the processes tell each other about changes, so the
+cache must be one that all of them share, like memcached, and not the
+local-memory cache that Django uses when CACHES is not set. With that
+one, a change is only seen by the process that made it, and the others
+serve the old object until OBJECT_CACHE_TIMEOUT. The reference data,
+the rankings of the ads and the sessions depend on the same cache. '''
+
+import hashlib
+import uuid
+
+from django.core.cache import cache
+from django.core.cache.backends.base import MEMCACHE_MAX_KEY_LENGTH, default_key_func
+from django.db import transaction
+
+
+OBJECT_CACHE_TIMEOUT = 60 * 60
+
+
+def make_cache_key(key, key_prefix, version):
+    ''' The KEY_FUNCTION of the cache. Names like "player:fotboll:<username>"
+    may contain characters that memcached does not allow in keys, so keys
+    with those, or that are too long, are hashed. '''
+    key = default_key_func(key, key_prefix, version)
+    if len(key.encode()) > MEMCACHE_MAX_KEY_LENGTH or any(ord(char) < 33 or ord(char) == 127 for char in key):
+        key = "{}:{}:hash:{}".format(key_prefix, version, hashlib.md5(key.encode()).hexdigest())
+    return key
+
+
+def _entry_key(name):
+    return "objects:{}".format(name)
+
+
+def _version_key(name):
+    return "objects:version:{}".format(name)
+
+
+def get_versions(names):
+    ''' Return {name: token}, creating the tokens that are missing. '''
+    keys = {_version_key(name): name for name in names}
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        ''' add() keeps a token that someone else created in between. '''
+        for key in missing:
+            cache.add(key, uuid.uuid4().hex, None)
+        found.update(cache.get_many(missing))
+    return {keys[key]: found.get(key) for key in keys}
+
+
+def is_current(versions):
+    found = cache.get_many([_version_key(name) for name in versions])
+    return all(found.get(_version_key(name)) == token for name, token in versions.items())
+
+
+def get_cached_object(name, load, dependencies):
+    ''' Return the object cached under name, or call load() and cache
+    what it returns. dependencies(obj) returns the other names the
+    object depends on. Exceptions from load(), like Http404, are not
+    cached. '''
+    entry = cache.get(_entry_key(name))
+    if entry is not None and is_current(entry["versions"]):
+        return entry["object"]
+
+    versions = get_versions([name])
+    obj = load()
+    versions.update(get_versions(dependencies(obj)))
+    cache.set(_entry_key(name), {"versions": versions, "object": obj}, OBJECT_CACHE_TIMEOUT)
+    return obj
+
+
+def bump(*names):
+    ''' Make every entry that depends on one of the names stale, once
+    the current transaction is committed. Bumping earlier would let a
+    request that reads before the commit cache the old rows under the
+    new token. Returns {name: token} of the new tokens. '''
+    tokens = {name: uuid.uuid4().hex for name in names}
+    transaction.on_commit(lambda: cache.set_many(
+        {_version_key(name): token for name, token in tokens.items()}, None
+    ))
+    return tokens
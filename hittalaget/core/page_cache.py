@@ -0,0 +1,200 @@
+''' A full-page cache for the market lists as seen by anonymous visitors.
+
+Every logged-out visitor gets the same list, so it is rendered once per
+URL and served from the cache. The parts of base.html that are personal
+(the nav and the flash messages) are left as holes in the cached HTML,
+and are rendered for each request when the page is served.
+
+A page is fresh for PAGE_CACHE_FRESH seconds. After that it is still
+served, but the first request to see it stale refreshes it in the
+background. Only one refresh or render of a page runs at a time, guarded
+by a lock made with cache.add() in the cache that all processes share.
+Requests that miss a page while another one renders it wait a little
+for it instead of all hitting the database.
+
+A page is cached by its path and the query parameters that the view
+reads, like the cursor, the search text and the filters, in a fixed
+order. Other parameters, like ?utm_source=... or random ones, are left
+out of the key and of the page, so they can not be used to get past the
+cache or to fill it with copies of a page. '''
+
+import hashlib
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import HttpRequest, HttpResponse, QueryDict
+from django.template.loader import render_to_string
+from django.utils.cache import patch_vary_headers
+
+from .background import run_in_background
+
+
+PAGE_CACHE_FRESH = 60
+PAGE_CACHE_TIMEOUT = 60 * 60
+PAGE_CACHE_LOCK_TIMEOUT = 30
+PAGE_CACHE_WAIT = 2
+PAGE_CACHE_POLL = 0.05
+
+''' The holes in a cached page, and the templates that fill them. '''
+PAGE_CACHE_HOLES = {
+    "nav": "includes/nav.html",
+    "messages": "includes/messages.html",
+}
+
+
+def get_page_query(request, params):
+    ''' The non-empty query parameters of the request that are in params,
+    sorted by name. '''
+    query = QueryDict(mutable=True)
+    for name in sorted(set(params)):
+        values = [value for value in request.GET.getlist(name) if value]
+        if values:
+            query.setlist(name, values)
+    return query
+
+
+def _page_key(request, query):
+    url = "{}?{}".format(request.path, query.urlencode())
+    return "pages:{}".format(hashlib.md5(url.encode()).hexdigest())
+
+
+def _lock_key(key):
+    return "{}:lock".format(key)
+
+
+def hole_marker(name):
+    return "<!--page-cache:{}-->".format(name)
+
+
+def fill_holes(request, content):
+    for name, template_name in PAGE_CACHE_HOLES.items():
+        content = content.replace(hole_marker(name), render_to_string(template_name, request=request))
+    return content
+
+
+def _render(view, request, args, kwargs):
+    ''' Return the HTML of the page with its holes, or None if the view
+    did not return a page that can be cached. '''
+    response = view(request, *args, **kwargs)
+    if hasattr(response, 'render'):
+        response.render()
+    if response.status_code != 200:
+        return None
+    return {
+        "content": response.content.decode(response.charset),
+        "content_type": response['Content-Type'],
+        "created": time.time(),
+    }
+
+
+def _refresh(key, view, request, args, kwargs):
+    try:
+        page = _render(view, request, args, kwargs)
+        if page is not None:
+            cache.set(key, page, PAGE_CACHE_TIMEOUT)
+    finally:
+        cache.delete(_lock_key(key))
+
+
+def _copy_request(request, query):
+    ''' A bare anonymous GET for the same path and query, which can be
+    rendered from a background thread after the original request is
+    done. '''
+    copy = HttpRequest()
+    copy.method = "GET"
+    copy.path = request.path
+    copy.path_info = request.path_info
+    copy.GET = query.copy()
+    copy.META = {
+        key: request.META[key] for key in ("SERVER_NAME", "SERVER_PORT", "HTTP_HOST") if key in request.META
+    }
+    copy.user = AnonymousUser()
+    copy.page_cache_render = True
+    return copy
+
+
+def _wait_for_page(key):
+    deadline = time.monotonic() + PAGE_CACHE_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(PAGE_CACHE_POLL)
+        page = cache.get(key)
+        if page is not None:
+            return page
+        if cache.get(_lock_key(key)) is None:
+            return None
+    return None
+
+
+def _serve(request, page, status):
+    response = HttpResponse(fill_holes(request, page["content"]), content_type=page["content_type"])
+    response['X-Page-Cache'] = status
+    patch_vary_headers(response, ["Cookie"])
+    return response
+
+
+def get_cached_page(request, view, args, kwargs, params):
+    ''' Serve the page of view for the request from the cache. view is
+    called with a copy of the request, with only the query parameters in
+    params, whenever the page is rendered. '''
+    query = get_page_query(request, params)
+    key = _page_key(request, query)
+    page = cache.get(key)
+
+    if page is not None:
+        if time.time() - page["created"] < PAGE_CACHE_FRESH:
+            return _serve(request, page, "hit")
+        if cache.add(_lock_key(key), True, PAGE_CACHE_LOCK_TIMEOUT):
+            run_in_background(_refresh, key, view, _copy_request(request, query), args, kwargs)
+        return _serve(request, page, "stale")
+
+    if cache.add(_lock_key(key), True, PAGE_CACHE_LOCK_TIMEOUT):
+        try:
+            page = _render(view, _copy_request(request, query), args, kwargs)
+            if page is not None:
+                cache.set(key, page, PAGE_CACHE_TIMEOUT)
+        finally:
+            cache.delete(_lock_key(key))
+    else:
+        page = _wait_for_page(key)
+        if page is None:
+            page = _render(view, _copy_request(request, query), args, kwargs)
+
+    if page is None:
+        ''' Not a page that is cached, like a redirect. Let the view
+        answer the request itself. '''
+        request.page_cache_bypass = True
+        return view(request, *args, **kwargs)
+    return _serve(request, page, "miss")
+
+
+class AnonymousPageCacheMixin:
+    ''' Serve a view's GET requests from the page cache to anonymous
+    visitors. The view's template must extend base.html. page_cache_params
+    are the query parameters the view reads, besides the cursor of
+    KeysetPaginationMixin and the search text of TextSearchMixin. '''
+    page_cache_params = ()
+
+    def get_page_cache_params(self):
+        params = list(self.page_cache_params)
+        for attribute in ('cursor_kwarg', 'search_kwarg'):
+            if hasattr(self, attribute):
+                params.append(getattr(self, attribute))
+        return params
+
+    def uses_page_cache(self):
+        request = self.request
+        return request.method == "GET" and not request.user.is_authenticated
+
+    def dispatch(self, request, *args, **kwargs):
+        ''' Requests made by the page cache itself are rendered as usual. '''
+        if getattr(request, 'page_cache_render', False) or getattr(request, 'page_cache_bypass', False):
+            return super().dispatch(request, *args, **kwargs)
+        if not self.uses_page_cache():
+            return super().dispatch(request, *args, **kwargs)
+        return get_cached_page(request, type(self).as_view(), args, kwargs, self.get_page_cache_params())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['page_cache'] = getattr(self.request, 'page_cache_render', False)
+        return context
@@ -0,0 +1,168 @@
+import datetime
+import decimal
+
+from django.core import signing
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from django.http import Http404
+
+
+class InvalidCursor(InvalidPage):
+    pass
+
+
+def _serialize_key(value):
+    ''' Cursor values travel through JSON, so dates and decimals are
+    passed as strings. The ORM parses them back when filtering. '''
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+class KeysetPage:
+    ''' A single page returned by KeysetPaginator. '''
+
+    def __init__(self, object_list, has_next, has_previous, paginator):
+        self.object_list = object_list
+        self.has_next_page = has_next
+        self.has_previous_page = has_previous
+        self.paginator = paginator
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.has_next_page
+
+    def has_previous(self):
+        return self.has_previous_page
+
+    def has_other_pages(self):
+        return self.has_next_page or self.has_previous_page
+
+    @property
+    def next_cursor(self):
+        if not self.has_next_page or not self.object_list:
+            return None
+        return self.paginator.encode_cursor("n", self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous_page or not self.object_list:
+            return None
+        return self.paginator.encode_cursor("p", self.object_list[0])
+
+
+class KeysetPaginator:
+    ''' Paginate a queryset by seeking past the ordering key of the last
+    row seen, instead of using OFFSET. Every page is then an index range
+    scan of per_page + 1 rows no matter how deep it is.
+
+    The last field in `ordering` must be unique (usually the pk), so that
+    the ordering is total and no rows are skipped or repeated. Cursors are
+    signed, so they are opaque to the client and can not be tampered with. '''
+
+    salt = "hittalaget.keyset"
+
+    def __init__(self, queryset, per_page, ordering=("-id",)):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = [(f.lstrip("-"), f.startswith("-")) for f in self.ordering]
+
+    def encode_cursor(self, direction, obj):
+        values = [_serialize_key(self._get_value(obj, field)) for field, _ in self.fields]
+        return signing.dumps([direction] + values, salt=self.salt, compress=True)
+
+    def decode_cursor(self, cursor):
+        try:
+            data = signing.loads(cursor, salt=self.salt)
+        except signing.BadSignature:
+            raise InvalidCursor("Ogiltig sida.")
+
+        if (not isinstance(data, list) or len(data) != len(self.fields) + 1
+                or data[0] not in ("n", "p")):
+            raise InvalidCursor("Ogiltig sida.")
+
+        return data[0], data[1:]
+
+    def _get_value(self, obj, field):
+        for attr in field.split("__"):
+            obj = getattr(obj, attr)
+        return obj
+
+    def _seek(self, values, backwards):
+        ''' Build the row-value comparison (a, b) > (x, y) as
+        a > x OR (a = x AND b > y), honouring the direction of each
+        field. '''
+        condition = Q()
+        for i, (field, descending) in enumerate(self.fields):
+            lookup = "lt" if descending != backwards else "gt"
+            clause = Q(**{"{}__{}".format(field, lookup): values[i]})
+            for prev_field, prev_value in zip(self.fields[:i], values[:i]):
+                clause &= Q(**{prev_field[0]: prev_value})
+            condition |= clause
+        return condition
+
+    def _order_by(self, backwards):
+        if not backwards:
+            return self.ordering
+        return tuple(f[1:] if f.startswith("-") else "-" + f for f in self.ordering)
+
+    def page(self, cursor=None):
+        if cursor:
+            direction, values = self.decode_cursor(cursor)
+        else:
+            direction, values = "n", None
+
+        backwards = direction == "p"
+        queryset = self.queryset
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, backwards))
+
+        rows = list(queryset.order_by(*self._order_by(backwards))[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if backwards:
+            rows.reverse()
+            return KeysetPage(rows, has_next=True, has_previous=has_more, paginator=self)
+        return KeysetPage(rows, has_next=has_more, has_previous=values is not None, paginator=self)
+
+
+class KeysetPaginationMixin:
+    ''' Swap the OFFSET based pagination of ListView for keyset
+    pagination. The page is picked with an opaque ?sida=<cursor>
+    parameter, and the other query parameters are preserved in the
+    next/previous links. '''
+    paginate_by = 25
+    keyset_ordering = ("-id",)
+    cursor_kwarg = "sida"
+
+    def get_keyset_ordering(self):
+        return self.keyset_ordering
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, page_size, self.get_keyset_ordering())
+        cursor = self.request.GET.get(self.cursor_kwarg)
+
+        try:
+            page = paginator.page(cursor)
+        except InvalidCursor as e:
+            raise Http404(str(e))
+
+        page.next_querystring = self.get_page_querystring(page.next_cursor)
+        page.previous_querystring = self.get_page_querystring(page.previous_cursor)
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+    def get_page_querystring(self, cursor):
+        if cursor is None:
+            return None
+        params = self.request.GET.copy()
+        params[self.cursor_kwarg] = cursor
+        return params.urlencode()
@@ -0,0 +1,167 @@
+''' Public IDs for teams, ads and ad conversations.
+
+The IDs in the URLs should be six digits and should not give away how
+many rows there are, so they can not be plain sequence numbers. Picking
+random numbers and retrying on collisions gets slower as the space
+fills up, and two concurrent inserts can still pick the same number.
+
+Instead, every kind has a Postgres sequence, and the n:th number from
+it is mapped to an ID through a keyed permutation of 100000-999999 (a
+Feistel network, cycle-walked down to the size of the space). Since a
+permutation never maps two numbers to the same ID, each ID costs one
+nextval() and can never collide.
+
+IDs handed out before this (see ReservedPublicId) are skipped without
+any queries. Their positions in the permutation are loaded once per
+process, and the n:th free position is found with a binary search.
+
+When all six-digit IDs are used up, the allocator goes on with a second
+permutation of 1000000-9999999. Seven-digit IDs work everywhere the
+six-digit ones do, they are just longer. '''
+
+import bisect
+import hashlib
+import threading
+
+from django.conf import settings
+from django.db import connection
+
+from .models import ReservedPublicId
+
+
+FEISTEL_ROUNDS = 6
+
+SIX_DIGITS = (100000, 900000)
+SEVEN_DIGITS = (1000000, 9000000)
+
+
+class PublicIdsExhausted(Exception):
+    pass
+
+
+class FeistelPermutation:
+    ''' A keyed permutation of range(size). '''
+
+    def __init__(self, key, size):
+        self.key = hashlib.blake2b(key.encode()).digest()[:32]
+        self.size = size
+        bits = max((size - 1).bit_length(), 2)
+        self.half_bits = (bits + 1) // 2
+        self.mask = (1 << self.half_bits) - 1
+
+    def _round(self, i, value):
+        digest = hashlib.blake2b(
+            bytes([i]) + value.to_bytes(4, "big"), key=self.key, digest_size=4
+        ).digest()
+        return int.from_bytes(digest, "big") & self.mask
+
+    def _encrypt(self, x):
+        left, right = x >> self.half_bits, x & self.mask
+        for i in range(FEISTEL_ROUNDS):
+            left, right = right, left ^ self._round(i, right)
+        return (left << self.half_bits) | right
+
+    def _decrypt(self, y):
+        left, right = y >> self.half_bits, y & self.mask
+        for i in reversed(range(FEISTEL_ROUNDS)):
+            left, right = right ^ self._round(i, left), left
+        return (left << self.half_bits) | right
+
+    def permute(self, x):
+        ''' The network permutes a power of two. Walking the cycle until
+        the value is back in range keeps it a permutation of range(size). '''
+        y = self._encrypt(x)
+        while y >= self.size:
+            y = self._encrypt(y)
+        return y
+
+    def inverse(self, y):
+        x = self._decrypt(y)
+        while x >= self.size:
+            x = self._decrypt(x)
+        return x
+
+
+class PublicIdAllocator:
+    ''' Maps the numbers of a kind's sequence to public IDs. '''
+
+    def __init__(self, kind):
+        key = "{}:{}".format(settings.PUBLIC_ID_KEY, kind)
+        self.kind = kind
+        self.six = FeistelPermutation(key + ":6", SIX_DIGITS[1])
+        self.seven = FeistelPermutation(key + ":7", SEVEN_DIGITS[1])
+        self.reserved = None
+        self.lock = threading.Lock()
+
+    def get_reserved(self):
+        ''' Return the sorted positions in the six-digit permutation that
+        belong to reserved IDs. '''
+        if self.reserved is None:
+            with self.lock:
+                if self.reserved is None:
+                    first, size = SIX_DIGITS
+                    ids = ReservedPublicId.objects.filter(
+                        kind=self.kind, public_id__gte=first, public_id__lt=first + size,
+                    ).values_list('public_id', flat=True)
+                    self.reserved = sorted(self.six.inverse(i - first) for i in ids)
+        return self.reserved
+
+    def capacity(self):
+        ''' How many six-digit IDs the sequence can hand out in total. '''
+        return SIX_DIGITS[1] - len(self.get_reserved())
+
+    def public_id(self, n):
+        ''' Return the public ID of the n:th sequence number. '''
+        reserved = self.get_reserved()
+        capacity = SIX_DIGITS[1] - len(reserved)
+
+        if n < capacity:
+            ''' Find the position x with exactly n free positions before
+            it. Moving x past the reserved ones up to it only ever moves
+            it forward, and it stops on a free position. '''
+            x = n
+            while True:
+                skipped = bisect.bisect_right(reserved, x)
+                if n + skipped == x:
+                    break
+                x = n + skipped
+            return SIX_DIGITS[0] + self.six.permute(x)
+
+        n -= capacity
+        if n >= SEVEN_DIGITS[1]:
+            raise PublicIdsExhausted("Inga fler id:n för {}.".format(self.kind))
+        return SEVEN_DIGITS[0] + self.seven.permute(n)
+
+
+_allocators = {}
+_allocators_lock = threading.Lock()
+
+
+def get_allocator(kind):
+    with _allocators_lock:
+        if kind not in _allocators:
+            _allocators[kind] = PublicIdAllocator(kind)
+        return _allocators[kind]
+
+
+def sequence_name(kind):
+    return "core_public_id_{}".format(kind)
+
+
+def allocate_public_ids(kind, count):
+    ''' Return `count` new public IDs of the kind, using one query. '''
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(%s) FROM generate_series(1, %s)", [sequence_name(kind), count]
+        )
+        numbers = [row[0] for row in cursor.fetchall()]
+
+    allocator = get_allocator(kind)
+    return [allocator.public_id(n) for n in numbers]
+
+
+def allocate_public_id(kind):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT nextval(%s)", [sequence_name(kind)])
+        n = cursor.fetchone()[0]
+    return get_allocator(kind).public_id(n)
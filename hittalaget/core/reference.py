@@ -0,0 +1,247 @@
+''' The reference data of the site: sports, the choice lists of each
+sport, positions and cities.
+
+Forms and views read these all the time, and they hardly ever change, so
+each process keeps them in memory instead of querying for them on every
+form. Positions and cities are loaded from the database the first time
+they are needed, and loaded again after a Position or City has been
+saved or deleted. Other processes see the change through a version
+token in the cache, which is checked at most every
+REFERENCE_CHECK_INTERVAL seconds, so the cache must be one that all
+processes share (see object_cache.py). '''
+
+import copy
+import threading
+import time
+import uuid
+
+from django import forms
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from hittalaget.players.form_choices import (
+    football_experiences,
+    football_sides,
+    football_special_abilities,
+)
+from hittalaget.teams.form_choices import football_levels
+
+
+REFERENCE_CHECK_INTERVAL = 5
+REFERENCE_MAX_AGE = 60 * 60
+REFERENCE_VERSION_KEY = "reference:version"
+
+SPORTS = [
+    ("fotboll", "Fotboll"),
+]
+
+''' The choice lists of each sport. The ads use the experience and
+special ability lists of the players, since they are matched against
+them. '''
+SPORT_CHOICES = {
+    "fotboll": {
+        "side": football_sides,
+        "experience": football_experiences,
+        "special_ability": football_special_abilities,
+        "level": football_levels,
+    },
+}
+
+SPORT_VALUES = {
+    sport: {name: [value for value, label in choices] for name, choices in lists.items()}
+    for sport, lists in SPORT_CHOICES.items()
+}
+
+SIDE_LABELS = {
+    "fotboll": "Bästa fot",
+}
+
+
+def is_sport(sport):
+    return sport in SPORT_CHOICES
+
+
+def get_choices(sport, name):
+    ''' Return the (value, label) choices of the list for the sport. '''
+    return SPORT_CHOICES[sport][name]
+
+
+def get_values(sport, name):
+    return SPORT_VALUES[sport][name]
+
+
+class ReferenceData:
+    ''' The positions and cities as loaded at one point in time. '''
+
+    def __init__(self, positions, cities, version):
+        self.positions_by_pk = {position.pk: position for position in positions}
+        self.cities_by_pk = {city.pk: city for city in cities}
+        self.cities = cities
+        self.sport_positions = {}
+        for position in positions:
+            self.sport_positions.setdefault(position.sport, []).append(position)
+        self.version = version
+        self.loaded_at = self.checked_at = time.monotonic()
+
+    def is_expired(self):
+        ''' Rows inserted without signals (bulk_create, raw SQL) or a
+        change that was rolled back are picked up after this long. '''
+        return time.monotonic() - self.loaded_at > REFERENCE_MAX_AGE
+
+    def get_positions(self, sport):
+        return self.sport_positions.get(sport, [])
+
+
+_data = None
+_lock = threading.Lock()
+
+
+def _get_version():
+    cache.add(REFERENCE_VERSION_KEY, uuid.uuid4().hex, None)
+    return cache.get(REFERENCE_VERSION_KEY)
+
+
+def _load(version):
+    from hittalaget.players.models import Position
+    from hittalaget.users.models import City
+
+    return ReferenceData(
+        list(Position.objects.order_by('pk')),
+        list(City.objects.order_by('pk')),
+        version,
+    )
+
+
+def get_reference_data():
+    global _data
+    data = _data
+    if data is not None and time.monotonic() - data.checked_at < REFERENCE_CHECK_INTERVAL:
+        return data
+
+    ''' The version is read before loading, so that a change committed
+    while loading makes the next check load again. '''
+    version = _get_version()
+    if data is not None and data.version == version and not data.is_expired():
+        data.checked_at = time.monotonic()
+        return data
+
+    with _lock:
+        if _data is None or _data.version != version or _data.is_expired():
+            _data = _load(version)
+        return _data
+
+
+def get_positions(sport):
+    return get_reference_data().get_positions(sport)
+
+
+def get_position(pk):
+    return get_reference_data().positions_by_pk.get(pk)
+
+
+def get_cities():
+    return get_reference_data().cities
+
+
+def get_city(pk):
+    return get_reference_data().cities_by_pk.get(pk)
+
+
+def invalidate():
+    ''' Load the positions and cities again. This process does so right
+    away, since it can already see the change, and the other processes
+    once the current transaction is committed. '''
+    global _data
+    _data = None
+
+    def bump():
+        global _data
+        _data = None
+        cache.set(REFERENCE_VERSION_KEY, uuid.uuid4().hex, None)
+    transaction.on_commit(bump)
+
+
+# ---------------------------------- #
+# ------------- FORMS -------------- #
+# ---------------------------------- #
+
+
+class SportForm(forms.Form):
+    sport = forms.CharField(
+        max_length=255,
+        label="Välj en sport",
+        widget=forms.Select(choices=SPORTS)
+    )
+
+
+class ReferenceChoiceMixin:
+    ''' Choices of model instances from the reference data. Like a
+    ModelChoiceField it cleans to the instances, but it never queries. '''
+
+    def set_objects(self, objects, empty_label=None):
+        self.objects = {str(obj.pk): obj for obj in objects}
+        choices = [(obj.pk, str(obj)) for obj in objects]
+        if empty_label is not None:
+            choices = [("", empty_label)] + choices
+        self.choices = choices
+
+    def get_object(self, value):
+        try:
+            obj = getattr(self, 'objects', {})[str(value)]
+        except KeyError:
+            raise ValidationError(
+                self.error_messages['invalid_choice'],
+                code='invalid_choice',
+                params={'value': value},
+            )
+        ''' The instances are shared by every request of the process, so
+        the form hands out copies of them. '''
+        return copy.copy(obj)
+
+    def prepare_value(self, value):
+        if isinstance(value, (list, tuple)):
+            return [getattr(v, 'pk', v) for v in value]
+        return getattr(value, 'pk', value)
+
+
+class ReferenceChoiceField(ReferenceChoiceMixin, forms.ChoiceField):
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        return self.get_object(value)
+
+    def validate(self, value):
+        forms.Field.validate(self, value)
+
+
+class ReferenceMultipleChoiceField(ReferenceChoiceMixin, forms.MultipleChoiceField):
+
+    def to_python(self, value):
+        return [self.get_object(v) for v in super().to_python(value)]
+
+    def validate(self, value):
+        if self.required and not value:
+            raise ValidationError(self.error_messages['required'], code='required')
+
+
+def set_reference_choices(form, name, objects):
+    ''' Replace the model choice field `name` of a form with one over
+    the given reference objects. The label, help text, widget and error
+    messages of the field are kept. '''
+    field = form.fields[name]
+    if isinstance(field, forms.ModelMultipleChoiceField):
+        field_class = ReferenceMultipleChoiceField
+    else:
+        field_class = ReferenceChoiceField
+    new_field = field_class(
+        required=field.required,
+        widget=field.widget,
+        label=field.label,
+        initial=field.initial,
+        help_text=field.help_text,
+        error_messages=field.error_messages,
+    )
+    new_field.set_objects(objects, empty_label=getattr(field, 'empty_label', None))
+    form.fields[name] = new_field
@@ -0,0 +1,86 @@
+''' Full-text search over the text of ads and teams.
+
+Every searchable model keeps a `search_vector` tsvector column with a
+GIN index, which is rebuilt by a post_save signal whenever a row is
+saved. Searches match against that column, so they never have to scan
+the table, and are ranked with ts_rank.
+
+Every match is ranked, and the best ones are shown first. Ranking needs
+the vector of every matching row, which for a very common word is a
+large part of the table. So when there are more than SEARCH_MAX_RANKED
+matches, only that many of the newest ones are ranked, and the rest are
+not shown. '''
+
+from django import forms
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
+
+
+SEARCH_CONFIG = "swedish"
+SEARCH_MAX_RANKED = 10000
+
+
+class TextSearchForm(forms.Form):
+    q = forms.CharField(required=False, max_length=255, label="Sök")
+
+
+def search(queryset, text):
+    ''' Return the rows of queryset that match text, annotated with
+    their rank. '''
+    query = SearchQuery(text, config=SEARCH_CONFIG)
+    matches = queryset.filter(search_vector=query)
+
+    ''' Counting stops at the limit, so this only reads the index entries
+    of a common word as far as that. '''
+    if matches.order_by()[:SEARCH_MAX_RANKED + 1].count() > SEARCH_MAX_RANKED:
+        newest = matches.order_by('-id').values('id')[:SEARCH_MAX_RANKED]
+        matches = queryset.filter(id__in=newest)
+
+    ''' ts_rank returns a real, which does not survive the round trip
+    through a pagination cursor. As a double precision it does. '''
+    return matches.annotate(
+        rank=Cast(SearchRank(F('search_vector'), query), FloatField()),
+    )
+
+
+def update_search_vector(instance, vector):
+    ''' Rebuild the search vector of a saved instance. The vector refers
+    to the row's own columns, so it has to be written with an UPDATE
+    after the row exists. '''
+    type(instance).objects.filter(pk=instance.pk).update(search_vector=vector)
+
+
+class TextSearchMixin:
+    ''' Add a ?q= text search to a ListView using KeysetPaginationMixin.
+    While searching, the rows are ordered by rank, best first. '''
+    search_kwarg = "q"
+
+    def get_text_search_form(self):
+        if not hasattr(self, 'text_search_form'):
+            self.text_search_form = TextSearchForm(self.request.GET or None)
+        return self.text_search_form
+
+    def get_search_text(self):
+        ''' Return the search text, or None when not searching. '''
+        form = self.get_text_search_form()
+        if not form.is_bound or not form.is_valid():
+            return None
+        return form.cleaned_data['q'].strip() or None
+
+    def search_queryset(self, queryset):
+        text = self.get_search_text()
+        if text is None:
+            return queryset
+        return search(queryset, text)
+
+    def get_keyset_ordering(self):
+        if self.get_search_text() is None:
+            return super().get_keyset_ordering()
+        return ("-rank", "-id")
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['text_search_form'] = self.get_text_search_form()
+        context['search_text'] = self.get_search_text()
+        return context
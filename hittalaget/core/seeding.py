@@ -0,0 +1,665 @@
+''' The work of the seed_market command: a synthetic market, as large as
+asked for, for load tests and development.
+
+The rows are generated in worker processes, in chunks, and streamed
+into Postgres with COPY, so the save() signals are skipped. Whatever
+they would have done is done by the generator itself: usernames and
+profile fields are copied to the players, slugs and ad titles are built,
+public IDs are allocated, the inbox entries are written along with the
+messages, and the search vectors are filled in with one UPDATE per
+chunk.
+
+Everything the chunks have to agree on is planned up front, in this
+process: the first primary key of every table, the public IDs, and how
+many ads, history entries and messages each team, player and
+conversation gets. A chunk draws the rest from a random generator of
+its own, seeded with the seed and the position of the chunk, so the
+same seed gives the same market however many workers load it. Into an
+empty database it gives the same primary keys as well.
+
+A chunk is loaded in one transaction. The users, with their players,
+teams and ads, are loaded before the conversations, which refer to them.
+Each conversation chunk loads its conversations with their users,
+messages and inbox entries. '''
+
+import bisect
+import io
+import multiprocessing
+import os
+import random
+import re
+import time
+from datetime import datetime, timedelta
+
+import django
+import numpy as np
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, connections, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from hittalaget.ads.models import AD_SEARCH_VECTOR, Ad
+from hittalaget.conversations.models import (
+    AdConversation,
+    AdMessage,
+    InboxEntry,
+    PmConversation,
+    PmMessage,
+)
+from hittalaget.players.models import History, Player, Position
+from hittalaget.teams.models import TEAM_SEARCH_VECTOR, Team
+from hittalaget.users.models import City
+
+from . import reference
+from .benchmarks import seed_positions
+from .jobs import enqueue_many
+from .public_ids import allocate_public_ids
+
+User = get_user_model()
+
+SPORT = "fotboll"
+
+''' When the newest rows are from, unless told otherwise. It is part of
+what the seed reproduces, so it is a fixed date rather than today. '''
+SEED_NOW = datetime(2020, 3, 1, tzinfo=timezone.utc)
+
+''' Rows per chunk. They are part of what the seed reproduces, so they
+are not options. '''
+USER_CHUNK = 5000
+CONVERSATION_CHUNK = 2000
+
+SIZES = {
+    "users": 10000,
+    "players": 6000,
+    "teams": 500,
+    "ads": 3000,
+    "pm_conversations": 5000,
+    "ad_conversations": 5000,
+    "messages": 200000,
+}
+
+''' The shape of the market. Override any of them with a JSON file. '''
+DISTRIBUTIONS = {
+    # The number of cities, and the Zipf exponent of how the users are
+    # spread over them. The first cities are the largest.
+    "cities": 290,
+    "city_skew": 1.0,
+    # Ages in years, heights in cm (mean and standard deviation).
+    "age": [16, 45],
+    "height": [180, 8],
+    # The share of the players that are looking for a team, and the
+    # weights of how many positions and history entries a player has.
+    "available": 0.6,
+    "positions": {"1": 60, "2": 30, "3": 10},
+    "history": {"0": 40, "1": 30, "2": 20, "3": 10},
+    # The share of the teams that are looking for players, and that are
+    # verified.
+    "looking": 0.5,
+    "verified": 0.1,
+    # Pareto shapes of how the ads are spread over the teams, and the
+    # messages over the conversations. Lower is more uneven.
+    "ad_skew": 1.5,
+    "message_skew": 1.2,
+    # The mean minutes between two messages of a conversation, how many
+    # days back the conversations go, the chance that the author of a
+    # message changes, and the share of the conversations whose last
+    # messages have not been read.
+    "message_gap": 30,
+    "days": 365,
+    "reply": 0.6,
+    "unread": 0.3,
+}
+
+CITY_NAMES = [
+    "Stockholm", "Göteborg", "Malmö", "Uppsala", "Västerås", "Örebro",
+    "Linköping", "Helsingborg", "Jönköping", "Norrköping", "Lund", "Umeå",
+    "Gävle", "Borås", "Södertälje", "Eskilstuna", "Halmstad", "Växjö",
+    "Karlstad", "Sundsvall", "Östersund", "Trollhättan", "Luleå", "Borlänge",
+    "Kristianstad", "Kalmar", "Falun", "Skövde", "Karlskrona", "Skellefteå",
+    "Uddevalla", "Varberg", "Nyköping", "Motala", "Landskrona", "Örnsköldsvik",
+    "Trelleborg", "Ängelholm", "Lidköping", "Visby",
+]
+FIRST_NAMES = [
+    "Erik", "Lars", "Karl", "Anders", "Johan", "Per", "Nils", "Jonas",
+    "Oskar", "Emil", "Hugo", "Viktor", "Axel", "Filip", "Isak", "Leo",
+    "Anna", "Eva", "Maria", "Karin", "Sara", "Emma", "Elin", "Ida",
+    "Maja", "Wilma", "Alva", "Ebba", "Julia", "Linnea", "Moa", "Klara",
+]
+LAST_NAMES = [
+    "Andersson", "Johansson", "Karlsson", "Nilsson", "Eriksson", "Larsson",
+    "Olsson", "Persson", "Svensson", "Gustafsson", "Pettersson", "Jonsson",
+    "Jansson", "Hansson", "Bengtsson", "Jönsson", "Lindberg", "Lindström",
+    "Lindqvist", "Lindgren", "Berg", "Axelsson", "Bergström", "Lundberg",
+]
+TEAM_NAMES = ["{} IF", "IFK {}", "{} FF", "{} BK", "{} IK", "{} SK", "FC {}", "{} United"]
+HOME_NAMES = ["{}vallen", "{} IP", "{} Arena", "{} sportfält"]
+AD_SENTENCES = [
+    "Vi tränar två gånger i veckan och spelar match på helgerna.",
+    "Laget har en bra stämning och siktar på att gå upp i år.",
+    "Du ska vara träningsvillig och vilja utvecklas.",
+    "Vi söker en spelare som kan ta plats direkt i startelvan.",
+    "Erfarenhet från seriespel är ett plus men inget krav.",
+    "Hör av dig om du vill vara med på en provträning.",
+    "Vi har konstgräs och tränar året om.",
+    "Säsongen börjar i april och vi spelar cirka tjugo matcher.",
+]
+MESSAGE_SENTENCES = [
+    "Hej!", "Tack för svaret.", "Låter bra!", "När tränar ni?",
+    "Är platsen fortfarande ledig?", "Jag kan komma på torsdag.",
+    "Vilken division spelar ni i?", "Vi hörs!", "Jag har spelat i division 4.",
+    "Kan du skicka adressen?", "Vi ses på träningen.", "Grymt, tack!",
+]
+
+COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+ESCAPED_RE = re.compile(r'[\\\t\n\r]')
+
+
+# ---------------------------------- #
+# --------------- COPY ------------- #
+# ---------------------------------- #
+
+
+def format_value(value):
+    ''' A value in the text format of COPY. Called for every value of
+    every row, so the common types come first. '''
+    kind = type(value)
+    if kind is int:
+        return str(value)
+    if kind is str:
+        return value.translate(COPY_ESCAPES) if ESCAPED_RE.search(value) else value
+    if value is None:
+        return "\\N"
+    if value is True:
+        return "t"
+    if value is False:
+        return "f"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        value = "{{{}}}".format(",".join(
+            '"{}"'.format(str(item).replace("\\", "\\\\").replace('"', '\\"')) for item in value
+        ))
+    return str(value).translate(COPY_ESCAPES)
+
+
+def copy_rows(cursor, model, fields, rows):
+    ''' Stream the rows, tuples of the values of the fields, into the
+    table of the model. '''
+    if not rows:
+        return
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join([format_value(value) for value in row]))
+        buffer.write("\n")
+    buffer.seek(0)
+    columns = ", ".join(model._meta.get_field(name).column for name in fields)
+    cursor.copy_expert("COPY {} ({}) FROM STDIN".format(model._meta.db_table, columns), buffer)
+
+
+# ---------------------------------- #
+# -------------- PLAN -------------- #
+# ---------------------------------- #
+
+
+def allocate(total, weights, minimum=0):
+    ''' Split `total` into whole numbers of at least `minimum`, one per
+    weight and in proportion to them, by the largest remainders. '''
+    counts = np.full(len(weights), minimum, dtype=np.int64)
+    rest = total - minimum * len(weights)
+    if not len(weights) or rest <= 0:
+        return counts
+    shares = weights / weights.sum() * rest
+    whole = np.floor(shares).astype(np.int64)
+    missing = rest - int(whole.sum())
+    whole[np.argsort(whole - shares, kind="stable")[:missing]] += 1
+    return counts + whole
+
+
+def cumulative(counts):
+    ''' The index of the first row of each, and the end. '''
+    return [0] + np.cumsum(counts).tolist()
+
+
+def reserve_ids(model, count):
+    ''' Return the first of `count` primary keys taken from the sequence
+    of the table, which hands out the ones after them. '''
+    if not count:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT setval(pg_get_serial_sequence(%(table)s, 'id'),"
+            " nextval(pg_get_serial_sequence(%(table)s, 'id')) + %(count)s - 1)",
+            {"table": model._meta.db_table, "count": count},
+        )
+        return cursor.fetchone()[0] - count + 1
+
+
+def coprime_multiplier(rng, size):
+    ''' A multiplier that permutes range(size). '''
+    if size <= 2:
+        return 1
+    while True:
+        m = int(rng.integers(1, max(size, 2))) * 2 + 1
+        if np.gcd(m, size) == 1:
+            return m
+
+
+def seed_cities(count):
+    names = CITY_NAMES[:count] + ["Ort {}".format(i) for i in range(len(CITY_NAMES) + 1, count + 1)]
+    City.objects.bulk_create([City(name=name) for name in names], ignore_conflicts=True)
+    cities = dict(City.objects.filter(name__in=names).values_list('name', 'pk'))
+    return [(cities[name], name) for name in names]
+
+
+def validate(sizes, distributions):
+    unknown = set(distributions) - set(DISTRIBUTIONS)
+    if unknown:
+        raise ValueError("Unknown distributions: {}.".format(", ".join(sorted(unknown))))
+    if sizes["users"] < sizes["players"] + sizes["teams"]:
+        raise ValueError("Every player and every team needs a user of its own, so there must be "
+                         "at least as many users as players and teams together.")
+    if sizes["ads"] and not sizes["teams"]:
+        raise ValueError("The ads need teams.")
+    if sizes["pm_conversations"] > sizes["users"] * ((sizes["users"] - 1) // 2):
+        raise ValueError("There are not enough pairs of users for the private conversations.")
+    if sizes["ad_conversations"] > sizes["ads"] * sizes["players"]:
+        raise ValueError("There are not enough ads and players for the ad conversations.")
+    if sizes["messages"] < sizes["pm_conversations"] + sizes["ad_conversations"]:
+        raise ValueError("Every conversation needs a message.")
+
+
+def make_plan(sizes, seed, distributions, prefix, sport, password, now):
+    ''' Return the plan the chunks share, and the chunks. '''
+    rng = np.random.default_rng(seed)
+    users, players, teams, ads = sizes["users"], sizes["players"], sizes["teams"], sizes["ads"]
+    pm_conversations, ad_conversations = sizes["pm_conversations"], sizes["ad_conversations"]
+
+    cities = seed_cities(distributions["cities"])
+    reference.invalidate()
+    positions = list(Position.objects.filter(pk__in=seed_positions(sport)).order_by('pk').values_list('pk', 'name'))
+
+    history = [int(k) for k in distributions["history"]]
+    history_counts = rng.choice(history, size=players, p=normalize(distributions["history"].values()))
+    ad_counts = allocate(ads, rng.pareto(distributions["ad_skew"], teams) + 1)
+    message_counts = allocate(
+        sizes["messages"], rng.pareto(distributions["message_skew"], pm_conversations + ad_conversations) + 1, 1,
+    )
+
+    plan = {
+        "seed": seed,
+        "prefix": prefix,
+        "sport": sport,
+        "password": password,
+        "now": now,
+        "sizes": sizes,
+        "distributions": distributions,
+        "cities": cities,
+        "city_weights": np.cumsum(1 / np.arange(1, len(cities) + 1) ** distributions["city_skew"]).tolist(),
+        "positions": positions,
+        "choices": {name: reference.get_values(sport, name) for name in reference.SPORT_CHOICES[sport]},
+        "ad_teams": cumulative(ad_counts),
+        "pm_multiplier": coprime_multiplier(rng, users),
+        "ad_multiplier": coprime_multiplier(rng, players),
+        "first_ids": {
+            "user": reserve_ids(User, users),
+            "player": reserve_ids(Player, players),
+            "history": reserve_ids(History, int(history_counts.sum())),
+            "team": reserve_ids(Team, teams),
+            "ad": reserve_ids(Ad, ads),
+            "pm_conversation": reserve_ids(PmConversation, pm_conversations),
+            "ad_conversation": reserve_ids(AdConversation, ad_conversations),
+            "pm_message": reserve_ids(PmMessage, int(message_counts[:pm_conversations].sum())),
+            "ad_message": reserve_ids(AdMessage, int(message_counts[pm_conversations:].sum())),
+            "inbox": reserve_ids(InboxEntry, 2 * (pm_conversations + ad_conversations)),
+        },
+    }
+
+    team_ids = allocate_public_ids("team", teams) if teams else []
+    ad_ids = allocate_public_ids("ad", ads) if ads else []
+    conversation_ids = allocate_public_ids("conversation", ad_conversations) if ad_conversations else []
+    history_starts = cumulative(history_counts)
+
+    chunks = []
+    for start in range(0, users, USER_CHUNK):
+        end = min(start + USER_CHUNK, users)
+        team_start, team_end = min(max(start - players, 0), teams), min(max(end - players, 0), teams)
+        chunks.append({
+            "kind": "users",
+            "start": start,
+            "end": end,
+            "history_starts": history_starts[min(start, players):min(end, players) + 1],
+            "team_ids": team_ids[team_start:team_end],
+            "ad_ids": ad_ids[plan["ad_teams"][team_start]:plan["ad_teams"][team_end]],
+        })
+
+    message_starts = cumulative(message_counts)
+    for kind, count, offset in (("pm", pm_conversations, 0), ("ad", ad_conversations, pm_conversations)):
+        for start in range(0, count, CONVERSATION_CHUNK):
+            end = min(start + CONVERSATION_CHUNK, count)
+            ''' Counted from the first message of the kind. '''
+            first = message_starts[offset]
+            chunks.append({
+                "kind": kind,
+                "start": start,
+                "end": end,
+                "message_starts": [n - first for n in message_starts[offset + start:offset + end + 1]],
+                "conversation_ids": conversation_ids[start:end] if kind == "ad" else [],
+            })
+    return plan, chunks
+
+
+def normalize(weights):
+    weights = np.array(list(weights), dtype=float)
+    return weights / weights.sum()
+
+
+# ---------------------------------- #
+# ------------- CHUNKS ------------- #
+# ---------------------------------- #
+
+
+_plan = None
+
+
+def init_worker(plan):
+    ''' Runs in each worker process. A process that was not forked has
+    to set up Django first. '''
+    global _plan
+    if not apps.ready:
+        django.setup()
+    _plan = plan
+
+
+def get_username(plan, i):
+    return "{}_{}".format(plan["prefix"], i + 1)
+
+
+def user_attributes(plan, rng, count):
+    ''' The cities, birthdays and heights of `count` users. '''
+    distributions = plan["distributions"]
+    now = plan["now"]
+    cities = rng.choices(plan["cities"], cum_weights=plan["city_weights"], k=count)
+    youngest, oldest = distributions["age"]
+    mean, deviation = distributions["height"]
+    return [
+        (
+            city,
+            now - timedelta(days=rng.uniform(youngest, oldest + 1) * 365.25),
+            min(max(int(rng.gauss(mean, deviation)), 150), 210),
+        )
+        for city in cities
+    ]
+
+
+def load_users(plan, chunk):
+    ''' Load the users of the chunk, with their players, positions and
+    history entries, and their teams with their ads. '''
+    rng = random.Random("{}:users:{}".format(plan["seed"], chunk["start"]))
+    distributions = plan["distributions"]
+    sizes = plan["sizes"]
+    first_ids = plan["first_ids"]
+    choices = plan["choices"]
+    sport = plan["sport"]
+    now = plan["now"]
+
+    users, players, player_positions, history, teams, ads = [], [], [], [], [], []
+    position_counts = [int(k) for k in distributions["positions"]]
+    position_weights = list(distributions["positions"].values())
+
+    attributes = user_attributes(plan, rng, chunk["end"] - chunk["start"])
+    for i, ((city_id, city_name), birthday, height) in zip(range(chunk["start"], chunk["end"]), attributes):
+        user_id = first_ids["user"] + i
+        username = get_username(plan, i)
+        first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        users.append((
+            user_id, plan["password"], False, username, first_name, last_name,
+            "{}@example.com".format(username), False, True,
+            now - timedelta(days=rng.uniform(0, distributions["days"])), birthday, height, city_id,
+        ))
+
+        if i < sizes["players"]:
+            player_id = first_ids["player"] + i
+            players.append((
+                player_id, user_id, username, sport,
+                rng.choice(choices["side"]), rng.choice(choices["experience"]),
+                rng.choice(choices["special_ability"]), rng.random() < distributions["available"],
+                city_id, birthday, height, "images/players/default.png", [],
+            ))
+            count = min(rng.choices(position_counts, position_weights)[0], len(plan["positions"]))
+            for position_id, name in rng.sample(plan["positions"], count):
+                player_positions.append((player_id, position_id))
+
+            n = i - chunk["start"]
+            for h in range(chunk["history_starts"][n], chunk["history_starts"][n + 1]):
+                start_year = now.year - rng.randint(1, 15)
+                history.append((
+                    first_ids["history"] + h, start_year, min(start_year + rng.randint(0, 4), now.year),
+                    rng.choice(TEAM_NAMES).format(rng.choice(plan["cities"])[1]), player_id,
+                ))
+
+        elif i < sizes["players"] + sizes["teams"]:
+            t = i - sizes["players"]
+            team_id = first_ids["team"] + t
+            name = rng.choice(TEAM_NAMES).format(city_name)
+            teams.append((
+                team_id, user_id, name, city_id, chunk["team_ids"][len(teams)], slugify(name),
+                rng.randint(1880, now.year - 1), rng.choice(HOME_NAMES).format(city_name),
+                rng.random() < distributions["looking"], rng.random() < distributions["verified"],
+                "", sport, rng.choice(choices["level"]), "images/teams/default.png", [],
+            ))
+            for a in range(plan["ad_teams"][t], plan["ad_teams"][t + 1]):
+                position_id, position_name = rng.choice(plan["positions"])
+                title = "{} söker {}".format(name, position_name)
+                ads.append((
+                    first_ids["ad"] + a, chunk["ad_ids"][len(ads)], team_id, sport, title, slugify(title),
+                    " ".join(rng.sample(AD_SENTENCES, rng.randint(2, 4))),
+                    rng.randint(20, 40), rng.randint(160, 185), position_id,
+                    rng.choice(choices["experience"][:8]), rng.choice(choices["special_ability"]),
+                ))
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        copy_rows(cursor, User, [
+            'id', 'password', 'is_superuser', 'username', 'first_name', 'last_name', 'email',
+            'is_staff', 'is_active', 'date_joined', 'birthday', 'height', 'city',
+        ], users)
+        copy_rows(cursor, Player, [
+            'id', 'user', 'username', 'sport', 'side', 'experience', 'special_ability',
+            'is_available', 'city', 'birthday', 'height', 'image', 'image_renditions',
+        ], players)
+        copy_rows(cursor, Player.positions.through, ['player', 'position'], player_positions)
+        copy_rows(cursor, History, ['id', 'start_year', 'end_year', 'team_name', 'player'], history)
+        copy_rows(cursor, Team, [
+            'id', 'user', 'name', 'city', 'team_id', 'slug', 'founded', 'home', 'is_looking',
+            'is_verified', 'website', 'sport', 'level', 'image', 'image_renditions',
+        ], teams)
+        copy_rows(cursor, Ad, [
+            'id', 'ad_id', 'team', 'sport', 'title', 'slug', 'description', 'max_age',
+            'min_height', 'position', 'min_experience', 'special_ability',
+        ], ads)
+        if teams:
+            Team.objects.filter(pk__range=(teams[0][0], teams[-1][0])).update(search_vector=TEAM_SEARCH_VECTOR)
+        if ads:
+            Ad.objects.filter(pk__range=(ads[0][0], ads[-1][0])).update(search_vector=AD_SEARCH_VECTOR)
+    return {"users": len(users), "players": len(players), "history": len(history),
+            "teams": len(teams), "ads": len(ads)}
+
+
+def get_pm_pair(plan, c):
+    ''' The users of the c:th private conversation. The c:th pair of a
+    permutation of the users, with users k + 1 apart, so no pair comes
+    twice. '''
+    users = plan["sizes"]["users"]
+    a = (c % users) * plan["pm_multiplier"] % users
+    b = (a + 1 + c // users) % users
+    return a, b
+
+
+def get_ad_pair(plan, c):
+    ''' The player and the team user of the c:th ad conversation, and the
+    index of its ad. '''
+    sizes = plan["sizes"]
+    ad = c % sizes["ads"]
+    player = (ad * plan["ad_multiplier"] + c // sizes["ads"]) % sizes["players"]
+    team = bisect.bisect_right(plan["ad_teams"], ad) - 1
+    return player, sizes["players"] + team, ad
+
+
+def load_conversations(plan, chunk):
+    ''' Load the conversations of the chunk, with their users, messages
+    and inbox entries. '''
+    kind = chunk["kind"]
+    rng = random.Random("{}:{}:{}".format(plan["seed"], kind, chunk["start"]))
+    distributions = plan["distributions"]
+    first_ids = plan["first_ids"]
+    now = plan["now"]
+    if kind == "pm":
+        conversation_model, message_model = PmConversation, PmMessage
+        inbox_offset = 0
+    else:
+        conversation_model, message_model = AdConversation, AdMessage
+        inbox_offset = 2 * plan["sizes"]["pm_conversations"]
+
+    conversations, members, messages, inbox = [], [], [], []
+    for n, c in enumerate(range(chunk["start"], chunk["end"])):
+        conversation_id = first_ids["{}_conversation".format(kind)] + c
+        if kind == "pm":
+            first, second = get_pm_pair(plan, c)
+        else:
+            first, second, ad = get_ad_pair(plan, c)
+        usernames = [get_username(plan, first), get_username(plan, second)]
+        user_ids = [first_ids["user"] + first, first_ids["user"] + second]
+        if kind == "pm":
+            conversations.append((
+                conversation_id, "pm", PmConversation.make_participants_key(*user_ids), usernames,
+            ))
+        else:
+            conversations.append((
+                conversation_id, "ad", usernames, first_ids["ad"] + ad, chunk["conversation_ids"][n], True,
+            ))
+        members.extend([(conversation_id, user_ids[0]), (conversation_id, user_ids[1])])
+
+        ''' The times run back from the last message. '''
+        count = chunk["message_starts"][n + 1] - chunk["message_starts"][n]
+        last = now - timedelta(minutes=rng.uniform(0, distributions["days"] * 24 * 60))
+        created = [last]
+        for _ in range(count - 1):
+            created.append(created[-1] - timedelta(minutes=rng.expovariate(1 / distributions["message_gap"])))
+        created.reverse()
+
+        author = 0
+        run = 0
+        message_id = first_ids["{}_message".format(kind)] + chunk["message_starts"][n]
+        for m, at in enumerate(created):
+            if m and rng.random() < distributions["reply"]:
+                author = 1 - author
+                run = 0
+            run += 1
+            content = " ".join(rng.sample(MESSAGE_SENTENCES, rng.randint(1, 3)))
+            at = at.isoformat()
+            messages.append((message_id + m, at, at, user_ids[author], content, conversation_id))
+
+        ''' The last author has read everything. The other user may not
+        have read the last messages in a row. '''
+        unread = run if rng.random() < distributions["unread"] else 0
+        inbox_id = first_ids["inbox"] + inbox_offset + 2 * c
+        for u, user_id in enumerate(user_ids):
+            inbox.append((
+                inbox_id + u, user_id, kind, conversation_id, created[-1],
+                content[:InboxEntry.SNIPPET_LENGTH], 0 if u == author else unread,
+            ))
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if kind == "pm":
+            copy_rows(cursor, PmConversation, ['id', 'tag', 'participants_key', 'users_arr'], conversations)
+        else:
+            copy_rows(cursor, AdConversation, [
+                'id', 'tag', 'users_arr', 'ad', 'conversation_id', 'is_active',
+            ], conversations)
+        copy_rows(cursor, conversation_model.users.through, [conversation_model._meta.model_name, 'user'], members)
+        copy_rows(cursor, message_model, ['id', 'created', 'modified', 'author', 'content', 'conversation'], messages)
+        copy_rows(cursor, InboxEntry, [
+            'id', 'user', 'tag', '{}_conversation'.format(kind), 'last_message_at', 'snippet', 'unread_count',
+        ], inbox)
+    return {"{}_conversations".format(kind): len(conversations), "{}_messages".format(kind): len(messages)}
+
+
+def load_chunk(chunk):
+    try:
+        if chunk["kind"] == "users":
+            return load_users(_plan, chunk)
+        return load_conversations(_plan, chunk)
+    finally:
+        connections.close_all()
+
+
+# ---------------------------------- #
+# -------------- SEED -------------- #
+# ---------------------------------- #
+
+
+def run_chunks(chunks, workers, progress):
+    counts = {}
+    if workers == 1:
+        results = map(load_chunk, chunks)
+    else:
+        ''' The workers open connections of their own. Forked with this
+        one open, they would share it. '''
+        connections.close_all()
+        pool = multiprocessing.get_context().Pool(workers, initializer=init_worker, initargs=(_plan,))
+        results = pool.imap_unordered(load_chunk, chunks)
+    try:
+        for result in results:
+            for name, count in result.items():
+                counts[name] = counts.get(name, 0) + count
+            progress(counts)
+    finally:
+        if workers != 1:
+            pool.close()
+            pool.join()
+    return counts
+
+
+def get_today():
+    ''' Today at midnight (UTC), for a market that looks current. The
+    same seed then gives another market every day. '''
+    return timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def seed_market(sizes, seed=0, distributions=None, prefix="m", workers=None, sport=SPORT,
+                password=None, now=None, match=False, progress=None):
+    ''' Seed the market, and return how many rows of each kind were
+    loaded. `now` is when the newest rows are from, SEED_NOW by default
+    (see get_today() for today). '''
+    global _plan
+    sizes = dict(SIZES, **sizes)
+    distributions = dict(DISTRIBUTIONS, **(distributions or {}))
+    validate(sizes, distributions)
+    if User.objects.filter(username=get_username({"prefix": prefix}, 0)).exists():
+        raise ValueError("There are users with the prefix {} already.".format(prefix))
+
+    if now is None:
+        now = SEED_NOW
+    workers = workers or os.cpu_count() or 1
+    progress = progress or (lambda counts: None)
+    start = time.perf_counter()
+
+    ''' One hash for all users, since hashing is slow on purpose. '''
+    password = make_password(password)
+    with transaction.atomic():
+        _plan, chunks = make_plan(sizes, seed, distributions, prefix, sport, password, now)
+
+    counts = run_chunks([chunk for chunk in chunks if chunk["kind"] == "users"], workers, progress)
+    counts.update(run_chunks([chunk for chunk in chunks if chunk["kind"] != "users"], workers, progress))
+
+    with connection.cursor() as cursor:
+        for model in (User, Player, Player.positions.through, History, Team, Ad, PmConversation,
+                      AdConversation, PmMessage, AdMessage, InboxEntry):
+            cursor.execute("ANALYZE {}".format(model._meta.db_table))
+
+    if match and sizes["ads"]:
+        first = _plan["first_ids"]["ad"]
+        enqueue_many("ads.refresh_ad_matches", [[pk] for pk in range(first, first + sizes["ads"])])
+    counts["seconds"] = round(time.perf_counter() - start, 1)
+    return counts
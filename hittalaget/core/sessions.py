@@ -0,0 +1,201 @@
+''' Sessions, and the users of them, from a cache in each process.
+
+Every logged-in request reads its session and its user before any view
+runs. With SESSION_ENGINE set to this module, both usually come from an
+LRU cache in the process instead of the database.
+
+Sessions are stored as with the cached_db engine: in the database, and
+written through to the shared cache when they are saved. The local
+entry of a session holds its data and, once it is known, its user, with
+the object cache tokens (see object_cache.py) of "session:<key>" and
+"user:<pk>". It is used while both tokens are unchanged, which is one
+get_many from the shared cache per request.
+
+Saving or deleting a session, as logging in and out does, bumps its
+token and writes the entry through in this process. The user is added
+to the entry when logging in, so the next request reads neither table.
+Saving a user bumps the other token, so a user deactivated by
+UserDeleteView is rejected by every process on its next request, since
+ModelBackend does not let inactive users in.
+
+The tokens must be in a cache that all processes share, like memcached
+or redis, or the other processes will not see them change. Entries are
+kept at most SESSION_LOCAL_TIMEOUT seconds, so a session that expires
+is soon read from the shared cache again, which has expired it too. '''
+
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.contrib import auth
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.auth.signals import user_logged_in
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from django.utils.functional import SimpleLazyObject
+
+from .object_cache import bump, get_versions, is_current
+
+SESSION_LOCAL_CACHE_SIZE = 10000
+SESSION_LOCAL_TIMEOUT = 60
+
+
+class LocalCache:
+    ''' A thread-safe LRU cache of at most `size` entries, which expire
+    `timeout` seconds after they were set. '''
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.timeout, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+''' {session key: entry}. An entry is a dict of the tokens it depends on,
+the pickled data and the pickled user, or None. Entries are replaced
+rather than changed, so other threads never see half of one, and the
+objects are pickled so requests never share them. '''
+local_sessions = LocalCache(SESSION_LOCAL_CACHE_SIZE, SESSION_LOCAL_TIMEOUT)
+
+
+def _session_name(session_key):
+    return "session:{}".format(session_key)
+
+
+def _user_name(user_id):
+    return "user:{}".format(user_id)
+
+
+class SessionStore(CachedDBStore):
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        ''' (tokens, pickled user) of the user of the session, when it is
+        known. '''
+        self.cached_user = None
+
+    def load(self):
+        session_key = self.session_key
+        entry = local_sessions.get(session_key)
+        if entry is not None and is_current(entry["versions"]):
+            if entry["user"] is not None:
+                self.cached_user = (entry["versions"], entry["user"])
+            return pickle.loads(entry["data"])
+
+        versions = get_versions([_session_name(session_key)])
+        data = super().load()
+        if self.session_key is not None:
+            local_sessions.set(session_key, {"versions": versions, "data": pickle.dumps(data), "user": None})
+        return data
+
+    def save(self, must_create=False):
+        super().save(must_create)
+        versions = bump(_session_name(self.session_key))
+        user = None
+        if self.get_cached_user_name() is not None:
+            cached_versions, user = self.cached_user
+            versions.update({name: token for name, token in cached_versions.items() if name.startswith("user:")})
+        local_sessions.set(self.session_key, {"versions": versions, "data": pickle.dumps(self._session), "user": user})
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            session_key = self.session_key
+        super().delete(session_key)
+        if session_key is not None:
+            bump(_session_name(session_key))
+            local_sessions.delete(session_key)
+
+    def get_cached_user_name(self):
+        ''' The name of the cached user, if it is still the user of the
+        session. '''
+        if self.cached_user is None:
+            return None
+        name = _user_name(self.get(auth.SESSION_KEY))
+        return name if name in self.cached_user[0] else None
+
+    def remember_user(self, user, versions):
+        self.cached_user = (versions, pickle.dumps(user))
+        entry = local_sessions.get(self.session_key)
+        if entry is not None:
+            local_sessions.set(self.session_key, {
+                "versions": {**entry["versions"], **versions},
+                "data": entry["data"],
+                "user": self.cached_user[1],
+            })
+
+    def get_cached_user(self, load):
+        ''' The user of the session, from its entry, or load(), which is
+        added to the entry if it is a logged-in user. '''
+        user_id = self.get(auth.SESSION_KEY)
+        if self.get_cached_user_name() is not None:
+            return pickle.loads(self.cached_user[1])
+        if user_id is None:
+            return load()
+
+        versions = get_versions([_user_name(user_id)])
+        user = load()
+        if user.is_authenticated and self.session_key is not None:
+            self.remember_user(user, versions)
+        return user
+
+
+def get_user(request):
+    ''' The user of the request, as django.contrib.auth.get_user() would
+    return it. From the cache when the session engine is this module. '''
+    session = request.session
+    if hasattr(session, 'get_cached_user'):
+        return session.get_cached_user(lambda: auth.get_user(request))
+    return auth.get_user(request)
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    ''' AuthenticationMiddleware, with get_user() from this module. '''
+
+    def process_request(self, request):
+        def get_request_user():
+            if not hasattr(request, '_cached_user'):
+                request._cached_user = get_user(request)
+            return request._cached_user
+        request.user = SimpleLazyObject(get_request_user)
+
+
+# ---------------------------------- #
+# ------------- SIGNALS ------------ #
+# ---------------------------------- #
+
+
+def user_logged_in_remember_user(sender, request, user, **kwargs):
+    ''' Write the user through to the entry of the new session, which is
+    saved at the end of the request. '''
+    session = request.session
+    if isinstance(session, SessionStore):
+        session.remember_user(user, get_versions([_user_name(user.pk)]))
+
+user_logged_in.connect(user_logged_in_remember_user)
@@ -0,0 +1,40 @@
+from django import template
+
+from hittalaget.core.images import rendition_url
+
+register = template.Library()
+
+
+def _srcset(name, widths):
+    return ", ".join("{} {}w".format(rendition_url(name, width), width) for width in widths)
+
+
+@register.simple_tag
+def image_srcset(obj):
+    ''' The srcset of the renditions of obj's image, or "" if they are
+    not done yet. '''
+    if not obj.image or not obj.image_renditions:
+        return ""
+    return _srcset(obj.image.name, obj.image_renditions)
+
+
+@register.inclusion_tag("includes/image.html")
+def responsive_image(obj, width, alt=""):
+    ''' An <img> of obj's image shown `width` CSS pixels wide. The src is
+    the smallest rendition at least that wide, and the browser can pick
+    a larger one from the srcset on screens with denser pixels. Until
+    the renditions are done, the original is shown. '''
+    context = {"src": "", "srcset": "", "width": width, "alt": alt}
+    if not obj.image:
+        return context
+
+    widths = obj.image_renditions
+    if not widths:
+        context["src"] = obj.image.url
+        return context
+
+    fitting = [w for w in widths if w >= width]
+    context["src"] = rendition_url(obj.image.name, fitting[0] if fitting else widths[-1])
+    context["srcset"] = _srcset(obj.image.name, widths)
+    context["sizes"] = "{}px".format(width)
+    return context
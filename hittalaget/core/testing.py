@@ -0,0 +1,67 @@
+''' Factories of the objects that the tests of the apps need. '''
+
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from hittalaget.ads.models import Ad
+from hittalaget.players.models import Player
+from hittalaget.teams.models import Team
+from hittalaget.users.models import City
+
+
+def make_user(username, city=None, age=22, **kwargs):
+    fields = {
+        "email": "{}@example.com".format(username),
+        "first_name": "Anna",
+        "last_name": "Svensson",
+        "birthday": timezone.now() - datetime.timedelta(days=365 * age + 30),
+        "height": 180,
+        "city": city or City.objects.get_or_create(name="Stockholm")[0],
+    }
+    fields.update(kwargs)
+    user = get_user_model()(username=username, **fields)
+    user.set_password("lösenord")
+    user.save()
+    return user
+
+
+def make_player(user, positions=(), **kwargs):
+    fields = {
+        "sport": "fotboll",
+        "side": "höger",
+        "experience": "korpen",
+        "special_ability": "snabb",
+        "is_available": True,
+    }
+    fields.update(kwargs)
+    player = Player.objects.create(user=user, **fields)
+    player.positions.add(*positions)
+    return player
+
+
+def make_team(user, **kwargs):
+    fields = {
+        "name": "{} FC".format(user.username),
+        "city": user.city,
+        "founded": 2000,
+        "home": "Zinkensdamm",
+        "sport": "fotboll",
+        "level": "korpen",
+    }
+    fields.update(kwargs)
+    return Team.objects.create(user=user, **fields)
+
+
+def make_ad(team, position, **kwargs):
+    fields = {
+        "sport": team.sport,
+        "description": "Vi söker en spelare.",
+        "max_age": 30,
+        "min_height": 170,
+        "min_experience": "korpen",
+        "special_ability": "snabb",
+    }
+    fields.update(kwargs)
+    return Ad.objects.create(team=team, position=position, **fields)
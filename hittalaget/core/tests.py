@@ -0,0 +1,929 @@
+import datetime
+import json
+import os
+import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.core import signing
+from django.core.cache import cache
+from django.core.cache.backends.base import MEMCACHE_MAX_KEY_LENGTH
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image as PILImage
+from psycopg2 import extensions
+
+from hittalaget.ads.models import Ad, AdMatch
+from hittalaget.conversations.models import InboxEntry, PmMessage
+from hittalaget.players.models import History, Player, Position
+from hittalaget.teams.models import Team
+from hittalaget.users.models import City
+from . import images, instrumentation, jobs, loadtest, page_cache, public_ids, reference, search
+from .db import pool, routers
+from .management.commands import bench_public_ids
+from .models import Job, PoolMetric, ReservedPublicId
+from .object_cache import make_cache_key
+from .pagination import InvalidCursor, KeysetPaginator
+from .testing import make_ad, make_player, make_team, make_user
+
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "tests",
+        "KEY_FUNCTION": "hittalaget.core.object_cache.make_cache_key",
+    },
+}
+
+
+# --------------------------------- #
+# ----------- PAGINATION ---------- #
+# --------------------------------- #
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        for i in range(7):
+            make_team(make_user("agare{}".format(i)), founded=2000 + i % 3)
+        self.paginator = KeysetPaginator(Team.objects.all(), 3, ordering=("-founded", "id"))
+        self.expected = list(Team.objects.order_by("-founded", "id"))
+
+    def test_pages_cover_every_row_once(self):
+        page = self.paginator.page()
+        self.assertFalse(page.has_previous())
+        rows = list(page)
+        while page.has_next():
+            page = self.paginator.page(page.next_cursor)
+            rows += list(page)
+        self.assertEqual(rows, self.expected)
+        self.assertIsNone(page.next_cursor)
+
+    def test_previous_page(self):
+        first = self.paginator.page()
+        second = self.paginator.page(first.next_cursor)
+        back = self.paginator.page(second.previous_cursor)
+        self.assertEqual(list(back), list(first))
+        self.assertFalse(back.has_previous())
+        self.assertTrue(back.has_next())
+
+    def test_tampered_cursor(self):
+        cursor = self.paginator.page().next_cursor
+        for bad in ("trasig", cursor[:-2] + "xx", signing.dumps(["n", 1], salt=KeysetPaginator.salt),
+                    signing.dumps(["x", 2000, 1], salt=KeysetPaginator.salt), signing.dumps(["n", 2000, 1])):
+            with self.assertRaises(InvalidCursor):
+                self.paginator.page(bad)
+
+    def test_list_view(self):
+        url = reverse("team:list", kwargs={"sport": "fotboll"})
+        response = self.client.get(url)
+        page = response.context['page_obj']
+        self.assertEqual(len(page), 7)
+        self.assertIsNone(page.next_querystring)
+        self.assertEqual(self.client.get(url, {"sida": "trasig"}).status_code, 404)
+
+
+# --------------------------------- #
+# ---------- OBJECT CACHE --------- #
+# --------------------------------- #
+
+
+class CacheKeyTests(SimpleTestCase):
+
+    def test_plain_key_is_kept(self):
+        self.assertEqual(make_cache_key("objects:user:12", "", 1), ":1:objects:user:12")
+
+    def test_key_that_memcached_does_not_allow_is_hashed(self):
+        for name in ("player:fotboll:anna svensson", "player:fotboll:" + "a" * MEMCACHE_MAX_KEY_LENGTH):
+            key = make_cache_key("objects:" + name, "", 1)
+            self.assertTrue(key.startswith(":1:hash:"))
+            self.assertLessEqual(len(key), MEMCACHE_MAX_KEY_LENGTH)
+            self.assertNotIn(" ", key)
+
+    def test_hashed_keys_differ(self):
+        self.assertNotEqual(make_cache_key("a b", "", 1), make_cache_key("a  b", "", 1))
+
+
+@override_settings(CACHES=CACHES)
+class ObjectCacheTests(TransactionTestCase):
+
+    def setUp(self):
+        self.back = Position.objects.create(sport="fotboll", name="back")
+        self.user = make_user("kalle")
+        self.player = make_player(self.user, positions=[self.back])
+        History.objects.create(player=self.player, team_name="Gamla IK", start_year=2000, end_year=2001)
+        self.url = self.player.get_absolute_url()
+
+    def test_cached_page_does_not_query(self):
+        self.assertContains(self.client.get(self.url), "Gamla IK")
+        with CaptureQueriesContext(connection) as queries:
+            self.assertContains(self.client.get(self.url), "Gamla IK")
+        self.assertEqual(len(queries), 0)
+
+    def test_changes_make_the_player_stale(self):
+        self.client.get(self.url)
+        History.objects.create(player=self.player, team_name="Nya IK", start_year=2002, end_year=2003)
+        self.assertContains(self.client.get(self.url), "Nya IK")
+
+        self.back.name = "mittback"
+        self.back.save()
+        self.assertContains(self.client.get(self.url), "mittback")
+
+        self.user.height = 191
+        self.user.save()
+        self.assertContains(self.client.get(self.url), "191")
+
+        self.player.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_team_change_makes_its_ads_stale(self):
+        team = make_team(make_user("owner"), name="FC X")
+        ad = make_ad(team, self.back)
+        self.assertContains(self.client.get(team.get_absolute_url()), "FC X")
+        self.assertContains(self.client.get(ad.get_absolute_url()), "FC X")
+
+        team.name = "FC Y"
+        team.save()
+        self.assertContains(self.client.get(team.get_absolute_url()), "FC Y")
+        self.assertContains(self.client.get(ad.get_absolute_url()), "FC Y")
+
+        url = ad.get_absolute_url()
+        ad.delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+# --------------------------------- #
+# --------- REFERENCE DATA -------- #
+# --------------------------------- #
+
+
+@override_settings(CACHES=CACHES)
+class ReferenceDataTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        reference._data = None
+        self.addCleanup(setattr, reference, '_data', None)
+        self.back = Position.objects.create(sport="fotboll", name="back")
+
+    def test_loaded_once(self):
+        reference.get_positions("fotboll")
+        with self.assertNumQueries(0):
+            self.assertEqual(reference.get_positions("fotboll"), [self.back])
+            self.assertEqual(reference.get_position(self.back.pk), self.back)
+
+    def test_changes_are_seen_by_this_process_right_away(self):
+        reference.get_positions("fotboll")
+        forward = Position.objects.create(sport="fotboll", name="forward")
+        self.assertEqual(reference.get_positions("fotboll"), [self.back, forward])
+
+        forward.delete()
+        self.assertEqual(reference.get_positions("fotboll"), [self.back])
+
+    def test_changes_are_seen_by_other_processes_after_the_interval(self):
+        old = reference.get_reference_data()
+        malmo = City.objects.create(name="Malmö")
+
+        ''' Another process still has the data it loaded before. '''
+        reference._data = old
+        with self.assertNumQueries(0):
+            self.assertNotIn(malmo, reference.get_cities())
+        with mock.patch.object(reference, 'REFERENCE_CHECK_INTERVAL', 0):
+            self.assertIn(malmo, reference.get_cities())
+
+    def test_form_fields_hand_out_copies(self):
+        field = reference.ReferenceChoiceField()
+        field.set_objects(reference.get_positions("fotboll"))
+        position = field.clean(str(self.back.pk))
+        self.assertEqual(position, self.back)
+        self.assertIsNot(position, reference.get_position(self.back.pk))
+        with self.assertRaises(ValidationError):
+            field.clean("0")
+
+
+# --------------------------------- #
+# ------------- SEARCH ------------ #
+# --------------------------------- #
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        self.team = make_team(make_user("owner"), name="Hammarby")
+        back = Position.objects.create(sport="fotboll", name="back")
+        goalkeeper = Position.objects.create(sport="fotboll", name="målvakt")
+        ''' The oldest ad has the word in its title, which weighs the most. '''
+        self.best = make_ad(self.team, goalkeeper, description="Vi behöver en ny.")
+        self.others = [
+            make_ad(self.team, back, description="Vår målvakt slutar, så vi söker en ny back. {}".format(i))
+            for i in range(3)
+        ]
+        make_ad(self.team, back, description="Inget om det.")
+
+    def search(self, text):
+        return list(search.search(Ad.objects.all(), text).order_by('-rank', '-id'))
+
+    def test_every_match_is_ranked(self):
+        results = self.search("målvakt")
+        self.assertEqual(results[0], self.best)
+        self.assertEqual(set(results), {self.best, *self.others})
+
+    def test_words_are_stemmed(self):
+        self.assertEqual(self.search("målvakten")[0], self.best)
+
+    def test_newest_are_ranked_when_there_are_too_many(self):
+        with mock.patch.object(search, 'SEARCH_MAX_RANKED', 3):
+            results = self.search("målvakt")
+        self.assertEqual(set(results), set(self.others))
+
+    def test_list_is_ordered_by_rank(self):
+        self.client.force_login(self.team.user)
+        response = self.client.get(reverse("ad:list", kwargs={"sport": "fotboll"}), {"q": "målvakt"})
+        self.assertEqual(list(response.context['object_list'])[0], self.best)
+        self.assertEqual(len(response.context['object_list']), 4)
+
+
+# --------------------------------- #
+# ----------- PAGE CACHE ---------- #
+# --------------------------------- #
+
+
+@override_settings(CACHES=CACHES)
+class PageCacheTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.owner = make_user("owner")
+        make_team(self.owner, name="FC Alfa")
+        self.url = reverse("team:list", kwargs={"sport": "fotboll"})
+
+    def test_second_visitor_gets_the_cached_page(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Page-Cache'], "miss")
+        self.assertContains(response, "FC Alfa")
+        self.assertNotContains(response, "page-cache:")
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Page-Cache'], "hit")
+        self.assertContains(response, "FC Alfa")
+        self.assertEqual(len(queries), 0)
+
+    def test_logged_in_users_are_not_served_from_the_cache(self):
+        self.client.get(self.url)
+        self.client.force_login(self.owner)
+        response = self.client.get(self.url)
+        self.assertFalse(response.has_header('X-Page-Cache'))
+
+    def test_other_parameters_share_the_page(self):
+        self.client.get(self.url, {"q": "alfa"})
+        response = self.client.get(self.url, {"q": "alfa", "utm_source": "nyhetsbrev", "x": "123"})
+        self.assertEqual(response['X-Page-Cache'], "hit")
+        self.assertNotContains(response, "nyhetsbrev")
+
+    def test_parameters_that_change_the_page_are_in_the_key(self):
+        self.client.get(self.url)
+        self.assertEqual(self.client.get(self.url, {"q": "alfa"})['X-Page-Cache'], "miss")
+        self.assertEqual(self.client.get(self.url, {"q": "beta"})['X-Page-Cache'], "miss")
+        self.assertEqual(self.client.get(self.url, {"q": ""})['X-Page-Cache'], "hit")
+
+    def test_key_does_not_depend_on_the_order(self):
+        url = reverse("player:list", kwargs={"sport": "fotboll"})
+        self.client.get(url + "?min_height=170&max_height=190")
+        self.assertEqual(self.client.get(url + "?max_height=190&min_height=170")['X-Page-Cache'], "hit")
+
+    def test_invalid_cursor_is_not_cached(self):
+        self.assertEqual(self.client.get(self.url, {"sida": "trasig"}).status_code, 404)
+        self.assertEqual(self.client.get(self.url, {"sida": "trasig"}).status_code, 404)
+
+    def test_stale_page_is_refreshed_in_the_background(self):
+        self.client.get(self.url)
+        make_team(make_user("beta"), name="FC Beta")
+        with mock.patch.object(page_cache, 'PAGE_CACHE_FRESH', 0):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Page-Cache'], "stale")
+        self.assertNotContains(response, "FC Beta")
+
+        deadline = time.monotonic() + 5
+        while "FC Beta" not in self.client.get(self.url).content.decode():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
+
+
+# --------------------------------- #
+# ------------- IMPORTS ----------- #
+# --------------------------------- #
+
+
+class ImportTests(TestCase):
+
+    def setUp(self):
+        self.back = Position.objects.create(sport="fotboll", name="back")
+        self.owner = make_user("owner")
+        self.kalle = make_user("kalle", height=190)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+    def run_import(self, *args):
+        out, err = StringIO(), StringIO()
+        call_command("import_market", *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_teams(self):
+        path = self.write("teams.csv", "\n".join([
+            "username,sport,name,city,founded,home,level",
+            "owner,fotboll,Nya IK,Malmö,1999,Stadion,korpen",
+            "okand,fotboll,Ingen IK,Malmö,1999,Stadion,korpen",
+            "kalle,fotboll,Kalles IK,Malmö,nittio,Stadion,korpen",
+            "owner,fotboll,Andra IK,Malmö,1999,Stadion,korpen",
+        ]))
+        out, err = self.run_import("teams", path)
+        self.assertIn("Imported 1 teams", out)
+        self.assertEqual(err.splitlines(), [
+            "Row 2: unknown user: okand",
+            "Row 3: founded is not a number: nittio",
+            "Row 4: owner already has a team for fotboll",
+        ])
+
+        team = Team.objects.get()
+        self.assertEqual((team.slug, team.city.name), ("nya-ik", "Malmö"))
+        self.assertIsNotNone(team.team_id)
+        self.assertEqual(list(search.search(Team.objects.all(), "nya")), [team])
+
+    def test_players_get_the_matches_of_existing_ads(self):
+        ad = make_ad(make_team(self.owner), self.back)
+        path = self.write("players.jsonl", "\n".join(json.dumps(row) for row in [
+            {"username": "kalle", "sport": "fotboll", "positions": ["back"], "side": "höger",
+             "experience": "korpen", "special_ability": "snabb", "is_available": True},
+            {"username": "owner", "sport": "fotboll", "positions": ["libero"], "side": "höger",
+             "experience": "korpen", "special_ability": "snabb"},
+        ]))
+        out, err = self.run_import("players", path)
+        self.assertIn("Imported 1 players", out)
+        self.assertEqual(err.strip(), "Row 2: unknown position: libero")
+
+        player = Player.objects.get()
+        self.assertEqual((player.username, player.height), ("kalle", 190))
+        self.assertEqual(list(player.positions.all()), [self.back])
+
+        while jobs.run_next_job() is not None:
+            pass
+        self.assertTrue(AdMatch.objects.filter(ad=ad, player=player).exists())
+
+    def test_ads(self):
+        make_team(self.owner, name="FC X")
+        make_player(self.kalle, positions=[self.back])
+        path = self.write("ads.csv", "\n".join([
+            "username,sport,position,description,max_age,min_height,min_experience,special_ability",
+            "owner,fotboll,back,Vi söker en back.,30,170,korpen,snabb",
+            "kalle,fotboll,back,Vi söker en back.,30,170,korpen,snabb",
+            "owner,fotboll,back,Vi söker en back.,30,170,proffs,snabb",
+        ]))
+        out, err = self.run_import("ads", path)
+        self.assertIn("Imported 1 ads", out)
+        self.assertEqual(err.splitlines(), [
+            "Row 2: kalle has no team for fotboll",
+            "Row 3: min_experience is not a valid choice: proffs",
+        ])
+
+        ad = Ad.objects.get()
+        self.assertEqual(ad.title, "FC X söker back")
+        while jobs.run_next_job() is not None:
+            pass
+        self.assertEqual(list(AdMatch.objects.filter(ad=ad).values_list('player__username', flat=True)), ["kalle"])
+
+    def test_negative_numbers(self):
+        make_team(self.owner, name="FC X")
+        path = self.write("ads.csv", "\n".join([
+            "username,sport,position,description,max_age,min_height,min_experience,special_ability",
+            "owner,fotboll,back,Vi söker en back.,-1,170,korpen,snabb",
+        ]))
+        out, err = self.run_import("ads", path)
+        self.assertIn("Imported 0 ads", out)
+        self.assertEqual(err.strip(), "Row 1: max_age is negative: -1")
+
+    def test_batch_refused_by_the_database(self):
+        path = self.write("teams.csv", "\n".join([
+            "username,sport,name,city,founded,home,level",
+            "owner,fotboll,Nya IK,Malmö,1999,Stadion,korpen",
+            "kalle,fotboll,Kalles IK,Malmö,1999,{},korpen".format("x" * 300),
+        ]))
+        out, err = self.run_import("teams", path, "--batch-size", "1")
+        self.assertIn("Imported 1 teams", out)
+        self.assertTrue(err.startswith("Row 2: not imported with its batch: "))
+        self.assertEqual(list(Team.objects.values_list('name', flat=True)), ["Nya IK"])
+
+    def test_unknown_format(self):
+        with self.assertRaises(CommandError):
+            self.run_import("teams", self.write("teams.xml", ""))
+
+
+# --------------------------------- #
+# -------------- JOBS ------------- #
+# --------------------------------- #
+
+
+class JobTests(TransactionTestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.register("tests.record", self.calls.append)
+        self.register("tests.urgent", self.calls.append, priority=10)
+        self.register("tests.fail", self.fail_job, max_attempts=3)
+
+    def register(self, name, func, **kwargs):
+        jobs.job(name, **kwargs)(func)
+        self.addCleanup(jobs.JOBS.pop, name)
+
+    def fail_job(self):
+        City.objects.create(name="Rullas tillbaka")
+        raise ValueError("Trasigt")
+
+    def run_jobs(self):
+        while jobs.run_next_job() is not None:
+            pass
+
+    def test_jobs_run_by_priority_and_are_deleted(self):
+        jobs.enqueue("tests.record", args=["först inlagd"])
+        jobs.enqueue("tests.urgent", args=["viktig"])
+        self.run_jobs()
+        self.assertEqual(self.calls, ["viktig", "först inlagd"])
+        self.assertFalse(Job.objects.exists())
+
+    def test_unknown_job(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue("tests.okand")
+
+    def test_waiting_job_with_the_same_key_is_not_added(self):
+        jobs.enqueue("tests.record", args=[1], key="nyckel")
+        jobs.enqueue("tests.record", args=[2], key="nyckel")
+        self.run_jobs()
+        self.assertEqual(self.calls, [1])
+
+    def test_jobs_in_the_future_wait(self):
+        jobs.enqueue("tests.record", args=[1], run_at=timezone.now() + datetime.timedelta(hours=1))
+        self.assertIsNone(jobs.run_next_job())
+
+    def test_failed_job_is_retried_later_and_then_given_up(self):
+        jobs.enqueue("tests.fail")
+        delays = []
+        for attempt in range(3):
+            Job.objects.update(run_at=timezone.now())
+            start = timezone.now()
+            with self.assertLogs("hittalaget.core.jobs", "ERROR"):
+                jobs.run_next_job()
+            job = Job.objects.get()
+            delays.append(round((job.run_at - start).total_seconds() / jobs.JOB_RETRY_DELAY))
+
+        self.assertEqual(delays[:2], [1, 2])
+        self.assertEqual((job.attempts, job.is_failed, job.last_error), (3, True, "Trasigt"))
+        self.assertFalse(City.objects.filter(name="Rullas tillbaka").exists())
+
+        Job.objects.update(run_at=timezone.now())
+        self.assertIsNone(jobs.run_next_job())
+
+    def test_periodic_job_waits_for_its_next_run(self):
+        self.register("tests.periodic", lambda: self.calls.append("periodisk"), every=60)
+        jobs.schedule_periodic_jobs()
+        jobs.schedule_periodic_jobs()
+        self.run_jobs()
+        self.assertEqual(self.calls, ["periodisk"])
+        job = Job.objects.get(name="tests.periodic")
+        self.assertGreater(job.run_at, timezone.now() + datetime.timedelta(seconds=50))
+
+    def test_locked_job_is_skipped_by_other_workers(self):
+        started, release = threading.Event(), threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+            self.calls.append("blockerad")
+
+        def worker():
+            try:
+                jobs.run_next_job()
+            finally:
+                connection.close()
+
+        self.register("tests.block", block, priority=20)
+        jobs.enqueue("tests.block")
+        jobs.enqueue("tests.record", args=["nästa"])
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        self.assertTrue(started.wait(5))
+        self.assertEqual(jobs.run_next_job().name, "tests.record")
+        self.assertIsNone(jobs.run_next_job())
+        release.set()
+        thread.join()
+
+        self.assertEqual(self.calls, ["nästa", "blockerad"])
+        self.assertFalse(Job.objects.exists())
+
+    def test_idle_worker_sleeps_while_another_runs_a_job(self):
+        started, release = threading.Event(), threading.Event()
+        self.register("tests.block", lambda: (started.set(), release.wait(5)))
+
+        def worker():
+            try:
+                jobs.run_next_job()
+            finally:
+                connection.close()
+
+        jobs.enqueue("tests.block")
+        jobs.enqueue("tests.record", args=["senare"], run_at=timezone.now() + datetime.timedelta(seconds=30))
+        thread = threading.Thread(target=worker)
+        thread.start()
+        try:
+            self.assertTrue(started.wait(5))
+            self.assertIsNone(jobs.run_next_job())
+            self.assertAlmostEqual(jobs.seconds_to_next_job(), 30, delta=5)
+
+            idle = jobs.Worker()
+            timeouts = []
+
+            def fake_select(rlist, wlist, xlist, timeout):
+                timeouts.append(timeout)
+                idle.stop()
+                return [], [], []
+
+            with mock.patch.object(jobs.signal, 'signal'), mock.patch.object(jobs.select, 'select', fake_select):
+                idle.run()
+            self.assertEqual(len(timeouts), 1)
+            self.assertGreater(timeouts[0], 5)
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(self.calls, [])
+
+
+# --------------------------------- #
+# -------------- POOL ------------- #
+# --------------------------------- #
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.closed = False
+        self.autocommit = False
+        self.notifies = []
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+        self.fail_rollback = False
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        if self.fail_rollback:
+            raise OperationalError("Borta")
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = True
+
+    def cursor(self):
+        if self.closed:
+            raise OperationalError("Stängd")
+        return mock.MagicMock()
+
+
+class PoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.pool = pool.Pool("default", {"MAX_SIZE": 2, "TIMEOUT": 0.05})
+
+    def connect(self):
+        return FakeConnection(), None
+
+    def get(self):
+        return self.pool.get(self.connect).connection
+
+    def test_returned_connection_is_used_again(self):
+        connection = self.get()
+        self.pool.put(connection)
+        self.assertIs(self.get(), connection)
+        self.assertEqual((self.pool.opened, self.pool.checkouts), (1, 2))
+
+    def test_checkout_times_out_when_every_connection_is_in_use(self):
+        self.get(), self.get()
+        with self.assertRaises(pool.PoolTimeout):
+            self.get()
+        self.assertEqual(self.pool.timeouts, 1)
+
+    def test_checkout_waits_for_a_connection(self):
+        self.pool.options["TIMEOUT"] = 5
+        first, second = self.get(), self.get()
+        timer = threading.Timer(0.05, self.pool.put, [first])
+        timer.start()
+        self.assertIs(self.get(), first)
+        timer.join()
+        self.assertEqual(self.pool.waits, 1)
+
+    def test_transaction_is_rolled_back(self):
+        connection = self.get()
+        connection.status = extensions.TRANSACTION_STATUS_INTRANS
+        self.pool.put(connection)
+        self.assertIs(self.get(), connection)
+        self.assertEqual(connection.status, extensions.TRANSACTION_STATUS_IDLE)
+
+    def test_discarded_connections_are_closed(self):
+        connection = self.get()
+        self.pool.put(connection, discard=True)
+        self.assertTrue(connection.closed)
+
+        broken = self.get()
+        self.assertIsNot(broken, connection)
+        broken.status = extensions.TRANSACTION_STATUS_INERROR
+        broken.fail_rollback = True
+        self.pool.put(broken)
+        self.assertTrue(broken.closed)
+        self.assertEqual(self.pool.size, 0)
+        self.assertEqual(self.pool.closed, 2)
+
+    def test_broken_idle_connection_is_replaced(self):
+        self.pool.options["CHECK_AFTER"] = 0
+        connection = self.get()
+        self.pool.put(connection)
+        connection.closed = True
+        self.assertIsNot(self.get(), connection)
+        self.assertEqual(self.pool.failed_checks, 1)
+
+    def test_stats_count_since_the_last_time(self):
+        with mock.patch.dict(pool._pools, {"test": self.pool}, clear=True):
+            self.pool.put(self.get())
+            self.get()
+            self.assertEqual(pool.take_pool_stats()["default"]["checkouts"], 2)
+            stats = pool.take_pool_stats()["default"]
+        self.assertEqual((stats["checkouts"], stats["in_use"], stats["idle"]), (0, 1, 0))
+
+
+class PoolMetricTests(TestCase):
+
+    def setUp(self):
+        ''' The requests of other tests flush their metrics in background
+        threads, which commit their rows outside of the test's transaction. '''
+        patcher = mock.patch.object(instrumentation, 'run_in_background')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        PoolMetric.objects.all().delete()
+
+    def flush(self, **values):
+        stats = dict(dict.fromkeys(pool.POOL_COUNTERS, 0), in_use=1, idle=1, max_size=10)
+        stats.update(values)
+        with mock.patch.object(instrumentation, 'take_pool_stats', return_value={"default": stats}):
+            instrumentation.flush_pools()
+
+    def get_metric(self, name, labels='db="default"'):
+        for line in instrumentation.format_pool_metrics().splitlines():
+            if line.startswith("{}{{{}}} ".format(name, labels)):
+                return float(line.rsplit(" ", 1)[1])
+
+    def test_processes_are_added_up(self):
+        self.flush(checkouts=5, in_use=3)
+        self.flush(checkouts=2, in_use=4)
+        PoolMetric.objects.create(db="default", process="annan:1", checkouts=10, in_use=2, max_size=10)
+        self.assertEqual(self.get_metric("hittalaget_db_pool_checkouts_total"), 17)
+        self.assertEqual(self.get_metric("hittalaget_db_pool_connections", 'db="default",state="in_use"'), 6)
+        self.assertEqual(self.get_metric("hittalaget_db_pool_max_connections"), 20)
+
+    def test_stopped_processes_keep_their_counters(self):
+        self.flush(checkouts=5)
+        PoolMetric.objects.create(
+            db="default", process="annan:1", checkouts=10, in_use=2,
+            updated=timezone.now() - datetime.timedelta(days=2),
+        )
+        self.assertEqual(self.get_metric("hittalaget_db_pool_connections", 'db="default",state="in_use"'), 1)
+        self.assertEqual(self.get_metric("hittalaget_db_pool_processes"), 1)
+
+        instrumentation.retire_pool_metrics()
+        instrumentation.retire_pool_metrics()
+        self.assertEqual(PoolMetric.objects.count(), 2)
+        self.assertEqual(self.get_metric("hittalaget_db_pool_checkouts_total"), 15)
+
+
+# --------------------------------- #
+# ------------- ROUTING ----------- #
+# --------------------------------- #
+
+
+def read_database_view(request):
+    if request.GET.get("write"):
+        City.objects.create(name="Malmö")
+    return HttpResponse(routers.get_read_database())
+
+
+@override_settings(DATABASE_REPLICAS=["replica"], REPLICA_PIN_SECONDS=10)
+class ReplicaRoutingTests(TransactionTestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(routers.replica_status, 'is_usable', return_value=True)
+        self.is_usable = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.middleware = routers.ReplicaMiddleware(read_database_view)
+        self.factory = RequestFactory()
+
+    def get_database(self, request):
+        return self.middleware(request).content.decode()
+
+    def test_get_reads_from_the_replica(self):
+        self.assertEqual(self.get_database(self.factory.get("/")), "replica")
+        self.assertNotIn(routers.PIN_COOKIE, self.middleware(self.factory.get("/")).cookies)
+        self.assertEqual(routers.get_read_database(), "default")
+
+    def test_post_reads_from_the_primary_and_pins(self):
+        response = self.middleware(self.factory.post("/"))
+        self.assertEqual(response.content, b"default")
+        self.assertEqual(response.cookies[routers.PIN_COOKIE]['max-age'], 10)
+
+        request = self.factory.get("/")
+        request.COOKIES[routers.PIN_COOKIE] = response.cookies[routers.PIN_COOKIE].value
+        self.assertEqual(self.get_database(request), "default")
+
+    def test_get_that_writes_pins(self):
+        response = self.middleware(self.factory.get("/", {"write": 1}))
+        self.assertEqual(response.content, b"default")
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+
+    def test_expired_or_invalid_pin_is_ignored(self):
+        for value in (str(int(time.time()) - 1), "trasig"):
+            request = self.factory.get("/")
+            request.COOKIES[routers.PIN_COOKIE] = value
+            self.assertEqual(self.get_database(request), "replica")
+
+    def test_replica_that_is_behind_is_not_used(self):
+        self.is_usable.return_value = False
+        self.assertEqual(self.get_database(self.factory.get("/")), "default")
+
+    def test_lag_of_the_primary_is_0(self):
+        self.assertEqual(routers.measure_lag("default"), 0)
+
+    def test_replica_without_wal_receiver_is_down(self):
+        replica = mock.MagicMock()
+        replica.cursor.return_value.__enter__.return_value.fetchone.return_value = (None,)
+        with mock.patch.object(routers, 'connections', {"replica": replica}):
+            with self.assertLogs("hittalaget.core.db.routers", "WARNING"):
+                self.assertIsNone(routers.measure_lag("replica"))
+
+
+# --------------------------------- #
+# ------------ LOAD TEST ---------- #
+# --------------------------------- #
+
+
+class LoadTestTests(TestCase):
+
+    def test_failing_client_does_not_hang_the_others(self):
+        calls = []
+
+        def factory():
+            calls.append(1)
+            if len(calls) == 2:
+                raise ConnectionRefusedError("Ingen server")
+            return lambda: (200, None)
+
+        with self.assertRaises(ConnectionRefusedError):
+            loadtest.run_target(factory, requests=8, concurrency=4, warmup=0)
+
+    def test_post_scenarios_are_undone(self):
+        kalle, anna = make_user("kalle"), make_user("anna")
+        player = make_player(kalle)
+        self.client.force_login(kalle)
+        self.client.post(reverse("conversation:create", kwargs={"username": "anna"}), {"content": "Hej!"})
+        entry = InboxEntry.objects.get(user=anna)
+
+        snapshot = loadtest.Snapshot(kalle)
+        for i in range(3):
+            self.client.post(reverse("conversation:create", kwargs={"username": "anna"}), {"content": "Igen"})
+            self.client.post(reverse("player:update_status", kwargs={"sport": "fotboll"}))
+        snapshot.restore()
+
+        self.assertEqual(PmMessage.objects.count(), 1)
+        restored = InboxEntry.objects.get(user=anna)
+        self.assertEqual((restored.unread_count, restored.snippet), (entry.unread_count, "Hej!"))
+        player.refresh_from_db()
+        self.assertTrue(player.is_available)
+
+
+# --------------------------------- #
+# ----------- PUBLIC IDS ---------- #
+# --------------------------------- #
+
+
+class PublicIdTests(TestCase):
+
+    def test_permutation(self):
+        permutation = public_ids.FeistelPermutation("nyckel", 1000)
+        values = [permutation.permute(x) for x in range(1000)]
+        self.assertEqual(sorted(values), list(range(1000)))
+        self.assertNotEqual(values, list(range(1000)))
+        self.assertEqual([permutation.inverse(y) for y in values], list(range(1000)))
+
+    def test_ids_are_six_digits_and_unique(self):
+        ids = public_ids.allocate_public_ids("team", 500)
+        self.assertEqual(len(set(ids)), 500)
+        self.assertTrue(all(100000 <= public_id <= 999999 for public_id in ids))
+        with self.assertNumQueries(1):
+            public_ids.allocate_public_ids("team", 100)
+
+    def test_new_rows_get_ids(self):
+        team = make_team(make_user("owner"))
+        ad = make_ad(team, Position.objects.create(sport="fotboll", name="back"))
+        self.assertEqual(len(str(team.team_id)), 6)
+        self.assertEqual(len(str(ad.ad_id)), 6)
+
+    def test_reserved_ids_are_skipped(self):
+        free = public_ids.PublicIdAllocator("team")
+        free.reserved = []
+        ids = [free.public_id(n) for n in range(10)]
+        ReservedPublicId.objects.bulk_create([
+            ReservedPublicId(kind="team", public_id=ids[2]),
+            ReservedPublicId(kind="team", public_id=ids[5]),
+        ])
+
+        allocator = public_ids.PublicIdAllocator("team")
+        allocated = [allocator.public_id(n) for n in range(8)]
+        self.assertEqual(allocated, [public_id for i, public_id in enumerate(ids) if i not in (2, 5)])
+        self.assertEqual(allocator.capacity(), public_ids.SIX_DIGITS[1] - 2)
+
+    def test_seven_digits_once_six_are_used_up(self):
+        allocator = public_ids.PublicIdAllocator("team")
+        allocator.reserved = []
+        self.assertEqual(len(str(allocator.public_id(public_ids.SIX_DIGITS[1]))), 7)
+        with self.assertRaises(public_ids.PublicIdsExhausted):
+            allocator.public_id(public_ids.SIX_DIGITS[1] + public_ids.SEVEN_DIGITS[1])
+
+    def test_benchmark_counts_the_queries(self):
+        rate, queries = bench_public_ids.Command().bench_allocator(1000, 20)
+        self.assertEqual(queries, 2)
+
+
+# --------------------------------- #
+# ------------- IMAGES ------------ #
+# --------------------------------- #
+
+
+def make_image(name, size=(1000, 500)):
+    buffer = BytesIO()
+    PILImage.new("RGB", size, "red").save(buffer, "PNG")
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+
+class ImageTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = override_settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.player = make_player(make_user("kalle"))
+
+    def upload(self, image):
+        self.player.image = image
+        self.player.save()
+        while jobs.run_next_job() is not None:
+            pass
+        self.player.refresh_from_db()
+
+    def test_renditions_are_made_after_the_upload(self):
+        self.upload(make_image("bild.png"))
+        self.assertEqual(self.player.image_renditions, [80, 160, 320, 640])
+        for width in self.player.image_renditions:
+            path = images.rendition_name(self.player.image.name, width)
+            with default_storage.open(path) as f:
+                self.assertEqual(PILImage.open(f).size[0], width)
+
+    def test_extension_is_part_of_the_name(self):
+        self.assertNotEqual(images.rendition_name("a.png", 160), images.rendition_name("a.jpg", 160))
+        self.assertEqual(images.rendition_name("a.png", 160), "renditions/a.png-160.webp")
+
+    def test_small_image_is_not_made_larger(self):
+        self.upload(make_image("liten.png", size=(100, 100)))
+        self.assertEqual(self.player.image_renditions, [80, 100])
+
+    def test_broken_and_huge_images_are_given_up(self):
+        self.upload(SimpleUploadedFile("trasig.png", b"ingen bild", content_type="image/png"))
+        self.assertEqual(self.player.image_renditions, [])
+
+        with mock.patch.object(PILImage, 'MAX_IMAGE_PIXELS', 1000):
+            with self.assertLogs("hittalaget.core.images", "ERROR"):
+                self.upload(make_image("enorm.png"))
+        self.assertEqual(self.player.image_renditions, [])
+        self.assertFalse(Job.objects.exists())
@@ -0,0 +1,17 @@
+from django.core.mail.backends.base import BaseEmailBackend
+
+from .models import QueuedEmail
+
+
+class QueuedEmailBackend(BaseEmailBackend):
+    ''' Puts the emails in the queue instead of sending them, so a request
+    never waits for the mail server. The send_queued_email command sends
+    them with the backend in settings.QUEUED_EMAIL_BACKEND.
+
+    The rows are inserted in the transaction of the request, so an email
+    about something that was rolled back is never sent. '''
+
+    def send_messages(self, email_messages):
+        emails = [QueuedEmail.from_message(message) for message in email_messages if message.recipients()]
+        QueuedEmail.objects.bulk_create(emails)
+        return len(emails)
@@ -0,0 +1,22 @@
+from hittalaget.core.jobs import job
+
+from .sending import get_mail_connection, queue_digests, send_queued
+
+''' The workers send the queued email, so no separate send_queued_email
+process is needed, although one can still be run. A run sends at most
+EMAIL_JOB_BATCHES batches, since they are only marked as sent when the
+job's transaction commits. '''
+EMAIL_JOB_INTERVAL = 10
+EMAIL_JOB_BATCHES = 10
+
+
+@job("emails.send_queued", priority=10, every=EMAIL_JOB_INTERVAL)
+def send_queued_email():
+    queue_digests()
+    mail_connection = get_mail_connection()
+    try:
+        for i in range(EMAIL_JOB_BATCHES):
+            if send_queued(mail_connection) == (0, 0):
+                break
+    finally:
+        mail_connection.close()
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from hittalaget.emails.sending import BATCH_SIZE, get_mail_connection, queue_digests, send_queued
+
+
+class Command(BaseCommand):
+    help = ("Send the queued emails, and the digests of new messages that are "
+            "due, in batches over one connection to the mail server. Runs until "
+            "stopped, or until the queue is empty with --once.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true",
+                            help="Exit once there is nothing left to send.")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+        parser.add_argument("--interval", type=float, default=5,
+                            help="Seconds to wait when there is nothing to send.")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        mail_connection = get_mail_connection()
+        try:
+            while True:
+                digests = queue_digests(batch_size)
+                sent, failed = send_queued(mail_connection, batch_size)
+                if sent or failed or digests:
+                    self.stdout.write("Queued {} digests, sent {} emails, {} failed.".format(digests, sent, failed))
+                    continue
+
+                ''' Nothing is due, so the connection is not kept open
+                while waiting. '''
+                mail_connection.close()
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
+        finally:
+            mail_connection.close()
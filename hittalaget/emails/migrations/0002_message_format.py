@@ -0,0 +1,23 @@
+# Generated by Django 3.0 on 2026-10-17 20:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queuedemail',
+            name='content_subtype',
+            field=models.CharField(default='plain', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='queuedemail',
+            name='encoding',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,137 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField, JSONField
+from django.core.mail import EmailMultiAlternatives
+from django.db import models
+from django.utils import timezone
+from hittalaget.conversations.models import MESSAGE_STATEMENTS
+
+
+# ---------------------------------- #
+# -------------- QUEUE ------------- #
+# ---------------------------------- #
+
+
+class QueuedEmail(models.Model):
+    ''' An email waiting to be sent by the send_queued_email command. Rows
+    are deleted once sent. One that keeps failing is kept, with
+    is_failed set, so it can be looked into. '''
+    subject = models.TextField()
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    to = ArrayField(models.CharField(max_length=255), default=list)
+    cc = ArrayField(models.CharField(max_length=255), default=list)
+    bcc = ArrayField(models.CharField(max_length=255), default=list)
+    reply_to = ArrayField(models.CharField(max_length=255), default=list)
+    headers = JSONField(default=dict)
+    alternatives = JSONField(default=list)
+    content_subtype = models.CharField(max_length=255, default="plain")
+    encoding = models.CharField(max_length=255, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    send_after = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    is_failed = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['send_after', 'id'], condition=models.Q(is_failed=False), name="queued_email_due"),
+        ]
+
+    def __str__(self):
+        return "{} ({})".format(self.subject, ", ".join(self.to))
+
+    @classmethod
+    def from_message(cls, message):
+        if message.attachments:
+            raise ValueError("Emails with attachments can not be queued.")
+        return cls(
+            subject=message.subject,
+            body=message.body,
+            from_email=message.from_email,
+            to=list(message.to),
+            cc=list(message.cc),
+            bcc=list(message.bcc),
+            reply_to=list(message.reply_to),
+            headers=dict(message.extra_headers),
+            alternatives=[list(alternative) for alternative in getattr(message, 'alternatives', [])],
+            content_subtype=message.content_subtype,
+            encoding=str(message.encoding or ""),
+        )
+
+    def to_message(self, connection=None):
+        ''' The message again. An empty encoding is DEFAULT_CHARSET. '''
+        message = EmailMultiAlternatives(
+            subject=self.subject,
+            body=self.body,
+            from_email=self.from_email,
+            to=self.to,
+            cc=self.cc,
+            bcc=self.bcc,
+            reply_to=self.reply_to,
+            headers=self.headers,
+            alternatives=[tuple(alternative) for alternative in self.alternatives],
+            connection=connection,
+        )
+        message.content_subtype = self.content_subtype
+        message.encoding = self.encoding or None
+        return message
+
+    def retry_later(self, error):
+        ''' Wait twice as long after each failed attempt. '''
+        self.attempts += 1
+        self.last_error = str(error)
+        if self.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+            self.is_failed = True
+        else:
+            delay = settings.EMAIL_RETRY_DELAY * 2 ** (self.attempts - 1)
+            self.send_after = timezone.now() + timedelta(seconds=delay)
+        self.save(update_fields=['attempts', 'last_error', 'is_failed', 'send_after'])
+
+
+# ---------------------------------- #
+# ------------- DIGESTS ------------ #
+# ---------------------------------- #
+
+
+class DigestRequest(models.Model):
+    ''' A user that has been sent new messages, and will be told about
+    all of them in one email at send_after. Messages that arrive before
+    then are in the same email, since there is at most one row per user. '''
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+")
+    send_after = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['send_after']),
+        ]
+
+
+def get_digest_insert(message):
+    ''' The insert that asks for a digest for every user of the
+    conversation but the author, as (sql, params). Users that already
+    wait for one keep it. It runs with the inbox upsert of the message
+    (see record_message). '''
+    conversation = message.conversation
+    through = conversation.users.through
+
+    sql = """
+        INSERT INTO {digests} (user_id, send_after)
+        SELECT u.user_id, %(digest_send_after)s
+        FROM {through} AS u
+        WHERE u.{through_column} = %(digest_conversation)s AND u.user_id <> %(digest_author)s
+        ON CONFLICT (user_id) DO NOTHING
+    """.format(
+        digests=DigestRequest._meta.db_table,
+        through=through._meta.db_table,
+        through_column=through._meta.get_field(conversation._meta.model_name).column,
+    )
+    params = {
+        "digest_send_after": message.created + timedelta(seconds=settings.EMAIL_DIGEST_DELAY),
+        "digest_conversation": conversation.pk,
+        "digest_author": message.author_id,
+    }
+    return sql, params
+
+MESSAGE_STATEMENTS.append(get_digest_insert)
@@ -0,0 +1,132 @@
+''' The work of the send_queued_email command.
+
+Several workers can run at once. Each one claims a batch of rows with
+SELECT ... FOR UPDATE SKIP LOCKED, so no row is handled twice, and keeps
+the rows locked until the batch is done. Emails are sent over one
+connection to the mail server, which is kept open from batch to batch
+while there is more to send. '''
+
+import logging
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+from hittalaget.conversations.models import InboxEntry
+
+from .models import DigestRequest, QueuedEmail
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+
+
+def get_mail_connection():
+    return get_connection(settings.QUEUED_EMAIL_BACKEND, fail_silently=False)
+
+
+def send_queued(mail_connection, batch_size=BATCH_SIZE):
+    ''' Send one batch of the emails that are due, and return how many
+    were sent and how many failed. '''
+    sent = failed = 0
+    with transaction.atomic():
+        emails = list(
+            QueuedEmail.objects.select_for_update(skip_locked=True)
+            .filter(is_failed=False, send_after__lte=timezone.now())
+            .order_by('send_after', 'id')[:batch_size]
+        )
+        if not emails:
+            return sent, failed
+
+        done = []
+        for email in emails:
+            try:
+                ''' Opens the connection unless it is open already. Left
+                to send_messages() it would be closed after each email. '''
+                mail_connection.open()
+                mail_connection.send_messages([email.to_message()])
+            except Exception as e:
+                logger.warning("Could not send email %s: %s", email.pk, e)
+                email.retry_later(e)
+                failed += 1
+                ''' The connection may be broken after an error, so the
+                next email opens a new one. '''
+                mail_connection.close()
+            else:
+                done.append(email.pk)
+                sent += 1
+        QueuedEmail.objects.filter(pk__in=done).delete()
+    return sent, failed
+
+
+# ---------------------------------- #
+# ------------- DIGESTS ------------ #
+# ---------------------------------- #
+
+
+def get_conversation_link(entry):
+    if entry.tag == "ad":
+        conversation = entry.ad_conversation
+        return conversation.ad.title, conversation.get_absolute_url()
+
+    usernames = [name for name in entry.pm_conversation.users_arr if name != entry.user.username]
+    username = usernames[0] if usernames else entry.user.username
+    return username, reverse("conversation:detail", kwargs={"username": username})
+
+
+def make_digest(user, entries):
+    conversations = []
+    for entry in entries:
+        label, path = get_conversation_link(entry)
+        conversations.append({
+            "label": label,
+            "url": settings.SITE_URL + path,
+            "unread_count": entry.unread_count,
+            "snippet": entry.snippet,
+        })
+    context = {
+        "user": user,
+        "conversations": conversations,
+        "unread_count": sum(entry.unread_count for entry in entries),
+        "inbox_url": settings.SITE_URL + reverse("conversation:list", kwargs={"label": "pm"}),
+    }
+    return EmailMessage(
+        subject=render_to_string("emails/digest_subject.txt", context).strip(),
+        body=render_to_string("emails/digest.txt", context),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[user.email],
+    )
+
+
+def queue_digests(batch_size=BATCH_SIZE):
+    ''' Turn a batch of the digests that are due into queued emails, and
+    return how many were queued. A user that has read everything in the
+    meantime gets none. '''
+    with transaction.atomic():
+        requests = list(
+            DigestRequest.objects.select_for_update(skip_locked=True)
+            .filter(send_after__lte=timezone.now())
+            .order_by('send_after')[:batch_size]
+        )
+        if not requests:
+            return 0
+
+        entries = {}
+        unread = (
+            InboxEntry.objects.filter(user__in=[r.user_id for r in requests], unread_count__gt=0)
+            .select_related('user', 'pm_conversation', 'ad_conversation__ad')
+            .order_by('-last_message_at', '-id')
+        )
+        for entry in unread:
+            entries.setdefault(entry.user_id, []).append(entry)
+
+        emails = [
+            QueuedEmail.from_message(make_digest(user_entries[0].user, user_entries))
+            for user_entries in entries.values()
+            if user_entries[0].user.email and user_entries[0].user.is_active
+        ]
+        QueuedEmail.objects.bulk_create(emails)
+        DigestRequest.objects.filter(pk__in=[r.pk for r in requests]).delete()
+    return len(emails)
@@ -0,0 +1,114 @@
+import smtplib
+from datetime import timedelta
+
+from django.core import mail
+from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.core.mail.backends.base import BaseEmailBackend
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from hittalaget.core.testing import make_user
+from .models import DigestRequest, QueuedEmail
+from .sending import get_mail_connection, queue_digests, send_queued
+
+
+class FailingBackend(BaseEmailBackend):
+
+    def send_messages(self, email_messages):
+        raise smtplib.SMTPServerDisconnected("Borta")
+
+
+QUEUED = "hittalaget.emails.backends.QueuedEmailBackend"
+LOCMEM = "django.core.mail.backends.locmem.EmailBackend"
+
+
+@override_settings(EMAIL_BACKEND=QUEUED, QUEUED_EMAIL_BACKEND=LOCMEM, EMAIL_MAX_ATTEMPTS=3, EMAIL_RETRY_DELAY=60)
+class QueueTests(TestCase):
+
+    def send(self):
+        return send_queued(get_mail_connection())
+
+    def test_emails_are_queued_and_sent(self):
+        mail.send_mail("Hej", "Text", "noreply@hittalaget.se", ["anna@example.com"])
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(QueuedEmail.objects.count(), 1)
+
+        self.assertEqual(self.send(), (1, 0))
+        self.assertEqual([message.subject for message in mail.outbox], ["Hej"])
+        self.assertFalse(QueuedEmail.objects.exists())
+
+    def test_message_is_sent_as_it_was_queued(self):
+        message = EmailMultiAlternatives(
+            "Hej", "<p>Hej</p>", "noreply@hittalaget.se", ["anna@example.com"],
+            cc=["bo@example.com"], reply_to=["svar@example.com"], headers={"X-Typ": "test"},
+        )
+        message.content_subtype = "html"
+        message.encoding = "iso-8859-1"
+        message.attach_alternative("Hej", "text/plain")
+        message.send()
+        self.send()
+
+        sent = mail.outbox[0]
+        self.assertEqual((sent.content_subtype, sent.encoding), ("html", "iso-8859-1"))
+        self.assertEqual((sent.cc, sent.reply_to, sent.extra_headers), (["bo@example.com"], ["svar@example.com"], {"X-Typ": "test"}))
+        self.assertEqual(sent.alternatives, [("Hej", "text/plain")])
+        self.assertIn("text/html", sent.message().as_string())
+
+    def test_default_format(self):
+        EmailMessage("Hej", "Text", to=["anna@example.com"]).send()
+        self.send()
+        self.assertEqual((mail.outbox[0].content_subtype, mail.outbox[0].encoding), ("plain", None))
+
+    def test_emails_with_attachments_are_not_queued(self):
+        message = EmailMessage("Hej", "Text", to=["anna@example.com"])
+        message.attach("fil.txt", "innehåll", "text/plain")
+        with self.assertRaises(ValueError):
+            message.send()
+
+    def test_emails_that_are_not_due_wait(self):
+        mail.send_mail("Hej", "Text", "noreply@hittalaget.se", ["anna@example.com"])
+        QueuedEmail.objects.update(send_after=timezone.now() + timedelta(minutes=1))
+        self.assertEqual(self.send(), (0, 0))
+
+    @override_settings(QUEUED_EMAIL_BACKEND="hittalaget.emails.tests.FailingBackend")
+    def test_failed_email_is_retried_later_and_then_given_up(self):
+        mail.send_mail("Hej", "Text", "noreply@hittalaget.se", ["anna@example.com"])
+        delays = []
+        for attempt in range(3):
+            QueuedEmail.objects.update(send_after=timezone.now())
+            start = timezone.now()
+            with self.assertLogs("hittalaget.emails.sending", "WARNING"):
+                self.assertEqual(self.send(), (0, 1))
+            email = QueuedEmail.objects.get()
+            delays.append(round((email.send_after - start).total_seconds() / 60))
+
+        self.assertEqual(delays[:2], [1, 2])
+        self.assertEqual((email.attempts, email.is_failed, email.last_error), (3, True, "Borta"))
+        QueuedEmail.objects.update(send_after=timezone.now())
+        self.assertEqual(self.send(), (0, 0))
+
+
+@override_settings(EMAIL_BACKEND=QUEUED, QUEUED_EMAIL_BACKEND=LOCMEM, EMAIL_DIGEST_DELAY=0)
+class DigestTests(TestCase):
+
+    def setUp(self):
+        self.anna = make_user("anna")
+        self.bo = make_user("bo")
+        self.client.force_login(self.anna)
+        for content in ("Ett", "Två"):
+            self.client.post(reverse("conversation:create", kwargs={"username": "bo"}), {"content": content})
+
+    def test_one_digest_for_many_messages(self):
+        self.assertEqual(list(DigestRequest.objects.values_list('user', flat=True)), [self.bo.pk])
+        self.assertEqual(queue_digests(), 1)
+        email = QueuedEmail.objects.get()
+        self.assertEqual(email.to, [self.bo.email])
+        self.assertIn("Två", email.body)
+        self.assertFalse(DigestRequest.objects.exists())
+
+    def test_no_digest_when_everything_is_read(self):
+        self.client.force_login(self.bo)
+        self.client.get(reverse("conversation:detail", kwargs={"username": "anna"}))
+        self.assertEqual(queue_digests(), 0)
+        self.assertFalse(DigestRequest.objects.exists())
@@ -2,27 +2,18 @@ from django import forms
 from django.core.exceptions import ValidationError
 from django.http import Http404
 from .models import Player, Position, History
-from .form_choices import (
-    football_experiences,
-    football_sides,
-    football_special_abilities,
+from hittalaget.users.models import City
+from hittalaget.core.reference import (
+    SIDE_LABELS,
+    SportForm,
+    get_choices,
+    get_cities,
+    get_positions,
+    set_reference_choices,
 )
 import datetime
 
 
-class SportForm(forms.Form):
-
-    SPORTS = [
-        ("fotboll", "Fotboll"),
-    ]
-
-    sport = forms.CharField(
-        max_length=255,
-        label="Välj en sport",
-        widget=forms.Select(choices=SPORTS)
-    )
-
-
 class PlayerForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
@@ -30,24 +21,14 @@ class PlayerForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
 
         self.fields['positions'].widget = forms.CheckboxSelectMultiple()
-        self.fields['positions'].queryset = Position.objects.filter(sport=self.sport)
-        
-        sides = {
-            "fotboll": [football_sides, "Bästa fot"],
-        }
-        experiences = {
-            "fotboll": football_experiences,
-        }
-        special_abilities = {
-            "fotboll": football_special_abilities,
-        }
+        set_reference_choices(self, 'positions', get_positions(self.sport))
         
         ''' Potential KeyError from invalid sports should be caught
         by the view before even reaching the forms. '''
-        self.fields['side'].widget = forms.Select(choices=sides[self.sport][0])
-        self.fields['side'].label = sides[self.sport][1]
-        self.fields['experience'].widget = forms.Select(choices=experiences[self.sport])
-        self.fields['special_ability'].widget = forms.Select(choices=special_abilities[self.sport])
+        self.fields['side'].widget = forms.Select(choices=get_choices(self.sport, "side"))
+        self.fields['side'].label = SIDE_LABELS[self.sport]
+        self.fields['experience'].widget = forms.Select(choices=get_choices(self.sport, "experience"))
+        self.fields['special_ability'].widget = forms.Select(choices=get_choices(self.sport, "special_ability"))
 
 
     class Meta:
@@ -105,6 +86,44 @@ class PlayerForm(forms.ModelForm):
         return data
 
 
+class PlayerSearchForm(forms.Form):
+    ''' Filters of the player market. Every field is optional, and an
+    empty form matches every available player. '''
+
+    position = forms.ModelChoiceField(
+        queryset=Position.objects.none(),
+        required=False,
+        label="Position",
+        empty_label="Alla",
+    )
+    side = forms.ChoiceField(required=False)
+    experience = forms.ChoiceField(required=False, label="Erfarenhet")
+    special_ability = forms.ChoiceField(required=False, label="Spetsegenskap")
+    city = forms.ModelChoiceField(
+        queryset=City.objects.all(),
+        required=False,
+        label="Stad",
+        empty_label="Alla",
+    )
+    min_age = forms.IntegerField(required=False, min_value=0, max_value=100, label="Ålder från")
+    max_age = forms.IntegerField(required=False, min_value=0, max_value=100, label="Ålder till")
+    min_height = forms.IntegerField(required=False, min_value=0, max_value=250, label="Längd från")
+    max_height = forms.IntegerField(required=False, min_value=0, max_value=250, label="Längd till")
+
+    def __init__(self, *args, **kwargs):
+        self.sport = kwargs.pop('sport')
+        super().__init__(*args, **kwargs)
+
+        empty = [("", "Alla")]
+
+        set_reference_choices(self, 'position', get_positions(self.sport))
+        set_reference_choices(self, 'city', get_cities())
+        self.fields['side'].choices = empty + get_choices(self.sport, "side")
+        self.fields['side'].label = SIDE_LABELS[self.sport]
+        self.fields['experience'].choices = empty + get_choices(self.sport, "experience")
+        self.fields['special_ability'].choices = empty + get_choices(self.sport, "special_ability")
+
+
 class HistoryForm(forms.ModelForm):
 
     class Meta:
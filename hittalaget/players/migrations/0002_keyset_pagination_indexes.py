@@ -0,0 +1,17 @@
+# Generated by Django 3.0 on 2026-10-17 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('players', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(fields=['sport', 'is_available', '-id'], name='players_pla_sport_7e8bfb_idx'),
+        ),
+    ]
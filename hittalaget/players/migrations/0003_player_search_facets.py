@@ -0,0 +1,63 @@
+# Generated by Django 3.0 on 2026-10-17 18:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_auto_20200211_1530'),
+        ('players', '0002_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='birthday',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='city',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='players', to='users.City'),
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='height',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.RunSQL(
+            sql="""
+                UPDATE players_player AS p
+                SET city_id = u.city_id, birthday = u.birthday, height = u.height
+                FROM users_user AS u
+                WHERE u.id = p.user_id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(fields=['sport', 'is_available', 'city'], name='players_pla_sport_164ae3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(fields=['sport', 'is_available', 'side'], name='players_pla_sport_1a6166_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(fields=['sport', 'is_available', 'experience'], name='players_pla_sport_63d75b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(fields=['sport', 'is_available', 'special_ability'], name='players_pla_sport_3dc1fa_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(fields=['sport', 'is_available', 'birthday'], name='players_pla_sport_44d450_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(fields=['sport', 'is_available', 'height'], name='players_pla_sport_bd2677_idx'),
+        ),
+    ]
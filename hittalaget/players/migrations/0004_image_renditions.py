@@ -0,0 +1,19 @@
+# Generated by Django 3.0 on 2026-10-17 19:26
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('players', '0003_player_search_facets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='image_renditions',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.PositiveIntegerField(), blank=True, default=list, editable=False, size=None),
+        ),
+    ]
@@ -1,7 +1,12 @@
 from django.conf import settings
-from django.db.models.signals import pre_save 
+from django.contrib.postgres.fields import ArrayField
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
 from django.db import models
 from django.urls import reverse
+from hittalaget.core import reference
+from hittalaget.core.images import connect_image_renditions
+from hittalaget.core.object_cache import bump
+from hittalaget.users.models import City
 
 
 def get_upload_path(instance, filename):
@@ -33,12 +38,19 @@ class Player(models.Model):
     experience = models.CharField(max_length=255)
     special_ability = models.CharField(max_length=255)
     is_available = models.BooleanField(default=False)
+    ''' Copied from the user so that the player market can be filtered
+    and faceted without joining the user table. '''
+    city = models.ForeignKey(City, on_delete=models.SET_NULL, null=True, related_name="players")
+    birthday = models.DateTimeField(null=True)
+    height = models.PositiveIntegerField(null=True)
     image = models.ImageField(
         upload_to=get_upload_path,
         blank=True,
         null=True,
         default='images/players/default.png'
     )
+    ''' The widths of the WebP renditions of the image that are done. '''
+    image_renditions = ArrayField(models.PositiveIntegerField(), default=list, blank=True, editable=False)
     
 
     class Meta:
@@ -46,6 +58,17 @@ class Player(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['user', 'sport'], name="unique player")
         ]
+        ''' Backs the keyset pagination and the faceted search of the
+        player market. '''
+        indexes = [
+            models.Index(fields=['sport', 'is_available', '-id']),
+            models.Index(fields=['sport', 'is_available', 'city']),
+            models.Index(fields=['sport', 'is_available', 'side']),
+            models.Index(fields=['sport', 'is_available', 'experience']),
+            models.Index(fields=['sport', 'is_available', 'special_ability']),
+            models.Index(fields=['sport', 'is_available', 'birthday']),
+            models.Index(fields=['sport', 'is_available', 'height']),
+        ]
 
 
     def __str__(self):
@@ -54,6 +77,11 @@ class Player(models.Model):
     def get_absolute_url(self):
         return reverse('player:detail', kwargs={"sport": self.sport, "username": self.username})
 
+    @staticmethod
+    def make_cache_name(sport, username):
+        ''' The name the player is cached under in the object cache. '''
+        return "player:{}:{}".format(sport, username)
+
 
 class History(models.Model):
     start_year = models.PositiveIntegerField()
@@ -66,8 +94,56 @@ def pre_save_username(sender, instance, **kwargs):
     user = instance.user
     instance.username = user.username
 
-pre_save.connect(pre_save_username, sender=Player)
+def pre_save_user_profile(sender, instance, **kwargs):
+    user = instance.user
+    instance.city_id = user.city_id
+    instance.birthday = user.birthday
+    instance.height = user.height
+
+USER_PROFILE_FIELDS = {'city', 'city_id', 'birthday', 'height'}
+
+def post_save_user_profile(sender, instance, update_fields=None, **kwargs):
+    ''' Keep the copied user fields of the player profiles up to date.
+    Saves of other fields, like last_login on every login, leave them. '''
+    if update_fields is not None and not set(update_fields) & USER_PROFILE_FIELDS:
+        return
+    Player.objects.filter(user=instance).update(
+        city_id=instance.city_id,
+        birthday=instance.birthday,
+        height=instance.height,
+    )
 
-    
+def player_changed_bump_cache(sender, instance, **kwargs):
+    bump(Player.make_cache_name(instance.sport, instance.username))
+
+def player_positions_changed_bump_cache(sender, instance, action, reverse, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if reverse:
+        ''' Players were added to or removed from the position. '''
+        bump("positions")
+    else:
+        bump(Player.make_cache_name(instance.sport, instance.username))
+
+def history_changed_bump_cache(sender, instance, **kwargs):
+    bump("history:{}".format(instance.player_id))
 
+def position_changed_bump_cache(sender, instance, **kwargs):
+    bump("positions")
 
+def position_changed_invalidate_reference(sender, instance, **kwargs):
+    reference.invalidate()
+
+pre_save.connect(pre_save_username, sender=Player)
+pre_save.connect(pre_save_user_profile, sender=Player)
+post_save.connect(post_save_user_profile, sender=settings.AUTH_USER_MODEL)
+post_save.connect(player_changed_bump_cache, sender=Player)
+post_delete.connect(player_changed_bump_cache, sender=Player)
+m2m_changed.connect(player_positions_changed_bump_cache, sender=Player.positions.through)
+post_save.connect(history_changed_bump_cache, sender=History)
+post_delete.connect(history_changed_bump_cache, sender=History)
+post_save.connect(position_changed_bump_cache, sender=Position)
+post_delete.connect(position_changed_bump_cache, sender=Position)
+post_save.connect(position_changed_invalidate_reference, sender=Position)
+post_delete.connect(position_changed_invalidate_reference, sender=Position)
+connect_image_renditions(Player)
@@ -0,0 +1,240 @@
+''' Faceted search over the player market.
+
+The results are read from the database. Every filter maps onto a
+column of Player (the user's city, birthday and height are copied onto
+the profile), and each of them leads a composite index together with
+(sport, is_available).
+
+The facet counts are not. Counting a million profiles five times over
+with GROUP BY takes Postgres hundreds of milliseconds, so each process
+keeps a columnar snapshot of the available players in NumPy arrays and
+counts with vectorized masks instead, about 20 MB per million players.
+
+The snapshot is built in the background, and no request ever waits for
+it: until the first one is done the search has no counts, and after
+that the last one is used while it is rebuilt. It is rebuilt once it is
+FACET_INDEX_MAX_AGE seconds old, so the counts are approximate and can
+lag behind the results by that much. '''
+
+import datetime
+import threading
+import time
+
+import numpy as np
+from django.db import connection
+from django.utils import timezone
+
+from hittalaget.core.background import run_in_background
+from hittalaget.core.reference import get_positions, get_reference_data, get_values
+from .models import Player
+
+
+FACETS = ["position", "side", "experience", "special_ability", "city"]
+CHOICE_FACETS = ["side", "experience", "special_ability"]
+FACET_INDEX_MAX_AGE = 60
+
+
+def _start_of_year(year):
+    return timezone.make_aware(datetime.datetime(year, 1, 1))
+
+
+def filter_players(queryset, data):
+    ''' Apply the cleaned data of a PlayerSearchForm to queryset. '''
+    if data.get('position'):
+        queryset = queryset.filter(positions=data['position'])
+
+    for field in ['side', 'experience', 'special_ability', 'city']:
+        if data.get(field):
+            queryset = queryset.filter(**{field: data[field]})
+
+    ''' Ages are counted in whole years like User.get_age() does, which
+    turns them into ranges of birthdays that can use the index. '''
+    current_year = timezone.now().year
+    if data.get('max_age') is not None:
+        queryset = queryset.filter(birthday__gte=_start_of_year(current_year - data['max_age']))
+    if data.get('min_age') is not None:
+        queryset = queryset.filter(birthday__lt=_start_of_year(current_year - data['min_age'] + 1))
+
+    if data.get('min_height') is not None:
+        queryset = queryset.filter(height__gte=data['min_height'])
+    if data.get('max_height') is not None:
+        queryset = queryset.filter(height__lte=data['max_height'])
+
+    return queryset
+
+
+class FacetIndex:
+    ''' Columnar snapshot of the available players of one sport. '''
+
+    def __init__(self, sport):
+        self.sport = sport
+        ''' The choice fields are stored as their (1-based) position in
+        these lists, 0 meaning a value that is not a valid choice. '''
+        self.choices = {name: get_values(sport, name) for name in CHOICE_FACETS}
+        self.columns = None
+        self.position_ids = []
+        self.built_at = None
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+    def build(self):
+        position_ids = [position.pk for position in get_positions(self.sport)][:63]
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT p.id,
+                    coalesce(p.city_id, 0),
+                    coalesce(array_position(%(sides)s::text[], p.side), 0),
+                    coalesce(array_position(%(experiences)s::text[], p.experience), 0),
+                    coalesce(array_position(%(abilities)s::text[], p.special_ability), 0),
+                    coalesce(extract(year FROM p.birthday)::int, 0),
+                    coalesce(p.height, 0),
+                    coalesce((
+                        SELECT bit_or(1::bigint << (array_position(%(positions)s::int[], pp.position_id) - 1))
+                        FROM {through} AS pp
+                        WHERE pp.player_id = p.id
+                    ), 0)
+                FROM {players} AS p
+                WHERE p.sport = %(sport)s AND p.is_available
+            """.format(
+                players=Player._meta.db_table,
+                through=Player.positions.through._meta.db_table,
+            ), {
+                "sport": self.sport,
+                "sides": self.choices["side"],
+                "experiences": self.choices["experience"],
+                "abilities": self.choices["special_ability"],
+                "positions": position_ids,
+            })
+            rows = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 8)
+
+        columns = {
+            "city": rows[:, 1].astype(np.int32),
+            "side": rows[:, 2].astype(np.int8),
+            "experience": rows[:, 3].astype(np.int8),
+            "special_ability": rows[:, 4].astype(np.int8),
+            "birth_year": rows[:, 5].astype(np.int16),
+            "height": rows[:, 6].astype(np.int16),
+            "positions": rows[:, 7].astype(np.uint64),
+        }
+
+        with self.lock:
+            self.columns = columns
+            self.position_ids = position_ids
+            self.built_at = time.monotonic()
+
+    def _refresh(self):
+        try:
+            self.build()
+        finally:
+            self.refreshing = False
+
+    def ensure_fresh(self):
+        ''' Build the snapshot in the background on first use, and again
+        once it is stale. '''
+        with self.lock:
+            if self.refreshing:
+                return
+            if self.built_at is not None and time.monotonic() - self.built_at <= FACET_INDEX_MAX_AGE:
+                return
+            self.refreshing = True
+
+        run_in_background(self._refresh)
+
+    def _masks(self, columns, position_ids, data):
+        ''' Return one boolean mask per facet filter, and one for the
+        range filters that are not facets. '''
+        size = len(columns["city"])
+        masks = {}
+
+        if data.get('position'):
+            try:
+                bit = np.uint64(1 << position_ids.index(data['position'].pk))
+            except ValueError:
+                masks['position'] = np.zeros(size, dtype=bool)
+            else:
+                masks['position'] = (columns["positions"] & bit) != 0
+
+        for field in ['side', 'experience', 'special_ability']:
+            if data.get(field):
+                values = self.choices[field]
+                code = values.index(data[field]) + 1 if data[field] in values else -1
+                masks[field] = columns[field] == code
+
+        if data.get('city'):
+            masks['city'] = columns["city"] == data['city'].pk
+
+        ranges = np.ones(size, dtype=bool)
+        current_year = timezone.now().year
+        if data.get('max_age') is not None:
+            ranges &= columns["birth_year"] >= current_year - data['max_age']
+        if data.get('min_age') is not None:
+            ranges &= (columns["birth_year"] <= current_year - data['min_age']) & (columns["birth_year"] > 0)
+        if data.get('min_height') is not None:
+            ranges &= columns["height"] >= data['min_height']
+        if data.get('max_height') is not None:
+            ranges &= (columns["height"] <= data['max_height']) & (columns["height"] > 0)
+
+        return masks, ranges
+
+    def counts(self, data):
+        ''' Return {facet: {value: count}}, or None if the snapshot has
+        not been built yet. The counts of a facet are taken with every
+        filter applied except the facet's own, so they tell how many
+        players each choice would give. '''
+        self.ensure_fresh()
+        with self.lock:
+            columns, position_ids = self.columns, self.position_ids
+        if columns is None:
+            return None
+
+        masks, ranges = self._masks(columns, position_ids, data)
+        facets = {}
+
+        for facet in FACETS:
+            mask = ranges.copy()
+            for other, other_mask in masks.items():
+                if other != facet:
+                    mask &= other_mask
+
+            if facet == 'position':
+                selected = columns["positions"][mask]
+                facets[facet] = {}
+                for i, position_id in enumerate(position_ids):
+                    count = int(np.count_nonzero(selected & np.uint64(1 << i)))
+                    if count:
+                        facets[facet][position_id] = count
+                continue
+
+            column = columns[facet][mask]
+            bins = np.bincount(column[column > 0])
+            counts = {code: int(count) for code, count in enumerate(bins) if count}
+            if facet != 'city':
+                values = self.choices[facet]
+                counts = {values[code - 1]: count for code, count in counts.items()}
+            facets[facet] = counts
+
+        return facets
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_facet_index(sport):
+    with _indexes_lock:
+        if sport not in _indexes:
+            _indexes[sport] = FacetIndex(sport)
+        return _indexes[sport]
+
+
+def facet_counts(sport, data):
+    return get_facet_index(sport).counts(data)
+
+
+def facet_labels(facets):
+    ''' Map the ids of the foreign key facets to their names. '''
+    data = get_reference_data()
+    return {
+        'position': {pk: data.positions_by_pk[pk].name for pk in facets['position'] if pk in data.positions_by_pk},
+        'city': {pk: data.cities_by_pk[pk].name for pk in facets['city'] if pk in data.cities_by_pk},
+    }
@@ -1,3 +1,124 @@
+from unittest import mock
+
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from hittalaget.core.testing import make_player, make_user
+from hittalaget.users.models import City
+from . import search
+from .models import Player, Position
+
+
+# --------------------------------- #
+# ------------- SEARCH ------------ #
+# --------------------------------- #
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        self.back = Position.objects.create(sport="fotboll", name="back")
+        self.forward = Position.objects.create(sport="fotboll", name="forward")
+        self.stockholm = City.objects.create(name="Stockholm")
+        self.goteborg = City.objects.create(name="Göteborg")
+        year = timezone.now().year
+        for i in range(12):
+            user = make_user(
+                "spelare{}".format(i),
+                city=self.stockholm if i % 2 else self.goteborg,
+                height=170 + i,
+                birthday=timezone.now().replace(year=year - 18 - i),
+            )
+            make_player(
+                user,
+                positions=[self.back if i < 6 else self.forward],
+                side="höger" if i % 3 else "vänster",
+                is_available=i != 11,
+            )
+        self.scout = make_user("scout")
+        self.client.force_login(self.scout)
+        self.url = reverse("player:list", kwargs={"sport": "fotboll"})
+
+        ''' The snapshots are built by the tests themselves. '''
+        patcher = mock.patch.object(search, 'run_in_background')
+        self.run_in_background = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(search._indexes.clear)
+
+    def get_usernames(self, params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(player.username for player in response.context['object_list'])
+
+    def get_facets(self, params):
+        response = self.client.get(self.url, params)
+        return {
+            facet['label']: {choice['label']: choice['count'] for choice in facet['choices']}
+            for facet in response.context['facets']
+        }
+
+    def test_filters(self):
+        self.assertEqual(
+            self.get_usernames({"position": self.back.pk, "city": self.stockholm.pk}),
+            ["spelare1", "spelare3", "spelare5"],
+        )
+        self.assertEqual(self.get_usernames({"max_age": 20, "min_height": 171}), ["spelare1", "spelare2"])
+        self.assertEqual(self.get_usernames({"side": "vänster"}), ["spelare0", "spelare3", "spelare6", "spelare9"])
+
+    def test_unavailable_players_are_not_found(self):
+        self.assertNotIn("spelare11", self.get_usernames({"position": self.forward.pk}))
+
+    def test_invalid_filter_lists_every_player(self):
+        self.assertEqual(len(self.get_usernames({"side": "okänd"})), 11)
+
+    def test_no_counts_without_filters(self):
+        self.assertNotIn('facets', self.client.get(self.url).context)
+
+    def test_counts(self):
+        search.get_facet_index("fotboll").build()
+        facets = self.get_facets({"position": self.back.pk, "city": self.stockholm.pk})
+
+        ''' The counts of a facet leave out its own filter. '''
+        self.assertEqual(facets['Stad'], {"Stockholm": 3, "Göteborg": 3})
+        self.assertEqual(facets['Position'], {"back": 3, "forward": 2})
+        self.run_in_background.assert_not_called()
+
+    def test_counts_agree_with_the_results(self):
+        index = search.FacetIndex("fotboll")
+        index.build()
+        players = Player.objects.filter(sport="fotboll", is_available=True)
+        for data in [{"min_age": 20, "max_height": 178}, {"max_age": 25}, {"side": "höger", "min_height": 175}]:
+            counts = index.counts(data)
+            self.assertEqual(sum(counts['experience'].values()), search.filter_players(players, data).count(), data)
+
+    def test_search_does_not_wait_for_the_first_build(self):
+        response = self.client.get(self.url, {"position": self.back.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context['facets'])
+        self.assertEqual(len(response.context['object_list']), 6)
+        self.run_in_background.assert_called_once()
+
+        ''' A build that is running is not started again. '''
+        self.client.get(self.url, {"position": self.back.pk})
+        self.run_in_background.assert_called_once()
+
+
+class UserProfileTests(TestCase):
+
+    def setUp(self):
+        self.user = make_user("kalle", height=180)
+        self.player = make_player(self.user)
+
+    def test_user_fields_are_copied_to_the_player(self):
+        goteborg = City.objects.create(name="Göteborg")
+        self.user.city = goteborg
+        self.user.height = 190
+        self.user.save()
+        self.player.refresh_from_db()
+        self.assertEqual((self.player.city, self.player.height), (goteborg, 190))
 
-# Create your tests here.
+    def test_login_does_not_update_the_players(self):
+        self.user.last_login = timezone.now()
+        with self.assertNumQueries(1):
+            self.user.save(update_fields=['last_login'])
@@ -12,6 +12,7 @@ urlpatterns = [
     path('<str:sport>/ny/', views.PlayerCreateView.as_view(), name="create"),
     path('<str:sport>/uppdatera/', views.PlayerUpdateView.as_view(), name="update"),
     path('<str:sport>/ta-bort/', views.PlayerDeleteView.as_view(), name="delete"),
+    path('<str:sport>/annonser-for-dig/', views.PlayerAdFeedView.as_view(), name="ad_feed"),
     path('<str:sport>/uppdatera-status/', views.PlayerUpdateStatusView.as_view(), name="update_status"),
     path('<str:sport>/historik/ny/', views.HistoryCreateView.as_view(), name="create_history"),
     path('<str:sport>/historik/<int:id>/ta-bort/', views.HistoryDeleteView.as_view(), name="delete_history"),
@@ -15,9 +15,12 @@ from django.views.generic import (
     FormView,
 )
 from .models import Player, History
-from .forms import SportForm, PlayerForm, HistoryForm
-
-VALID_SPORTS = ["fotboll"]
+from .forms import SportForm, PlayerForm, PlayerSearchForm, HistoryForm
+from .search import FACETS, facet_counts, facet_labels, filter_players
+from hittalaget.core.object_cache import get_cached_object
+from hittalaget.core.page_cache import AnonymousPageCacheMixin
+from hittalaget.core.reference import is_sport
+from hittalaget.core.pagination import KeysetPaginationMixin
 
 
 # ---------------------------------- #
@@ -35,7 +38,7 @@ class PlayerCheckMixin:
             return redirect_to_login(request.path, reverse("user:login"))
         
         ''' Redirect if invalid sport. '''
-        if sport not in VALID_SPORTS:
+        if not is_sport(sport):
             raise Http404()
 
         ''' Redirect to <player:list> if user does not have the player profile. '''
@@ -75,23 +78,81 @@ class PlayerInitiateCreateView(FormView):
         return redirect(reverse('player:create', kwargs={"sport": sport}))
 
 
-class PlayerListView(ListView):
+class PlayerListView(AnonymousPageCacheMixin, KeysetPaginationMixin, ListView):
     template_name = "players/list.html"
+    page_cache_params = list(PlayerSearchForm.base_fields)
 
     def dispatch(self, request, *args, **kwargs):
         ''' Return 404 if sport is not supported. '''
         sport = kwargs['sport']
-        if sport in VALID_SPORTS:
+        if is_sport(sport):
             return super().dispatch(request, *args, **kwargs)
         else:
             raise Http404()
 
-    def get_queryset(self):
-        ''' Return a list of available players for the sport in question. '''
+    def get_search_form(self):
+        if not hasattr(self, 'search_form'):
+            data = self.request.GET or None
+            self.search_form = PlayerSearchForm(data, sport=self.kwargs['sport'])
+        return self.search_form
+
+    def get_search_data(self):
+        ''' Return the cleaned search filters, or None when the list is
+        not in search mode. '''
+        form = self.get_search_form()
+        if not form.is_bound or not form.is_valid():
+            return None
+        data = {k: v for k, v in form.cleaned_data.items() if v not in (None, '')}
+        return data or None
+
+    def get_base_queryset(self):
         sport = self.kwargs['sport']
-        q = Player.objects.filter(sport=sport, is_available=True)
+        return Player.objects.filter(sport=sport, is_available=True)
+
+    def get_queryset(self):
+        ''' Return a list of available players for the sport in question,
+        narrowed down by the search filters if there are any. '''
+        q = self.get_base_queryset()
+        data = self.get_search_data()
+        if data is not None:
+            q = filter_players(q, data)
         return q
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['search_form'] = self.get_search_form()
+
+        data = self.get_search_data()
+        if data is not None:
+            context['facets'] = self.get_facets(data)
+        return context
+
+    def get_facets(self, data):
+        ''' Return the facet counts as lists of choices that each link to
+        the search narrowed down by that choice, or None while there are
+        no counts yet. '''
+        sport = self.kwargs['sport']
+        counts = facet_counts(sport, data)
+        if counts is None:
+            return None
+        labels = facet_labels(counts)
+        form = self.get_search_form()
+
+        facets = []
+        for facet in FACETS:
+            choices = []
+            for value, count in sorted(counts[facet].items(), key=lambda item: -item[1]):
+                params = self.request.GET.copy()
+                params.pop(self.cursor_kwarg, None)
+                params[facet] = value
+                choices.append({
+                    "label": labels[facet].get(value, value) if facet in labels else value,
+                    "count": count,
+                    "querystring": params.urlencode(),
+                })
+            facets.append({"label": form.fields[facet].label, "choices": choices})
+        return facets
+
 
 class PlayerDetailView(DetailView):
     template_name = "players/detail.html"
@@ -101,8 +162,15 @@ class PlayerDetailView(DetailView):
         if not hasattr(self, 'object'):
             sport = self.kwargs['sport']
             username = self.kwargs['username']
-            obj = get_object_or_404(Player.objects.select_related('user'), sport=sport, username=username)
-            self.object = obj
+            self.object = get_cached_object(
+                Player.make_cache_name(sport, username),
+                lambda: get_object_or_404(
+                    Player.objects.select_related('user').prefetch_related('positions', 'history_entries'),
+                    sport=sport,
+                    username=username,
+                ),
+                lambda player: ["user:{}".format(player.user_id), "history:{}".format(player.pk), "positions"],
+            )
 
         return self.object
 
@@ -127,6 +195,15 @@ class PlayerDetailView(DetailView):
         return context
 
     
+class PlayerAdFeedView(PlayerCheckMixin, GetObjectMixin, KeysetPaginationMixin, ListView):
+    template_name = "players/ad_feed.html"
+
+    def get_queryset(self):
+        ''' Return the ads that match the player, newest match first. '''
+        player = self.get_object()
+        return player.ad_matches.select_related('ad', 'ad__team', 'ad__position')
+
+
 class PlayerCreateView(CreateView):
     template_name = "players/create.html"
     form_class = PlayerForm
@@ -140,7 +217,7 @@ class PlayerCreateView(CreateView):
             return redirect_to_login(request.path, reverse("user:login"))
 
         ''' Redirect if invalid sport. '''
-        if sport not in VALID_SPORTS:
+        if not is_sport(sport):
             raise Http404()
 
         ''' Redirect if user already has a player profile for
@@ -241,7 +318,7 @@ class HistoryCreateView(CreateView):
             return redirect_to_login(request.path, reverse("user:login"))
         
         ''' Redirect if invalid sport. '''
-        if sport not in VALID_SPORTS:
+        if not is_sport(sport):
             raise Http404()
 
         ''' Redirect to <player:list> if user does not have a player to
@@ -293,7 +370,7 @@ class HistoryDeleteView(DeleteView):
             return redirect_to_login(request.path, reverse("user:login"))
         
         ''' Redirect if invalid sport. '''
-        if sport not in VALID_SPORTS:
+        if not is_sport(sport):
             raise Http404()
 
         ''' Raise 403 if user does not have permission to delete history entry. '''
@@ -2,7 +2,7 @@ from django import forms
 from django.core.exceptions import ValidationError
 from django.http import HttpResponseRedirect, Http404, HttpResponse
 from .models import Team
-from .form_choices import football_levels
+from hittalaget.core.reference import SportForm, get_choices, get_cities, set_reference_choices
 import datetime
 import re
 
@@ -12,32 +12,16 @@ def alphanumeric_validator(str):
         raise ValidationError("Du kan bara använda alfanumeriska tecken.")
 
 
-class SportForm(forms.Form):
-
-    SPORTS = [
-        ("fotboll", "Fotboll"),
-    ]
-
-    sport = forms.CharField(
-        max_length=255,
-        label="Välj en sport",
-        widget=forms.Select(choices=SPORTS)
-    )
-    
-
 class TeamForm(forms.ModelForm):
     
     def __init__(self, *args, **kwargs):
         self.sport = kwargs.pop("sport")
         super().__init__(*args, **kwargs)
 
-        level = {
-            "fotboll": football_levels,
-        }        
-        
         ''' Potential KeyError caused by an invalid sport should be caught
         by the view before even reaching the form. '''
-        self.fields['level'].widget = forms.Select(choices=level[self.sport])
+        self.fields['level'].widget = forms.Select(choices=get_choices(self.sport, "level"))
+        set_reference_choices(self, 'city', get_cities())
     
 
     class Meta:
@@ -0,0 +1,17 @@
+# Generated by Django 3.0 on 2026-10-17 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('teams', '0002_auto_20200213_1604'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='team',
+            index=models.Index(fields=['sport', '-id'], name='teams_team_sport_456089_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.0 on 2026-10-17 18:55
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('teams', '0003_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='team',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(
+            sql="""
+                UPDATE teams_team
+                SET search_vector =
+                    setweight(to_tsvector('swedish'::regconfig, coalesce(name, '')), 'A')
+                    || setweight(to_tsvector('swedish'::regconfig, coalesce(home, '') || ' ' || coalesce(level, '')), 'B')
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='team',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='teams_team_search__4d30b9_gin'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.0 on 2026-10-17 21:00
+
+from django.db import migrations
+
+
+def forget_renditions(apps, schema_editor):
+    ''' The renditions are named after the whole name of the image now,
+    extension included, so the ones made before are not found. The pages
+    show the originals until create_image_renditions has made them again. '''
+    Team = apps.get_model('teams', 'Team')
+    Team.objects.exclude(image_renditions=[]).update(image_renditions=[])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('teams', '0005_image_renditions'),
+    ]
+
+    operations = [
+        migrations.RunPython(forget_renditions, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,15 @@
 from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.db import models
-from django.db.models.signals import pre_save 
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.urls import reverse
 from django.utils.text import slugify
+from hittalaget.core.images import connect_image_renditions
+from hittalaget.core.object_cache import bump
+from hittalaget.core.public_ids import allocate_public_id
+from hittalaget.core.search import SEARCH_CONFIG, update_search_vector
 from hittalaget.users.models import City
 
 
@@ -37,6 +44,9 @@ class Team(models.Model):
         null=True,
         default="images/teams/default.png"
     )
+    ''' The widths of the WebP renditions of the image that are done. '''
+    image_renditions = ArrayField(models.PositiveIntegerField(), default=list, blank=True, editable=False)
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         ''' A user can only have one team for each sport. '''
@@ -45,6 +55,8 @@ class Team(models.Model):
         ]
         indexes = [
             models.Index(fields=['team_id',]),
+            models.Index(fields=['sport', '-id']),
+            GinIndex(fields=['search_vector']),
         ]
     
     
@@ -58,25 +70,41 @@ class Team(models.Model):
     def __str__(self):
         return self.name
 
+    @staticmethod
+    def make_cache_name(team_id):
+        ''' The name the team is cached under in the object cache. '''
+        return "team:{}".format(team_id)
+
 
 def pre_save_six_digit_team_id(sender, instance, **kwargs):
     ''' Each Football team will have a 6 digit team_id that will be
     used in the URL to identify the team. '''
-    from random import randint
-    rand_id = randint(100000, 999999)
-
     if not instance.team_id:
-        while Team.objects.filter(team_id=rand_id).exists():
-            rand_id = randint(100000, 999999)
-        else:
-            instance.team_id = rand_id
+        instance.team_id = allocate_public_id("team")
 
 def pre_save_slugify_name(sender, instance, **kwargs):
     if not instance.slug:
         instance.slug = slugify(instance.name)
 
+TEAM_SEARCH_VECTOR = (
+    SearchVector('name', weight='A', config=SEARCH_CONFIG)
+    + SearchVector('home', 'level', weight='B', config=SEARCH_CONFIG)
+)
+
+def post_save_search_vector(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not set(update_fields) & {'name', 'home', 'level'}:
+        return
+    update_search_vector(instance, TEAM_SEARCH_VECTOR)
+
+def team_changed_bump_cache(sender, instance, **kwargs):
+    bump(Team.make_cache_name(instance.team_id))
+
 
 pre_save.connect(pre_save_six_digit_team_id, sender=Team)
 pre_save.connect(pre_save_slugify_name, sender=Team)
+post_save.connect(post_save_search_vector, sender=Team)
+post_save.connect(team_changed_bump_cache, sender=Team)
+post_delete.connect(team_changed_bump_cache, sender=Team)
+connect_image_renditions(Team)
 
 
@@ -14,9 +14,11 @@ from django.views.generic import (
 )
 from .forms import SportForm, TeamForm, TeamCreateForm
 from .models import Team
-
-
-VALID_SPORTS = ["fotboll"]
+from hittalaget.core.object_cache import get_cached_object
+from hittalaget.core.page_cache import AnonymousPageCacheMixin
+from hittalaget.core.reference import is_sport
+from hittalaget.core.pagination import KeysetPaginationMixin
+from hittalaget.core.search import TextSearchMixin
 
 
 # ---------------------------------- #
@@ -34,7 +36,7 @@ class TeamCheckMixin:
             return redirect_to_login(request.path, reverse("user:login"))
 
         ''' Redirect if invalid sport. '''
-        if sport not in VALID_SPORTS:
+        if not is_sport(sport):
             raise Http404()
 
         
@@ -88,13 +90,13 @@ class TeamInitiateCreateView(FormView):
         return redirect(reverse('team:create', kwargs={"sport": sport}))
 
 
-class TeamListView(ListView):
+class TeamListView(AnonymousPageCacheMixin, TextSearchMixin, KeysetPaginationMixin, ListView):
     template_name = "teams/list.html"
 
     def dispatch(self, request, *args, **kwargs):
         ''' Return 404 if sport is not supported. '''
         sport = kwargs['sport']
-        if sport in VALID_SPORTS:
+        if is_sport(sport):
             return super().dispatch(request, *args, **kwargs)
         else:
             raise Http404()
@@ -102,7 +104,7 @@ class TeamListView(ListView):
     def get_queryset(self):
         sport = self.kwargs['sport']
         q = Team.objects.filter(sport=sport)
-        return q
+        return self.search_queryset(q)
 
 
 class TeamDetailView(DetailView):
@@ -112,7 +114,11 @@ class TeamDetailView(DetailView):
         ''' Return team if it exist else raise 404. '''
         if not hasattr(self, 'object'):
             team_id = self.kwargs['team_id']
-            self.object = get_object_or_404(Team, team_id=team_id)
+            self.object = get_cached_object(
+                Team.make_cache_name(team_id),
+                lambda: get_object_or_404(Team.objects.select_related('user', 'city'), team_id=team_id),
+                lambda team: ["user:{}".format(team.user_id)],
+            )
         
         return self.object
 
@@ -143,7 +149,7 @@ class TeamCreateView(GetFormKwargsMixin, CreateView):
             return redirect_to_login(request.path, reverse("user:login"))
 
         ''' Redirect if invalid sport. '''
-        if sport not in VALID_SPORTS:
+        if not is_sport(sport):
             raise Http404()
 
         ''' Redirect if user already has a team for the sport in 
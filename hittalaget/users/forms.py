@@ -7,6 +7,7 @@ from django.contrib.auth.forms import (
     SetPasswordForm,
 )  
 from django.core.exceptions import ValidationError
+from hittalaget.core.reference import get_cities, set_reference_choices
 import datetime
 
 
@@ -57,6 +58,7 @@ class UserCreateForm(UserCreationForm):
         self.fields['password1'].label = "Lösenord"
         self.fields['password2'].label = "Bekräfta lösenord"
         self.fields['password2'].help_text = ""
+        set_reference_choices(self, 'city', get_cities())
 
     class Meta(MetaMixin):
         model = User
@@ -82,6 +84,10 @@ class UserCreateForm(UserCreationForm):
     
 
 class UserUpdateForm(forms.ModelForm):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        set_reference_choices(self, 'city', get_cities())
+
     class Meta(MetaMixin):
         model = User
 
@@ -1,7 +1,10 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models.signals import post_save, post_delete
 from django.urls import reverse
 import datetime
+from hittalaget.core import reference
+from hittalaget.core.object_cache import bump
 
 class City(models.Model):
   name = models.CharField(max_length=255, unique=True)
@@ -32,4 +35,16 @@ class User(AbstractUser):
     return age
 
 
+def user_changed_bump_cache(sender, instance, update_fields=None, **kwargs):
+  ''' Logging in saves last_login, which is not shown anywhere. '''
+  if update_fields is not None and set(update_fields) <= {'last_login'}:
+    return
+  bump("user:{}".format(instance.pk))
 
+def city_changed_invalidate_reference(sender, instance, **kwargs):
+  reference.invalidate()
+
+post_save.connect(user_changed_bump_cache, sender=User)
+post_delete.connect(user_changed_bump_cache, sender=User)
+post_save.connect(city_changed_invalidate_reference, sender=City)
+post_delete.connect(city_changed_invalidate_reference, sender=City)